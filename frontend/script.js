@@ -9,19 +9,30 @@ const chatContainer = document.getElementById('chat-container');
 const proxyAddress = document.getElementById('proxy-address');
 
 // Server configuration
-const serverHost = '192.168.250.200'; 
-const httpPort = 8000;  // proxy server port
-const wsPort = 8765;
+// Served by unified_server.py, files and chat share the page's own origin;
+// opened from disk, they are the separate file (8000) and chat (8765) servers
+const servedOverHttp = location.protocol === 'http:' || location.protocol === 'https:';
+const serverHost = servedOverHttp ? location.hostname : '192.168.250.200';
+const httpBase = servedOverHttp ? location.origin : `http://${serverHost}:8000`;
+const wsBase = servedOverHttp
+    ? `${location.protocol === 'https:' ? 'wss' : 'ws'}://${location.host}/ws`
+    : `ws://${serverHost}:8765`;
 
-wsUrlInput.value = `ws://${serverHost}:${wsPort}`;
-proxyAddress.textContent = `http://${serverHost}:${httpPort}`;
+wsUrlInput.value = wsBase;
+proxyAddress.textContent = httpBase;
+
+function formatSize(bytes) {
+    if (bytes < 1024) return `${bytes} B`;
+    if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(1)} KB`;
+    return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+}
 
 // --- Fetch list of files from /list endpoint ---
  async function fetchFileList() {
    try {
-       const response = await fetch(`http://${serverHost}:${httpPort}/list`);
+       const response = await fetch(`${httpBase}/list`);
        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-       const files = await response.json();
+       const { files } = await response.json();
         fileList.innerHTML = '';
         if (files.length === 0) {
             fileList.innerHTML = '<li class="text-gray-400 text-sm">No files available.</li>';
@@ -32,12 +43,12 @@ proxyAddress.textContent = `http://${serverHost}:${httpPort}`;
             li.className = 'flex items-center justify-between bg-gray-800 p-2 rounded-md text-sm';
 
            const fileNameSpan = document.createElement('span');
-          fileNameSpan.textContent = file;
+          fileNameSpan.textContent = `${file.name} (${formatSize(file.size)})`;
            fileNameSpan.className = "truncate pr-2";
             li.appendChild(fileNameSpan);
 
             const downloadLink = document.createElement('a');
-           downloadLink.href = `http://${serverHost}:${httpPort}/Files/${file}`;
+           downloadLink.href = `${httpBase}/Files/${file.name}`;
             downloadLink.textContent = 'Download';
           downloadLink.target = '_blank';
           downloadLink.className = 'bg-blue-500 hover:bg-blue-600 text-white font-bold py-1 px-3 rounded-full text-xs transition-colors no-underline flex-shrink-0';
@@ -55,7 +66,7 @@ uploadButton.addEventListener('click', async () => {
     const file = fileInput.files[0];
     if (!file) return alert("Please select a file to upload.");
     try {
-        const response = await fetch(`http://${serverHost}:${httpPort}/${file.name}`, {
+        const response = await fetch(`${httpBase}/${file.name}`, {
             method: 'PUT',
             body: file,
             headers: {'Content-Type': 'application/octet-stream'}
@@ -75,6 +86,14 @@ uploadButton.addEventListener('click', async () => {
 
 // --- WebSocket Chat ---
 let socket = null;
+let streamingNode = null; // <pre> of the reply currently being streamed
+
+// Sent with every message so the server keeps our chat history across reconnects
+let sessionId = localStorage.getItem('chatSession');
+if (!sessionId) {
+    sessionId = crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    localStorage.setItem('chatSession', sessionId);
+}
 
 function connectSocket() {
     const url = wsUrlInput.value;
@@ -85,8 +104,20 @@ function connectSocket() {
     socket.onmessage = (event) => {
         try {
             const data = JSON.parse(event.data);
-            if (data.response) addMessage("Ollama", data.response);
-            else if (data.error) addMessage("Error", `${data.error}\n${data.detail || ''}`);
+            if (data.type === "queued") {
+                if (!streamingNode) streamingNode = addMessage("Ollama", "");
+                streamingNode.textContent = `Waiting in queue: position ${data.position}, about ${Math.ceil(data.eta_s)}s`;
+                streamingNode.dataset.queued = "1";
+            }
+            else if (data.type === "chunk") {
+                if (!streamingNode) streamingNode = addMessage("Ollama", "");
+                if (streamingNode.dataset.queued) { streamingNode.textContent = ""; delete streamingNode.dataset.queued; }
+                streamingNode.textContent += data.text;
+                chatContainer.scrollTop = chatContainer.scrollHeight;
+            }
+            else if (data.type === "done") streamingNode = null;
+            else if (data.response) addMessage("Ollama", data.response);
+            else if (data.error) { streamingNode = null; addMessage("Error", `${data.error}\n${data.detail || ''}`); }
             else addMessage("Unknown", event.data);
         } catch { addMessage("Raw", event.data); }
     };
@@ -110,6 +141,7 @@ function addMessage(sender, text) {
     messageElem.appendChild(textNode);
     chatContainer.appendChild(messageElem);
     chatContainer.scrollTop = chatContainer.scrollHeight;
+    return textNode;
 }
 
 function handleSend() {
@@ -119,8 +151,8 @@ function handleSend() {
     addMessage('You', message);
     if (!socket || socket.readyState !== WebSocket.OPEN) {
         connectSocket();
-        setTimeout(() => { if (socket && socket.readyState === WebSocket.OPEN) socket.send(JSON.stringify({ message, model })); }, 1000);
-    } else socket.send(JSON.stringify({ message, model }));
+        setTimeout(() => { if (socket && socket.readyState === WebSocket.OPEN) socket.send(JSON.stringify({ message, model, stream: true, session: sessionId })); }, 1000);
+    } else socket.send(JSON.stringify({ message, model, stream: true, session: sessionId }));
     promptInput.value = '';
 }
 
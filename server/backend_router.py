@@ -0,0 +1,136 @@
+import asyncio
+import contextlib
+import time
+from ollama_client import OllamaClient, OllamaError
+
+PROBE_INTERVAL = 5  # seconds between health/model probes of every backend
+PROBE_TIMEOUT = 2  # seconds a probe may take before the backend counts as down
+# Generations a backend with the model loaded takes before the rest share the load
+WARM_LIMIT = 2
+
+
+class Backend:
+    def __init__(self, url: str):
+        self.url = url
+        self.client = OllamaClient(url)
+        self.healthy = True
+        self.models = set()  # models Ollama reports as loaded (in memory)
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        self.checked_at = 0.0
+
+    @property
+    def load(self) -> int:
+        return self.client.in_flight
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.load,
+            "models": sorted(self.models),
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+def is_backend_failure(error: Exception) -> bool:
+    # Unreachable, timed out, cut off or a server-side error; a 4xx (e.g. an
+    # unknown model) would fail the same way on every backend
+    if isinstance(error, OllamaError):
+        return error.status is None or error.status >= 500
+    return isinstance(error, (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError))
+
+
+class BackendRouter:
+    """Spreads generations over several Ollama servers.
+
+    Each generation goes to the least-loaded healthy backend, preferring
+    those that already have the model loaded, since loading one can take
+    many seconds, as long as they have fewer than warm_limit generations
+    in flight; past that a cold backend is worth its load time. A backend that fails is ejected and retried by the
+    background probe loop (GET /api/ps), which also keeps the loaded-model
+    sets current. A generation that fails before producing anything moves
+    on to the next backend.
+    """
+
+    def __init__(self, urls, warm_limit: int = WARM_LIMIT):
+        self.backends = [Backend(url) for url in urls]
+        self.warm_limit = warm_limit
+        self.probe_task = None
+
+    def pick(self, model: str, exclude=()):
+        candidates = [b for b in self.backends if b not in exclude]
+        healthy = [b for b in candidates if b.healthy]
+        # With everything marked down, trying one beats failing outright
+        pool = healthy or candidates
+        # A busy warm backend would otherwise take every generation
+        warm = [b for b in pool if model in b.models and b.load < self.warm_limit]
+        pool = warm or pool
+        if not pool:
+            return None
+        return min(pool, key=lambda b: (b.load, b.requests))
+
+    def eject(self, backend: Backend, error: Exception):
+        backend.failures += 1
+        backend.last_error = str(error) or type(error).__name__
+        if backend.healthy:
+            backend.healthy = False
+            print(f"[ROUTER] Ejecting {backend.url}: {backend.last_error}")
+
+    async def generate(self, payload: dict, timeout: float = None):
+        """Yield the chunks of a streamed generation from the best backend."""
+        self.start()
+        model = payload.get("model")
+        tried = set()
+        while True:
+            backend = self.pick(model, tried)
+            if backend is None:
+                raise OllamaError("no Ollama backend available")
+            tried.add(backend)
+            backend.requests += 1
+            produced = False
+            try:
+                async with contextlib.aclosing(backend.client.generate(payload, timeout=timeout)) as chunks:
+                    async for chunk in chunks:
+                        produced = True
+                        yield chunk
+            except Exception as e:
+                if not is_backend_failure(e):
+                    raise
+                self.eject(backend, e)
+                if produced:
+                    # Part of the reply is already out; can't restart it elsewhere
+                    raise
+                print(f"[ROUTER] Retrying {model} on another backend")
+                continue
+            # Ollama keeps a model loaded for a while after using it
+            backend.models.add(model)
+            return
+
+    async def probe(self, backend: Backend):
+        try:
+            ps = await backend.client.get_json("/api/ps", timeout=PROBE_TIMEOUT)
+        except Exception as e:
+            if is_backend_failure(e):
+                self.eject(backend, e)
+            return
+        backend.models = {m.get("name") or m.get("model") for m in (ps or {}).get("models", [])}
+        backend.checked_at = time.monotonic()
+        if not backend.healthy:
+            backend.healthy = True
+            print(f"[ROUTER] {backend.url} is back")
+
+    async def probe_loop(self):
+        while True:
+            await asyncio.gather(*(self.probe(b) for b in self.backends))
+            await asyncio.sleep(PROBE_INTERVAL)
+
+    def start(self):
+        if self.probe_task is None:
+            self.probe_task = asyncio.ensure_future(self.probe_loop())
+
+    def stats(self) -> list:
+        return [b.stats() for b in self.backends]
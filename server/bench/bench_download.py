@@ -0,0 +1,126 @@
+"""Download benchmark: the old read()+sendall path against sendfile().
+
+    python bench/bench_download.py --size-mb 256 --rounds 5
+
+Each mode runs in its own subprocess so peak RSS is measured per mode. The
+server side sends over loopback TCP to a client thread that drains into a
+fixed buffer, so the client adds no per-download memory of its own.
+"""
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("legacy", "sendfile")
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def legacy_send_file(client_socket, filepath, filename):
+    # The previous implementation: whole file in memory, then copied again onto the header
+    with open(filepath, "rb") as f:
+        file_data = f.read()
+    header = (
+        "HTTP/1.1 200 OK\r\n"
+        "Content-Type: application/octet-stream\r\n"
+        f"Content-Disposition: attachment; filename=\"{filename}\"\r\n"
+        f"Content-Length: {len(file_data)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    client_socket.sendall(header.encode() + file_data)
+
+
+def drain(sock):
+    buf = bytearray(1 << 20)
+    view = memoryview(buf)
+    while sock.recv_into(view):
+        pass
+    sock.close()
+
+
+def run_worker(mode, filepath, rounds):
+    # http_handler creates ./Files on import; keep that out of the caller's cwd
+    os.chdir(tempfile.mkdtemp(prefix="bench-download-"))
+    sys.path.insert(0, SERVER_DIR)
+    import http_handler
+
+    listener = socket.create_server(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    size = os.path.getsize(filepath)
+    filename = os.path.basename(filepath)
+    baseline_rss = peak_rss_mb()
+
+    elapsed = 0.0
+    for _ in range(rounds):
+        client = socket.create_connection(("127.0.0.1", port))
+        reader = threading.Thread(target=drain, args=(client,))
+        reader.start()
+        conn, _ = listener.accept()
+        start = time.perf_counter()
+        if mode == "legacy":
+            legacy_send_file(conn, filepath, filename)
+        else:
+            http_handler.send_file_response(conn, filepath, filename)
+        conn.close()
+        reader.join()
+        elapsed += time.perf_counter() - start
+
+    listener.close()
+    return {
+        "mode": mode,
+        "size_mb": round(size / (1 << 20), 1),
+        "rounds": rounds,
+        "mb_per_s": round(size * rounds / (1 << 20) / elapsed, 1),
+        "baseline_rss_mb": round(baseline_rss, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.file, args.rounds)))
+        return
+
+    with tempfile.NamedTemporaryFile(prefix="bench-", suffix=".bin") as f:
+        chunk = os.urandom(1 << 20)
+        for _ in range(args.size_mb):
+            f.write(chunk)
+        f.flush()
+
+        results = []
+        for mode in MODES:
+            out = subprocess.run(
+                [sys.executable, __file__, "--worker", mode, "--file", f.name, "--rounds", str(args.rounds)],
+                check=True, capture_output=True, text=True,
+            )
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{'mode':<10}{'MB/s':>10}{'base RSS MB':>14}{'peak RSS MB':>14}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['mb_per_s']:>10}{r['baseline_rss_mb']:>14}{r['peak_rss_mb']:>14}")
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Ollama client benchmark: pooled asyncio client against the old requests path.
+
+    python bench/bench_ollama.py --concurrency 64 --requests 256
+
+Starts bench/stub_ollama.py in a subprocess and runs the same load through
+each mode:
+
+    pooled   OllamaClient, keep-alive connections reused across requests
+    fresh    OllamaClient with pooling off (a new connection per request)
+    threads  requests.post in asyncio.to_thread, as call_ollama used to
+             (skipped when requests isn't installed)
+
+Reports requests/s, time to first token and how many TCP connections the
+stub accepted.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+from ollama_client import OllamaClient  # noqa: E402
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+
+async def stub_stats(client):
+    async with contextlib.aclosing(client.stream("/stats", {})) as lines:
+        async for line in lines:
+            return line
+
+
+def threads_generate(url, payload):
+    # The previous call_ollama: one blocking request, and connection, per generation
+    def sync_request(on_first):
+        with requests.post(url, json=payload, stream=True, timeout=300) as r:
+            r.raise_for_status()
+            for line in r.iter_lines(decode_unicode=True):
+                if line:
+                    on_first()
+                    json.loads(line)
+
+    async def run():
+        first = []
+        started = time.perf_counter()
+        await asyncio.to_thread(sync_request, lambda: first or first.append(time.perf_counter()))
+        return first[0] - started
+
+    return run()
+
+
+async def client_generate(client, payload):
+    started = time.perf_counter()
+    ttft = None
+    async with contextlib.aclosing(client.generate(payload)) as chunks:
+        async for _ in chunks:
+            if ttft is None:
+                ttft = time.perf_counter() - started
+    return ttft
+
+
+async def run_mode(mode, url, concurrency, total, tokens):
+    control = OllamaClient(url)
+    before = (await stub_stats(control))["connections"]
+    client = OllamaClient(url, max_idle=0 if mode == "fresh" else concurrency)
+    payload = {"model": "llama3:8b", "prompt": "bench prompt text", "stream": True, "options": {"num_predict": tokens}}
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    ttfts = []
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            if mode == "threads":
+                ttfts.append(await threads_generate(url + "/api/generate", payload))
+            else:
+                ttfts.append(await client_generate(client, payload))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await client.close()
+    after = (await stub_stats(control))["connections"]
+    await control.close()
+
+    ttfts.sort()
+    return {
+        "mode": mode,
+        "requests": total,
+        "concurrency": concurrency,
+        "req_per_s": round(total / elapsed, 1),
+        "ttft_p50_ms": round(statistics.median(ttfts) * 1000, 1),
+        "ttft_p95_ms": round(ttfts[int(len(ttfts) * 0.95) - 1] * 1000, 1),
+        # Minus the one the control client opened for /stats
+        "connections": after - before - 1,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--token-delay", type=float, default=0.001)
+    parser.add_argument("--port", type=int, default=11499)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(SERVER_DIR, "bench", "stub_ollama.py"), "--port", str(args.port),
+         "--ttft", "0", "--token-delay", str(args.token_delay)],
+        stdout=subprocess.PIPE,
+    )
+    try:
+        stub.stdout.readline()  # wait for "listening"
+        url = f"http://127.0.0.1:{args.port}"
+        modes = ["pooled", "fresh"] + (["threads"] if requests is not None else [])
+        if requests is None:
+            print("[BENCH] requests not installed, skipping the threads mode")
+
+        results = []
+        print(f"{'mode':<10}{'req/s':>10}{'ttft p50 ms':>14}{'ttft p95 ms':>14}{'connections':>13}")
+        for mode in modes:
+            r = asyncio.run(run_mode(mode, url, args.concurrency, args.requests, args.tokens))
+            results.append(r)
+            print(f"{mode:<10}{r['req_per_s']:>10}{r['ttft_p50_ms']:>14}{r['ttft_p95_ms']:>14}{r['connections']:>13}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
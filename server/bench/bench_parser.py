@@ -0,0 +1,70 @@
+"""Request parser benchmark: parse_http_request against HttpRequestParser.
+
+    python bench/bench_parser.py
+
+That both parsers read every request the same way is checked by the
+differential fuzz in tests/test_proxy_parse.py.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from proxy_parse import HttpRequestParser, parse_http_request  # noqa: E402
+
+
+def bench_case(raw, seconds):
+    results = {}
+
+    def legacy():
+        parse_http_request(raw)
+
+    buf = bytearray(raw)
+
+    def incremental():
+        HttpRequestParser().parse(buf)
+
+    for name, fn in (("legacy", legacy), ("incremental", incremental)):
+        n = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            for _ in range(100):
+                fn()
+            n += 100
+        results[name] = n / (time.perf_counter() - start)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=1.0, help="time per benchmark case")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    head = (
+        "PUT /Files/report.pdf HTTP/1.1\r\nHost: 192.168.1.10:8000\r\nUser-Agent: bench\r\n"
+        "Accept: */*\r\nContent-Type: application/octet-stream\r\nConnection: keep-alive\r\n"
+    )
+    cases = {
+        "GET, no body": b"GET /list HTTP/1.1\r\nHost: 192.168.1.10:8000\r\nAccept: */*\r\n\r\n",
+        "PUT, 64 KiB body": (head + "Content-Length: 65536\r\n\r\n").encode() + os.urandom(65536),
+        "PUT, 1 MiB body": (head + "Content-Length: 1048576\r\n\r\n").encode() + os.urandom(1 << 20),
+    }
+
+    results = []
+    print(f"{'case':<20}{'legacy req/s':>15}{'incremental req/s':>20}{'speedup':>10}")
+    for name, raw in cases.items():
+        r = bench_case(raw, args.seconds)
+        speedup = r["incremental"] / r["legacy"]
+        results.append({"case": name, "legacy_per_s": round(r["legacy"]), "incremental_per_s": round(r["incremental"])})
+        print(f"{name:<20}{r['legacy']:>15.0f}{r['incremental']:>20.0f}{speedup:>9.1f}x")
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
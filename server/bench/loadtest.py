@@ -0,0 +1,333 @@
+"""Load test: the file server and the chat server under a mix of concurrent clients.
+
+    python bench/loadtest.py --clients 16 --duration 10 --mix list=4,download=4,upload=1,chat=1 --json run.json
+
+Starts everything in this process: the file server (main.start_server, or
+the event-loop server with --server event), the chat server
+(websocket_server.start_ws_server_forever), or both on one port with
+--server unified (unified_server.py), and bench/stub_ollama.py in
+place of Ollama, so results don't depend on a GPU or the network. Each
+client is a thread with its own keep-alive HTTP connection and WebSocket
+that picks operations by weight from --mix; choices are seeded (--seed), so
+two runs issue the same operations in the same order per client.
+
+Reports throughput, errors and p50/p95/p99 latency per operation, chat
+time-to-first-token, and peak RSS. Peak RSS covers the whole process,
+clients included. --json writes the same report for diffing between
+commits. Server logs go to --log (discarded by default).
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCH_DIR)
+OPERATIONS = ("list", "download", "upload", "chat")
+DOWNLOAD_FILES = 16  # files created up front for downloads to pick from
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, path=None, timeout=10.0):
+    # With a path, wait for an HTTP answer; a bare connect would look like a
+    # failed handshake to the WebSocket server
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if path is None:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            else:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=0.5)
+                conn.request("GET", path)
+                conn.getresponse().read()
+                conn.close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    # Nearest rank on sorted values
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(seconds):
+    seconds = sorted(seconds)
+    return {
+        f"p{p}_ms": round(percentile(seconds, p) * 1000, 2) if seconds else None
+        for p in (50, 95, 99)
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+# ---- servers ----
+def start_stub(args, port):
+    sys.path.insert(0, BENCH_DIR)
+    import stub_ollama
+
+    stub_args = SimpleNamespace(
+        host="127.0.0.1", port=port, tokens=args.tokens, ttft=args.ttft, token_delay=args.token_delay,
+        models=[args.model], max_loaded=1, swap_delay=0.0,
+    )
+    stub_ollama.loaded.append(args.model)
+    threading.Thread(target=lambda: asyncio.run(stub_ollama.serve(stub_args)), daemon=True).start()
+    wait_for_port(port)
+
+
+def start_servers(args, workdir):
+    ollama_port, file_port, ws_port = free_port(), free_port(), free_port()
+    start_stub(args, ollama_port)
+
+    # Read at import time, so set before the server modules are loaded
+    os.environ["OLLAMA_BACKENDS"] = f"http://127.0.0.1:{ollama_port}"
+    os.environ["OLLAMA_CONCURRENCY"] = str(args.ollama_concurrency)
+    # The chat server asks for this many tokens per reply, and the stub obeys
+    os.environ["OLLAMA_NUM_PREDICT"] = str(args.tokens)
+    os.environ["CHAT_HISTORY_DB"] = os.path.join(workdir, "chat_history.db")
+    os.chdir(workdir)  # http_handler serves ./Files
+    sys.path.insert(0, SERVER_DIR)
+    import main
+    import http_handler
+
+    if args.server == "unified":
+        from unified_server import start_unified_server
+        target = lambda: start_unified_server("127.0.0.1", file_port)
+        ws_port = file_port
+    elif args.server == "event":
+        from event_server import start_event_server
+        target = lambda: start_event_server("127.0.0.1", file_port)
+    else:
+        target = lambda: main.start_server("127.0.0.1", file_port)
+    threading.Thread(target=target, daemon=True).start()
+    wait_for_port(file_port)
+
+    if "chat" in args.mix and args.server != "unified":
+        import websocket_server
+        threading.Thread(target=websocket_server.start_ws_server_forever, args=("127.0.0.1", ws_port), daemon=True).start()
+        wait_for_port(ws_port, "/metrics")
+
+    payload = random.Random(args.seed).randbytes(args.file_size)
+    for i in range(DOWNLOAD_FILES):
+        with open(os.path.join(http_handler.FILES_DIR, f"bench-{i}.bin"), "wb") as f:
+            f.write(payload)
+    return file_port, ws_port
+
+
+# ---- clients ----
+class Client:
+    def __init__(self, index, args, file_port, ws_port, results):
+        self.index = index
+        self.args = args
+        self.file_port = file_port
+        self.ws_port = ws_port
+        self.results = results
+        self.random = random.Random(f"{args.seed}:{index}")
+        self.http = None
+        self.ws = None
+        self.uploads = 0
+        self.body = self.random.randbytes(args.file_size)
+
+    def request(self, method, path, body=None):
+        if self.http is None:
+            self.http = http.client.HTTPConnection("127.0.0.1", self.file_port, timeout=30)
+        try:
+            self.http.request(method, path, body=body)
+            response = self.http.getresponse()
+            response.read()
+        except Exception:
+            # Drop the connection so the next request starts clean
+            self.http.close()
+            self.http = None
+            raise
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path} -> {response.status}")
+
+    def op_list(self):
+        self.request("GET", "/list?limit=50")
+
+    def op_download(self):
+        self.request("GET", f"/Files/bench-{self.random.randrange(DOWNLOAD_FILES)}.bin")
+
+    def op_upload(self):
+        self.uploads += 1
+        self.request("PUT", f"/Files/upload-{self.index}-{self.uploads % 8}.bin", self.body)
+
+    def op_chat(self):
+        from websockets.sync.client import connect
+
+        if self.ws is None:
+            self.ws = connect(f"ws://127.0.0.1:{self.ws_port}", open_timeout=30)
+        words = " ".join(self.random.choice(("file", "share", "model", "cache", "proxy", "token")) for _ in range(6))
+        started = time.perf_counter()
+        self.ws.send(json.dumps({"message": f"{self.index} {words}", "stream": True, "cache": self.args.chat_cache}))
+        first = None
+        while True:
+            frame = json.loads(self.ws.recv(timeout=300))
+            if frame.get("type") == "chunk" and first is None:
+                first = time.perf_counter()
+                self.results["ttft"].append(first - started)
+            elif frame.get("type") == "done":
+                return
+            elif "error" in frame:
+                raise RuntimeError(frame["error"])
+
+    def run(self, mix, deadline, count):
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        done = 0
+        while time.perf_counter() < deadline and (count is None or done < count):
+            name = self.random.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                getattr(self, f"op_{name}")()
+                self.results[name].append(time.perf_counter() - started)
+            except Exception as e:
+                self.results["errors"].append((name, str(e)))
+                if name == "chat" and self.ws is not None:
+                    self.ws.close()
+                    self.ws = None
+            done += 1
+        if self.http is not None:
+            self.http.close()
+        if self.ws is not None:
+            self.ws.close()
+
+
+def run_load(args, file_port, ws_port):
+    # list.append is atomic, so clients share these lists without a lock
+    results = {name: [] for name in OPERATIONS}
+    results["ttft"] = []
+    results["errors"] = []
+    clients = [Client(i, args, file_port, ws_port, results) for i in range(args.clients)]
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=c.run, args=(args.mix, deadline, args.requests)) for c in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - started
+
+
+def report(args, results, elapsed, rss_before):
+    operations = {}
+    for name in args.mix:
+        samples = results[name]
+        errors = sum(1 for op, _ in results["errors"] if op == name)
+        operations[name] = {"count": len(samples), "errors": errors, "per_s": round(len(samples) / elapsed, 2)}
+        operations[name].update(summarize(samples))
+    total = sum(len(results[name]) for name in args.mix)
+    config = {k: v for k, v in vars(args).items() if k not in ("json", "log")}
+    return {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "config": config,
+        "elapsed_s": round(elapsed, 3),
+        "total": {"count": total, "errors": len(results["errors"]), "per_s": round(total / elapsed, 2)},
+        "operations": operations,
+        "chat_ttft": summarize(results["ttft"]) if "chat" in args.mix else None,
+        "rss_mb_at_start": round(rss_before, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "first_errors": sorted({f"{op}: {error}" for op, error in results["errors"]})[:10],
+    }
+
+
+def print_report(result):
+    print(f"{'operation':<10} {'count':>7} {'errors':>7} {'per_s':>9} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    for name, op in result["operations"].items():
+        print(f"{name:<10} {op['count']:>7} {op['errors']:>7} {op['per_s']:>9} "
+              f"{op['p50_ms']!s:>9} {op['p95_ms']!s:>9} {op['p99_ms']!s:>9}")
+    if result["chat_ttft"]:
+        ttft = result["chat_ttft"]
+        print(f"chat ttft  p50 {ttft['p50_ms']} ms  p95 {ttft['p95_ms']} ms  p99 {ttft['p99_ms']} ms")
+    print(f"total {result['total']['count']} ops, {result['total']['per_s']}/s, "
+          f"{result['total']['errors']} errors, peak RSS {result['peak_rss_mb']} MB")
+    for error in result["first_errors"]:
+        print(f"  error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=None, help="stop each client after this many operations")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("list=4,download=4,upload=1,chat=1"),
+                        help="operation weights, e.g. list=4,download=4,upload=1,chat=1")
+    parser.add_argument("--server", choices=("threaded", "event", "unified"), default="threaded", help="file server to test")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="bytes per uploaded/downloaded file")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--model", default="llama3:8b")
+    parser.add_argument("--tokens", type=int, default=32, help="tokens per reply (OLLAMA_NUM_PREDICT)")
+    parser.add_argument("--ttft", type=float, default=0.05, help="stub seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="stub seconds between tokens")
+    parser.add_argument("--ollama-concurrency", type=int, default=2, help="generations at once (OLLAMA_CONCURRENCY)")
+    parser.add_argument("--chat-cache", action="store_true", help="let repeated prompts hit the reply cache")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--log", default=os.devnull, help="file for the servers' log output")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    rss_before = peak_rss_mb()
+    stdout = sys.stdout
+    with tempfile.TemporaryDirectory() as workdir, open(args.log, "w") as log:
+        # The servers log every request; keep that out of the report
+        sys.stdout = log
+        try:
+            file_port, ws_port = start_servers(args, workdir)
+            results, elapsed = run_load(args, file_port, ws_port)
+        finally:
+            sys.stdout = stdout
+        result = report(args, results, elapsed, rss_before)
+        os.chdir(SERVER_DIR)
+
+    print_report(result)
+    if json_path:
+        with open(json_path, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
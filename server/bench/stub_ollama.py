@@ -0,0 +1,157 @@
+"""Stand-in for an Ollama server, for tests and benchmarks without a GPU.
+
+    python bench/stub_ollama.py --port 11434 --tokens 50 --token-delay 0.01
+
+Implements POST /api/generate and /api/chat with streamed NDJSON replies
+(chunked, keep-alive), GET /api/tags and GET /api/ps. Replies are
+deterministic for a given prompt. GET /stats reports how many connections
+and requests were served, so benchmarks can check connection reuse.
+
+Model loading is simulated: at most --max-loaded models are resident, and
+asking for another one first waits --swap-delay seconds, evicting the least
+recently used. Several stubs on different ports stand in for a cluster.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+stats = {"connections": 0, "requests": 0, "active": 0, "swaps": 0}
+loaded = []  # resident models, least recently used first
+swap_lock = asyncio.Lock()
+
+
+def chunk(data: bytes) -> bytes:
+    return f"{len(data):x}\r\n".encode() + data + b"\r\n"
+
+
+def reply_tokens(prompt: str, count: int):
+    words = prompt.split() or ["ok"]
+    return [f"{words[i % len(words)]} " for i in range(count)]
+
+
+async def send_json(writer, status, body):
+    data = json.dumps(body).encode()
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data
+    )
+    await writer.drain()
+
+
+async def load_model(model, args):
+    async with swap_lock:
+        if model in loaded:
+            loaded.remove(model)
+        else:
+            stats["swaps"] += 1
+            await asyncio.sleep(args.swap_delay)
+            while len(loaded) >= args.max_loaded:
+                loaded.pop(0)
+        loaded.append(model)
+
+
+async def generate(writer, request, args):
+    model = request.get("model", "stub")
+    await load_model(model, args)
+    if request.get("messages"):
+        prompt = request["messages"][-1].get("content", "")
+    else:
+        prompt = request.get("prompt", "")
+    tokens = reply_tokens(prompt, request.get("options", {}).get("num_predict") or args.tokens)
+    started = time.perf_counter()
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+    await asyncio.sleep(args.ttft)
+    is_chat = "messages" in request
+    for token in tokens:
+        if is_chat:
+            line = {"model": model, "message": {"role": "assistant", "content": token}, "done": False}
+        else:
+            line = {"model": model, "response": token, "done": False}
+        writer.write(chunk(json.dumps(line).encode() + b"\n"))
+        await writer.drain()
+        if args.token_delay:
+            await asyncio.sleep(args.token_delay)
+    elapsed = time.perf_counter() - started
+    # About 4 characters a token; tokens passed back in "context" aren't evaluated again
+    prompt_tokens = len(prompt) // 4 + 1
+    final = {
+        "model": model,
+        "done": True,
+        "prompt_eval_count": prompt_tokens,
+        "eval_count": len(tokens),
+        "eval_duration": int(elapsed * 1e9),
+        "total_duration": int(elapsed * 1e9),
+        # Conversation state as token ids, as Ollama returns for /api/generate
+        "context": list(request.get("context") or []) + [0] * prompt_tokens + [1] * len(tokens),
+    }
+    if is_chat:
+        final["message"] = {"role": "assistant", "content": ""}
+    else:
+        final["response"] = ""
+    writer.write(chunk(json.dumps(final).encode() + b"\n") + chunk(b""))
+    await writer.drain()
+
+
+async def handle(reader, writer, args):
+    stats["connections"] += 1
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("iso-8859-1").split("\r\n")
+            method, path = lines[0].split(" ")[:2]
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            stats["requests"] += 1
+            stats["active"] += 1
+            try:
+                if method == "POST" and path in ("/api/generate", "/api/chat"):
+                    await generate(writer, json.loads(body or b"{}"), args)
+                elif path == "/api/tags":
+                    await send_json(writer, "200 OK", {"models": [{"name": m} for m in args.models]})
+                elif path == "/api/ps":
+                    await send_json(writer, "200 OK", {"models": [{"name": m, "model": m} for m in loaded]})
+                elif path == "/stats":
+                    await send_json(writer, "200 OK", stats)
+                else:
+                    await send_json(writer, "404 Not Found", {"error": "not found"})
+            finally:
+                stats["active"] -= 1
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(args):
+    server = await asyncio.start_server(lambda r, w: handle(r, w, args), args.host, args.port)
+    print(f"[STUB] Ollama stub listening on {args.host}:{args.port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens", type=int, default=50, help="tokens per reply")
+    parser.add_argument("--ttft", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between tokens")
+    parser.add_argument("--models", nargs="*", default=["llama3:8b"], help="models reported by /api/tags")
+    parser.add_argument("--loaded", nargs="*", default=None, help="models resident at start (default: first of --models)")
+    parser.add_argument("--max-loaded", type=int, default=1, help="models that fit in memory at once")
+    parser.add_argument("--swap-delay", type=float, default=0.0, help="seconds to load a model that isn't resident")
+    args = parser.parse_args()
+    loaded.extend((args.models[:1] if args.loaded is None else args.loaded)[-args.max_loaded:])
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
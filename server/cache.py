@@ -1,115 +1,191 @@
 import time
 import threading
+from collections import OrderedDict
 
 # Constants (equivalent to C macros)
 MAX_CACHE_SIZE = 200 * (1 << 20)        # 200 MB
 MAX_ELEMENT_SIZE = 10 * (1 << 20)       # 10 MB
+CACHE_SHARDS = 8                        # independent LRU lists, each with its own lock
 
 
 class CacheElement:
-    def __init__(self, data: bytes, url: str):
+    def __init__(self, data: bytes, url: str, ttl: float = None):
         self.data = data
         self.len = len(data)
         self.url = url
         self.lru_time_track = time.time()
+        # Entries with a ttl are treated as missing once it runs out
+        self.expires_at = time.monotonic() + ttl if ttl else None
 
+    @property
+    def size(self) -> int:
+        return self.len + len(self.url) + 1
 
-class Cache:
-    def __init__(self):
-        self.cache_size = 0
-        self.elements = {}  # Use dict for O(1) access by URL
-        self.lock = threading.Lock()
 
-    def cache_find(self, url: str):
-        if not url:
-            return None
+class CacheShard:
+    """One LRU list: an OrderedDict kept in recency order (oldest first).
 
-        with self.lock:
-            element = self.elements.get(url)
-            if element:
-                element.lru_time_track = time.time()
-                print(f"[CACHE] Found URL: {url}, updated LRU time")
-                return element
+    Lookup, touch (move_to_end) and eviction (popitem(last=False)) are all O(1).
+    """
 
-            print(f"[CACHE] URL not found in cache: {url}")
-            return None
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.elements = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes_served = 0
+        self.bytes_evicted = 0
+
+    def evict_oldest(self):
+        # Caller holds self.lock
+        _, lru = self.elements.popitem(last=False)
+        self.size -= lru.size
+        self.evictions += 1
+        self.bytes_evicted += lru.size
+        return lru
 
-    def cache_remove(self):
-        with self.lock:
-            if not self.elements:
-                return
 
-            # Find oldest element by timestamp
-            lru_url = min(self.elements, key=lambda u: self.elements[u].lru_time_track)
-            lru = self.elements[lru_url]
+class Cache:
+    def __init__(self, max_size: int = MAX_CACHE_SIZE, shards: int = CACHE_SHARDS):
+        # Each shard gets an equal slice of the budget, so LRU order is per shard
+        self.shards = [CacheShard(max_size // shards) for _ in range(shards)]
+        # An element must fit in its shard: a bigger one would evict everything
+        # else there and still leave the shard over budget
+        self.max_element_size = min(MAX_ELEMENT_SIZE, max_size // shards)
+
+    def _shard(self, url: str) -> CacheShard:
+        return self.shards[hash(url) % len(self.shards)]
+
+    @property
+    def cache_size(self) -> int:
+        return sum(shard.size for shard in self.shards)
 
-            element_size = lru.len + len(lru.url) + 1
-            self.cache_size -= element_size
+    def cache_find(self, url: str):
+        if not url:
+            return None
 
-            print(f"[CACHE] Removing URL: {lru.url}, freed {element_size} bytes")
-            del self.elements[lru_url]
+        shard = self._shard(url)
+        with shard.lock:
+            element = shard.elements.get(url)
+            if element is not None and element.expires_at is not None and time.monotonic() >= element.expires_at:
+                del shard.elements[url]
+                shard.size -= element.size
+                shard.expirations += 1
+                element = None
+            if element is None:
+                shard.misses += 1
+                return None
+            shard.elements.move_to_end(url)
+            element.lru_time_track = time.time()
+            shard.hits += 1
+            shard.bytes_served += element.len
+            return element
 
-    def cache_add(self, data: bytes, url: str) -> bool:
+    def cache_remove(self):
+        # Evict the least recently used element across all shards: the oldest
+        # shard head wins, so this is O(number of shards)
+        oldest = None
+        for shard in self.shards:
+            with shard.lock:
+                if shard.elements:
+                    head = next(iter(shard.elements.values()))
+                    if oldest is None or head.lru_time_track < oldest[1]:
+                        oldest = (shard, head.lru_time_track)
+        if oldest is None:
+            return
+
+        shard = oldest[0]
+        with shard.lock:
+            if shard.elements:
+                lru = shard.evict_oldest()
+                print(f"[CACHE] Removing URL: {lru.url}, freed {lru.size} bytes")
+
+    def cache_add(self, data: bytes, url: str, ttl: float = None) -> bool:
         if not data or not url:
             return False
 
-        size = len(data)
-        element_size = size + len(url) + 1
-
-        if element_size > MAX_ELEMENT_SIZE:
+        element = CacheElement(data, url, ttl)
+        if element.size > self.max_element_size:
             print(f"[CACHE] Element too large, skipping: {url}")
             return False
 
-        with self.lock:
-            # If exists, update
-            if url in self.elements:
-                existing = self.elements[url]
-                existing.data = data
-                existing.len = size
-                existing.lru_time_track = time.time()
-                print(f"[CACHE] Updated existing URL: {url}")
-                return True
+        shard = self._shard(url)
+        with shard.lock:
+            # If exists, replace it and account for the size difference
+            existing = shard.elements.pop(url, None)
+            if existing is not None:
+                shard.size -= existing.size
 
             # Ensure enough space
-            while self.cache_size + element_size > MAX_CACHE_SIZE and self.elements:
-                self.cache_remove()
+            while shard.size + element.size > shard.max_size and shard.elements:
+                shard.evict_oldest()
 
-            # Add new
-            element = CacheElement(data, url)
-            self.elements[url] = element
-            self.cache_size += element_size
-
-            print(f"[CACHE] Added URL: {url}, size: {size} bytes, total: {self.cache_size}")
+            shard.elements[url] = element
+            shard.size += element.size
             return True
 
+    def cache_stats(self) -> dict:
+        stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "entries": 0,
+            "bytes_cached": 0,
+            "bytes_served": 0,
+            "bytes_evicted": 0,
+        }
+        for shard in self.shards:
+            with shard.lock:
+                stats["hits"] += shard.hits
+                stats["misses"] += shard.misses
+                stats["evictions"] += shard.evictions
+                stats["expirations"] += shard.expirations
+                stats["entries"] += len(shard.elements)
+                stats["bytes_cached"] += shard.size
+                stats["bytes_served"] += shard.bytes_served
+                stats["bytes_evicted"] += shard.bytes_evicted
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
     def cache_print(self):
-        with self.lock:
-            print("-----CACHE CONTENTS-----")
-            print(f"Total cache size: {self.cache_size} bytes")
-            for i, (url, elem) in enumerate(self.elements.items(), 1):
-                print(f"{i}. URL: {url}, Size: {elem.len}, LRU: {elem.lru_time_track}")
-            print("------------------------")
+        print("-----CACHE CONTENTS-----")
+        print(f"Total cache size: {self.cache_size} bytes")
+        i = 0
+        for shard in self.shards:
+            with shard.lock:
+                for url, elem in shard.elements.items():
+                    i += 1
+                    print(f"{i}. URL: {url}, Size: {elem.len}, LRU: {elem.lru_time_track}")
+        print("------------------------")
 
     def cache_get_size(self):
-        with self.lock:
-            return self.cache_size
+        return self.cache_size
 
     def cache_clear(self):
-        with self.lock:
-            self.elements.clear()
-            self.cache_size = 0
-            print("[CACHE] Cache cleared")
+        for shard in self.shards:
+            with shard.lock:
+                shard.elements.clear()
+                shard.size = 0
+        print("[CACHE] Cache cleared")
 
     def cache_exists(self, url: str) -> bool:
-        with self.lock:
-            return url in self.elements
+        shard = self._shard(url)
+        with shard.lock:
+            return url in shard.elements
 
     def cache_update_lru(self, url: str):
-        with self.lock:
-            if url in self.elements:
-                self.elements[url].lru_time_track = time.time()
-                print(f"[CACHE] Updated LRU for {url}")
+        shard = self._shard(url)
+        with shard.lock:
+            if url in shard.elements:
+                shard.elements.move_to_end(url)
+                shard.elements[url].lru_time_track = time.time()
 
 
-#  Singleton instance 
+#  Singleton instance
 cache = Cache()
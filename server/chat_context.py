@@ -0,0 +1,114 @@
+CHARS_PER_TOKEN = 4  # rough estimate for English text; Ollama reports the real counts
+REBUILD_FILL = 0.5  # a rebuilt prompt uses this share of the budget, leaving room to reuse context
+SUMMARY_SHARE = 0.25  # most of the budget a rolling summary may take
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class Turn:
+    def __init__(self, role: str, content: str):
+        self.role = role
+        self.content = content
+        self.tokens = estimate_tokens(self.line())
+
+    def line(self) -> str:
+        return f"{self.role}: {self.content}"
+
+
+class ChatContext:
+    """One client's chat history, kept within a prompt token budget.
+
+    While the conversation fits, only the new message is sent along with the
+    `context` array Ollama returned last turn, so earlier turns are neither
+    re-sent nor re-tokenized. Once context plus message would overflow the
+    budget, the prompt is rebuilt from the most recent turns that fit in
+    REBUILD_FILL of it (a sliding window), prefixed by a rolling summary of
+    older turns when summaries are on.
+    """
+
+    def __init__(self, budget_tokens: int, summaries: bool = False):
+        self.budget_tokens = budget_tokens
+        self.summaries = summaries
+        self.turns = []
+        self.summary = ""
+        # Turns that slid out of the window and aren't in the summary yet
+        self.unsummarized = []
+        self.context = None
+        self.model = None
+
+    def history(self):
+        return [{"role": t.role, "content": t.content} for t in self.turns]
+
+    def restore(self, summary: str, turns):
+        """Load a saved session: its summary and (role, content) turns, oldest first."""
+        self.summary = summary
+        self.turns = [Turn(role, content) for role, content in turns]
+        if self.turns:
+            self._fit_window(self.budget_tokens)
+
+    def _fit_window(self, budget: int):
+        # Keep the newest turns that fit (always the last one); older ones leave for good
+        used = estimate_tokens(self.summary) if self.summary else 0
+        keep = len(self.turns)
+        while keep > 0:
+            tokens = self.turns[keep - 1].tokens
+            if keep < len(self.turns) and used + tokens > budget:
+                break
+            used += tokens
+            keep -= 1
+        dropped, self.turns = self.turns[:keep], self.turns[keep:]
+        if self.summaries:
+            self.unsummarized.extend(dropped)
+
+    def prepare(self, message: str, model: str) -> dict:
+        """Add the user's message and return the prompt and context to send."""
+        turn = Turn("user", message)
+        self.turns.append(turn)
+        if model != self.model:
+            # Token ids from another model mean nothing to this one
+            self.context = None
+            self.model = model
+
+        if self.context is not None and len(self.context) + turn.tokens <= self.budget_tokens:
+            return {
+                "prompt": turn.line(),
+                "context": self.context,
+                "context_reused": True,
+                "prompt_tokens_est": len(self.context) + turn.tokens,
+            }
+
+        self.context = None
+        self._fit_window(int(self.budget_tokens * REBUILD_FILL))
+        lines = [f"summary: {self.summary}"] if self.summary else []
+        lines += [t.line() for t in self.turns]
+        prompt = "\n".join(lines)
+        return {
+            "prompt": prompt,
+            "context": None,
+            "context_reused": False,
+            "prompt_tokens_est": estimate_tokens(prompt),
+        }
+
+    def record_reply(self, text: str, final: dict):
+        self.turns.append(Turn("ai", text))
+        context = final.get("context")
+        # Only worth keeping while it leaves room for the next message
+        self.context = context if context and len(context) < self.budget_tokens else None
+        # Older turns are only needed for the next rebuild, which never uses more than the budget
+        self._fit_window(self.budget_tokens)
+
+    def summary_prompt(self) -> str:
+        """Prompt asking the model to fold the turns that left the window into the summary."""
+        max_words = int(self.budget_tokens * SUMMARY_SHARE * CHARS_PER_TOKEN / 6)
+        lines = [f"Summarize this conversation in under {max_words} words, keeping names, facts and decisions."]
+        if self.summary:
+            lines.append(f"Summary so far: {self.summary}")
+        lines += [t.line() for t in self.unsummarized]
+        return "\n".join(lines)
+
+    def set_summary(self, summary: str):
+        limit = int(self.budget_tokens * SUMMARY_SHARE * CHARS_PER_TOKEN)
+        self.summary = summary.strip()[:limit]
+        self.unsummarized = []
@@ -0,0 +1,122 @@
+import gzip
+import time
+import threading
+from cache import Cache
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip is always available
+    zstandard = None
+
+MIN_COMPRESS_SIZE = 1024                 # smaller bodies aren't worth the CPU
+MAX_COMPRESS_SIZE = 8 * (1 << 20)        # larger files go out as-is with sendfile
+MIN_SAVING_RATIO = 0.1                   # keep a variant only if it is 10%+ smaller
+VARIANT_CACHE_SIZE = 64 * (1 << 20)      # 64 MB of compressed variants
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/pdf",
+    "image/svg+xml",
+)
+
+# Stored in place of a variant that didn't shrink enough, so the file isn't
+# compressed again on every request
+SKIP = b"\0"
+
+variant_cache = Cache(max_size=VARIANT_CACHE_SIZE)
+
+stats_lock = threading.Lock()
+stats = {
+    "responses": 0,
+    "bytes_original": 0,
+    "bytes_sent": 0,
+    "compressions": 0,
+    "compress_seconds": 0.0,
+}
+
+
+def supported_encodings():
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def is_compressible(content_type):
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encoding, content_type, size):
+    """Pick the best encoding the client accepts, or None to send identity."""
+    if not accept_encoding or not is_compressible(content_type):
+        return None
+    if size < MIN_COMPRESS_SIZE or size > MAX_COMPRESS_SIZE:
+        return None
+
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    # supported_encodings() is in preference order, so ties go to the first
+    for encoding in supported_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def get_variant(key, encoding, load):
+    """Return the compressed body cached under key, compressing load() on a miss.
+
+    Returns None when the body doesn't compress well enough to be worth
+    sending encoded.
+    """
+    element = variant_cache.cache_find(key)
+    if element is not None:
+        return None if element.data == SKIP else element.data
+
+    data = load()
+    start = time.perf_counter()
+    encoded = compress(data, encoding)
+    with stats_lock:
+        stats["compressions"] += 1
+        stats["compress_seconds"] += time.perf_counter() - start
+
+    if len(encoded) > len(data) * (1 - MIN_SAVING_RATIO):
+        variant_cache.cache_add(SKIP, key)
+        return None
+    variant_cache.cache_add(encoded, key)
+    return encoded
+
+
+def record(original_size, sent_size):
+    with stats_lock:
+        stats["responses"] += 1
+        stats["bytes_original"] += original_size
+        stats["bytes_sent"] += sent_size
+
+
+def compression_stats():
+    with stats_lock:
+        result = dict(stats)
+    result["bytes_saved"] = result["bytes_original"] - result["bytes_sent"]
+    result["encodings"] = list(supported_encodings())
+    result["variant_cache"] = variant_cache.cache_stats()
+    return result
@@ -0,0 +1,304 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from http_handler import (
+    route_request, is_proxy_request, wants_keep_alive, is_upload, begin_upload, finish_upload, fail_upload, connection_header,
+    BodyTooLarge, check_body_size, send_body_too_large_response,
+    KEEPALIVE_TIMEOUT, MAX_KEEPALIVE_REQUESTS,
+    record_request, response_status, http_bytes_in, http_bytes_out, active_connections, slot_wait,
+)
+from proxy_parse import HttpRequestParser, body_decoder_for
+
+DEFAULT_PORT = 8000
+MAX_CLIENTS = 1000
+RECV_BUFFER = 4096
+SOCKET_TIMEOUT = 30  # seconds
+UPLOAD_CHUNK = 64 * 1024  # upload bodies are streamed to disk in pieces this size
+STREAM_THRESHOLD = 64 * 1024  # buffered handler output past this is written out immediately
+
+# Blocking disk work (listing, reading and writing files) goes to disk_pool;
+# client sockets are all driven from the single event loop.
+DISK_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Forwarded proxy requests block on their upstream and on the client taking
+# the relayed body, so they get a pool of their own: stalled upstreams and
+# slow readers can then only hold up other proxy requests, never file work.
+PROXY_WORKERS = 16
+PUSH_TIMEOUT = SOCKET_TIMEOUT  # seconds a worker waits for the client to take streamed output
+
+disk_pool = ThreadPoolExecutor(max_workers=DISK_WORKERS, thread_name_prefix="disk")
+proxy_pool = ThreadPoolExecutor(max_workers=PROXY_WORKERS, thread_name_prefix="proxy")
+
+
+class BufferedClient:
+    """Socket stand-in for the shared handlers.
+
+    Handlers call sendall() as they would on a real socket; the bytes are
+    collected here and written to the transport back on the event loop.
+    sendfile() keeps a duplicate of the file descriptor so the loop can send
+    the file zero-copy after the buffered headers. Given the loop and writer,
+    output past STREAM_THRESHOLD is pushed out from the worker thread as it
+    is produced, so proxied responses stream instead of piling up here.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None, writer: asyncio.StreamWriter = None):
+        self.buffer = bytearray()
+        self.file = None
+        self.offset = 0
+        self.count = None
+        self.loop = loop
+        self.writer = writer
+        self.status = None
+
+    def sendall(self, data):
+        if self.status is None:
+            self.status = response_status(data)
+        self.buffer.extend(data)
+        if self.writer is not None and len(self.buffer) >= STREAM_THRESHOLD:
+            data, self.buffer = self.buffer, bytearray()
+            # Blocks this worker until the client has taken the data (backpressure),
+            # but not for longer than PUSH_TIMEOUT: a client that stopped reading
+            # must not keep the worker
+            future = asyncio.run_coroutine_threadsafe(self._push(data), self.loop)
+            try:
+                future.result(PUSH_TIMEOUT)
+            except FutureTimeout:
+                future.cancel()
+                raise ConnectionError("client stopped reading")
+
+    async def _push(self, data):
+        self.writer.write(data)
+        http_bytes_out.inc(value=len(data))
+        await self.writer.drain()
+
+    def sendfile(self, file, offset=0, count=None):
+        self.file = os.fdopen(os.dup(file.fileno()), "rb")
+        self.offset = offset
+        self.count = count
+
+
+async def read_request(reader: asyncio.StreamReader, data: bytearray, parser: HttpRequestParser, timeout: float):
+    # Pipelined requests may already be sitting in data; only read when needed
+    parsed = parser.parse(data)
+    while parsed is None:
+        chunk = await asyncio.wait_for(reader.read(RECV_BUFFER), timeout)
+        if not chunk:
+            break
+        http_bytes_in.inc(value=len(chunk))
+        data.extend(chunk)
+        timeout = SOCKET_TIMEOUT
+        parsed = parser.parse(data)
+    return parsed
+
+
+async def read_body(reader: asyncio.StreamReader, data: bytearray, request) -> bytes:
+    """Read request's body, framed by Content-Length or chunked, and return it.
+
+    data is left holding whatever followed the body, i.e. the start of the
+    next pipelined request. Raises BodyTooLarge past MAX_BODY_SIZE.
+    """
+    check_body_size(request.content_length)
+    decoder = body_decoder_for(request)
+    body = bytearray(decoder.feed(bytes(data[request.body_offset:])))
+    while not decoder.done:
+        check_body_size(len(body))
+        chunk = await asyncio.wait_for(reader.read(RECV_BUFFER), SOCKET_TIMEOUT)
+        if not chunk:
+            # Closed mid-body: nothing after it can be framed
+            request.keep_alive = False
+            break
+        http_bytes_in.inc(value=len(chunk))
+        body += decoder.feed(chunk)
+    check_body_size(len(body))
+    data[:] = decoder.unused
+    return bytes(body)
+
+
+async def flush(writer: asyncio.StreamWriter, client: BufferedClient):
+    if client.buffer:
+        writer.write(client.buffer)
+        http_bytes_out.inc(value=len(client.buffer))
+        client.buffer = bytearray()
+        await writer.drain()
+    if client.file is not None:
+        file, client.file = client.file, None
+        try:
+            # Uses os.sendfile on plain TCP transports
+            sent = await asyncio.get_running_loop().sendfile(writer.transport, file, client.offset, client.count)
+            http_bytes_out.inc(value=sent)
+        finally:
+            file.close()
+
+
+async def receive_upload(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, request, prefix: bytes):
+    """Stream a PUT/POST body to disk; socket reads stay on the loop, writes go to the pool.
+
+    Returns whatever followed the body, i.e. the start of the next pipelined
+    request, and the response status.
+    """
+    loop = asyncio.get_running_loop()
+    decoder = body_decoder_for(request)
+    client = BufferedClient()
+    upload = await loop.run_in_executor(disk_pool, begin_upload, client, request)
+    await flush(writer, client)
+    if upload is None:
+        return b"", client.status
+
+    try:
+        await loop.run_in_executor(disk_pool, upload.write, decoder.feed(prefix))
+        while not decoder.done:
+            chunk = await asyncio.wait_for(reader.read(UPLOAD_CHUNK), SOCKET_TIMEOUT)
+            if not chunk:
+                raise ConnectionError("client closed connection mid-upload")
+            http_bytes_in.inc(value=len(chunk))
+            piece = decoder.feed(chunk)
+            if piece:
+                await loop.run_in_executor(disk_pool, upload.write, piece)
+    except Exception as e:
+        print(f"[UPLOAD] Failed to receive {upload.filename}: {e}")
+        await loop.run_in_executor(disk_pool, fail_upload, client, request, upload, e)
+        await flush(writer, client)
+        return b"", client.status
+
+    await loop.run_in_executor(disk_pool, finish_upload, client, request, upload)
+    await flush(writer, client)
+    return decoder.unused, client.status
+
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, slots: asyncio.Semaphore,
+                        websocket=None, assets=None):
+    """Serve one connection's requests.
+
+    The unified server (unified_server.py) also passes a websocket gateway,
+    which takes over connections asking to upgrade, and the static frontend
+    assets, which are answered from memory on the loop.
+    """
+    peer = writer.get_extra_info("peername") or ("?", 0)
+    client_addr = f"{peer[0]}:{peer[1]}"
+    loop = asyncio.get_running_loop()
+    handed_off = False
+
+    waited = time.perf_counter()
+    async with slots:
+        slot_wait.observe(time.perf_counter() - waited)
+        active_connections.inc()
+        try:
+            data = bytearray()
+            parser = HttpRequestParser()
+            served = 0
+            while True:
+                try:
+                    parsed = await read_request(reader, data, parser, KEEPALIVE_TIMEOUT if served else SOCKET_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if data:
+                        print(f"[LOOP {client_addr}] recv timed out mid-request")
+                    break
+                except ValueError as e:
+                    print(f"[LOOP {client_addr}] Bad request: {e}")
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+                    await writer.drain()
+                    break
+                except Exception as e:
+                    print(f"[LOOP {client_addr}] recv error: {e}")
+                    break
+
+                if parsed is None:
+                    # Closed before a complete request head arrived
+                    break
+
+                if websocket is not None and websocket.accepts(parsed):
+                    # The connection belongs to the chat server from here on,
+                    # and keeps its client slot until it closes
+                    handed_off = True
+                    await websocket.take_over(reader, writer, bytes(data))
+                    break
+
+                served += 1
+                parsed.keep_alive = served < MAX_KEEPALIVE_REQUESTS and wants_keep_alive(parsed)
+                print(f"[LOOP {client_addr}] Handling {parsed.method.upper()} for {parsed.path}")
+                started = time.perf_counter()
+                asset = assets.match(parsed) if assets is not None else None
+
+                if is_upload(parsed):
+                    # Upload bodies go straight from the socket to disk
+                    prefix = bytes(data[parsed.body_offset:])
+                    rest, status = await receive_upload(reader, writer, parsed, prefix)
+                    data = bytearray(rest)
+                else:
+                    # Anything past this request's body belongs to the next pipelined request
+                    head = bytes(data[:parsed.body_offset])
+                    try:
+                        body_bytes = await read_body(reader, data, parsed)
+                    except BodyTooLarge as e:
+                        print(f"[LOOP {client_addr}] {e}")
+                        body_bytes = None
+
+                    if body_bytes is None:
+                        client = BufferedClient()
+                        send_body_too_large_response(client, parsed)
+                        await flush(writer, client)
+                        status = client.status
+                    elif asset is not None:
+                        response = assets.response(parsed, asset, connection_header(parsed))
+                        writer.write(response)
+                        http_bytes_out.inc(value=len(response))
+                        await writer.drain()
+                        status = response_status(response)
+                    else:
+                        raw_request = head + body_bytes
+                        client = BufferedClient(loop, writer)
+                        pool = proxy_pool if is_proxy_request(parsed) else disk_pool
+                        await loop.run_in_executor(pool, route_request, client, parsed, raw_request, body_bytes)
+                        await flush(writer, client)
+                        status = client.status
+                record_request(parsed, status, time.perf_counter() - started)
+
+                if not parsed.keep_alive:
+                    break
+
+        except Exception as e:
+            print(f"[LOOP {client_addr}] Exception in handler: {e}")
+            try:
+                writer.write(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+            except Exception:
+                pass
+        finally:
+            active_connections.dec()
+            # A handed-off transport belongs to the WebSocket connection, which closes it
+            if not handed_off:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except Exception:
+                    pass
+            print(f"[LOOP {client_addr}] Connection closed")
+
+
+async def serve(listen_host: str = "0.0.0.0", listen_port: int = DEFAULT_PORT, websocket=None, assets=None):
+    slots = asyncio.Semaphore(MAX_CLIENTS)
+
+    async def on_connect(reader, writer):
+        await handle_client(reader, writer, slots, websocket, assets)
+
+    server = await asyncio.start_server(
+        on_connect, listen_host, listen_port, backlog=MAX_CLIENTS, reuse_address=True
+    )
+    if websocket is not None:
+        websocket.attach(server)
+    print(f"[MAIN] Event-loop file server listening on {listen_host}:{listen_port}")
+    async with server:
+        await server.serve_forever()
+
+
+def start_event_server(listen_host: str = "0.0.0.0", listen_port: int = DEFAULT_PORT):
+    try:
+        asyncio.run(serve(listen_host, listen_port))
+    except KeyboardInterrupt:
+        print("\n[MAIN] Shutting down due to KeyboardInterrupt")
+    except OSError as e:
+        print(f"[MAIN] Failed to bind/listen on {listen_host}:{listen_port} -> {e}")
+    finally:
+        disk_pool.shutdown(wait=False)
+        proxy_pool.shutdown(wait=False)
+        print("[MAIN] Server closed")
@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import bisect
+import mimetypes
+import threading
+
+RESCAN_INTERVAL = 30  # seconds between full rescans that catch in-place edits
+DEFAULT_LIST_LIMIT = 1000
+MAX_LIST_LIMIT = 10000
+SORT_KEYS = ("name", "size", "mtime")
+
+
+class FileEntry:
+    def __init__(self, name: str, size: int, mtime: float):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        # Serialized once, reused by every listing that includes this file
+        self.json = json.dumps({
+            "name": name,
+            "size": size,
+            "mtime": mtime,
+            "type": self.content_type,
+        }).encode()
+
+
+class FileIndex:
+    """In-memory index of a directory's files, served as pre-serialized JSON.
+
+    Uploads update the index directly. A listing only rescans the directory
+    when its mtime changed (a file was added, removed or renamed in) or
+    RESCAN_INTERVAL has passed, so an unchanged directory costs one stat().
+    With a content store (file_share.ContentStore), the names in its
+    manifest are listed along with any plain files in the directory.
+    """
+
+    def __init__(self, directory: str, store=None):
+        self.directory = directory
+        self.store = store
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.dir_mtime_ns = None
+        self.scanned_at = 0.0
+        # sort key -> (entries in order, their names for bisect, full response body)
+        self.views = {}
+        # Bumped on every change so derived data (e.g. compressed listings) can be keyed on it
+        self.version = 0
+
+    def update(self, name: str):
+        stored = self.store.info(name) if self.store is not None else None
+        if stored is not None:
+            size, mtime = stored
+        else:
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                self.remove(name)
+                return
+            size, mtime = st.st_size, st.st_mtime
+        with self.lock:
+            self.entries[name] = FileEntry(name, size, mtime)
+            self.views.clear()
+            self.version += 1
+        # The rename into place bumped the directory mtime; that change is
+        # accounted for, so don't let it trigger a full rescan
+        try:
+            self.dir_mtime_ns = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            pass
+
+    def remove(self, name: str):
+        with self.lock:
+            if self.entries.pop(name, None) is not None:
+                self.views.clear()
+                self.version += 1
+
+    def reconcile(self):
+        entries = {}
+        with os.scandir(self.directory) as it:
+            for de in it:
+                if not de.is_file():
+                    continue
+                st = de.stat()
+                old = self.entries.get(de.name)
+                if old is not None and old.size == st.st_size and old.mtime == st.st_mtime:
+                    entries[de.name] = old
+                else:
+                    entries[de.name] = FileEntry(de.name, st.st_size, st.st_mtime)
+        if self.store is not None:
+            for name, size, mtime in self.store.items():
+                old = self.entries.get(name)
+                if old is not None and old.size == size and old.mtime == mtime:
+                    entries[name] = old
+                else:
+                    entries[name] = FileEntry(name, size, mtime)
+        with self.lock:
+            self.entries = entries
+            self.views.clear()
+            self.version += 1
+            self.scanned_at = time.monotonic()
+
+    def refresh(self):
+        try:
+            dir_mtime_ns = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return
+        if dir_mtime_ns != self.dir_mtime_ns or time.monotonic() - self.scanned_at > RESCAN_INTERVAL:
+            self.reconcile()
+            self.dir_mtime_ns = dir_mtime_ns
+
+    def _view(self, sort: str):
+        # Caller holds self.lock
+        view = self.views.get(sort)
+        if view is None:
+            key = sort.lstrip("-")
+            ordered = sorted(self.entries.values(), key=lambda e: (getattr(e, key), e.name),
+                             reverse=sort.startswith("-"))
+            names = [e.name for e in ordered] if sort == "name" else None
+            body = self._body(ordered, 0, len(ordered))
+            view = self.views[sort] = (ordered, names, body)
+        return view
+
+    @staticmethod
+    def _body(entries, offset, total):
+        return (
+            b'{"total": ' + str(total).encode() + b', "offset": ' + str(offset).encode()
+            + b', "files": [' + b", ".join(e.json for e in entries) + b"]}"
+        )
+
+    def listing(self, offset: int = 0, limit: int = DEFAULT_LIST_LIMIT, prefix: str = "", sort: str = "name") -> bytes:
+        if sort.lstrip("-") not in SORT_KEYS:
+            raise ValueError(f"unknown sort key: {sort}")
+        offset = max(offset, 0)
+        limit = min(max(limit, 0), MAX_LIST_LIMIT)
+
+        self.refresh()
+        with self.lock:
+            ordered, names, body = self._view(sort)
+            if not prefix:
+                if offset == 0 and limit >= len(ordered):
+                    return body
+                return self._body(ordered[offset:offset + limit], offset, len(ordered))
+
+            if names is not None:
+                # Name order: the prefix matches are one contiguous run
+                lo = bisect.bisect_left(names, prefix)
+                hi = bisect.bisect_left(names, prefix + "\U0010ffff")
+                matches = ordered[lo:hi]
+            else:
+                matches = [e for e in ordered if e.name.startswith(prefix)]
+            return self._body(matches[offset:offset + limit], offset, len(matches))
@@ -1,4 +1,24 @@
 import os
+import re
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+STORE_DIR = ".store"  # inside the files directory; listings only show plain files
+SHA256_HEX = re.compile(r"[0-9a-f]{64}")
+
+MANIFEST_SCHEMA = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+"""
 
 
 def save_file(filename: str, data: bytes, size: int) -> int:
@@ -67,3 +87,196 @@ def get_file_size(filename: str) -> int:
         return os.stat(filename).st_size
     except:
         return -1
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class HashMismatch(ValueError):
+    pass
+
+
+def is_sha256(value) -> bool:
+    return isinstance(value, str) and SHA256_HEX.fullmatch(value) is not None
+
+
+class ContentStore:
+    """Files kept once per distinct content, under the names they were uploaded as.
+
+    Each content is a blob named by its SHA-256 in .store/blobs/; the
+    manifest (SQLite) maps every file name to its blob, and each change to
+    it is one transaction, so a crash leaves either the old mapping or the
+    new one. Uploading content that is already stored only adds a name,
+    and a blob is deleted once no name refers to it. Files placed directly
+    in the directory (not uploaded through the store) are still found by
+    name.
+
+    One server process owns a store; the manifest is read into memory at
+    startup and lookups never touch the database.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.root = os.path.join(directory, STORE_DIR)
+        self.blobs = os.path.join(self.root, "blobs")
+        self.incoming = os.path.join(self.root, "incoming")
+        os.makedirs(self.blobs, exist_ok=True)
+        os.makedirs(self.incoming, exist_ok=True)
+        # Uploads cut off by a crash leave their temp files behind
+        for entry in os.scandir(self.incoming):
+            if entry.name.endswith(".part"):
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+        self.lock = threading.Lock()
+        # Written from the upload threads, always under self.lock
+        self.db = sqlite3.connect(os.path.join(self.root, "manifest.db"), check_same_thread=False)
+        self.db.executescript(MANIFEST_SCHEMA)
+        self.files = {
+            name: {"sha256": digest, "size": size, "mtime": mtime}
+            for name, digest, size, mtime in self.db.execute("SELECT name, sha256, size, mtime FROM files")
+        }
+        # Names per blob, so an unreferenced blob can be dropped
+        self.refs = {}
+        for entry in self.files.values():
+            self.refs[entry["sha256"]] = self.refs.get(entry["sha256"], 0) + 1
+        self.stats = {"stored": 0, "deduplicated": 0, "linked": 0, "blobs_removed": 0}
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blobs, digest[:2], digest)
+
+    def has(self, digest: str) -> bool:
+        return is_sha256(digest) and os.path.isfile(self.blob_path(digest))
+
+    def blob_size(self, digest: str) -> int:
+        return get_file_size(self.blob_path(digest)) if is_sha256(digest) else -1
+
+    def resolve(self, name: str):
+        """(path holding name's content, manifest entry), or (None, None) if there is no such file.
+
+        The entry is None for plain files outside the store.
+        """
+        entry = self.files.get(name)
+        if entry is not None:
+            return self.blob_path(entry["sha256"]), entry
+        path = os.path.join(self.directory, name)
+        return (path, None) if os.path.isfile(path) else (None, None)
+
+    def info(self, name: str):
+        """(size, mtime) of a stored name, or None for names outside the store."""
+        entry = self.files.get(name)
+        return (entry["size"], entry["mtime"]) if entry is not None else None
+
+    def items(self):
+        with self.lock:
+            return [(name, entry["size"], entry["mtime"]) for name, entry in self.files.items()]
+
+    def _bind(self, name: str, digest: str, size: int):
+        # Caller holds self.lock
+        old = self.files.get(name)
+        entry = {"sha256": digest, "size": size, "mtime": time.time()}
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO files (name, sha256, size, mtime) VALUES (?, ?, ?, ?)",
+                            (name, digest, size, entry["mtime"]))
+        self.files[name] = entry
+        self.refs[digest] = self.refs.get(digest, 0) + 1
+        if old is not None:
+            self.refs[old["sha256"]] -= 1
+
+        if old is not None and not self.refs[old["sha256"]]:
+            del self.refs[old["sha256"]]
+            try:
+                os.unlink(self.blob_path(old["sha256"]))
+                self.stats["blobs_removed"] += 1
+            except OSError:
+                pass
+        # A plain file of the same name would otherwise linger beside the stored one
+        legacy = os.path.join(self.directory, name)
+        if os.path.isfile(legacy):
+            os.unlink(legacy)
+
+    def add(self, name: str, temp_path: str, digest: str, size: int) -> bool:
+        """Store a fully written temp file as name; returns True if its content was already stored."""
+        blob = self.blob_path(digest)
+        with self.lock:
+            duplicate = os.path.isfile(blob)
+            if duplicate:
+                os.unlink(temp_path)
+                self.stats["deduplicated"] += 1
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                # mkstemp creates the file owner-only; give it normal file permissions
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, blob)
+                self.stats["stored"] += 1
+            self._bind(name, digest, size)
+        return duplicate
+
+    def link(self, name: str, digest: str) -> bool:
+        """Point name at an already stored blob; False if there is no such blob."""
+        with self.lock:
+            size = self.blob_size(digest)
+            if size < 0:
+                return False
+            self._bind(name, digest, size)
+            self.stats["linked"] += 1
+        print(f"[STORE] Linked {name} to stored content {digest[:12]}, no transfer")
+        return True
+
+    def upload(self, name: str, max_size: int, expected_hash: str = None):
+        return StreamingUpload(self, name, max_size, expected_hash)
+
+    def store_stats(self):
+        with self.lock:
+            result = dict(self.stats)
+            result["names"] = len(self.files)
+            result["blobs"] = len(self.refs)
+            result["bytes_named"] = sum(e["size"] for e in self.files.values())
+        return result
+
+
+class StreamingUpload:
+    """Writes an upload to a temp file chunk by chunk, hashing it as it goes,
+    then hands it to the content store.
+
+    The temp file lives in the store's "incoming" directory so moving it in
+    as a blob is an atomic rename on the same filesystem, and readers never
+    see a half-written file. With expected_hash (the client's
+    X-Content-SHA256), a body that hashes differently is rejected.
+    """
+
+    def __init__(self, store: ContentStore, filename: str, max_size: int, expected_hash: str = None):
+        self.store = store
+        self.filename = filename
+        self.max_size = max_size
+        self.expected_hash = expected_hash
+        self.size = 0
+        self.hash = hashlib.sha256()
+        fd, self.temp_path = tempfile.mkstemp(dir=store.incoming, suffix=".part")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        if self.size + len(chunk) > self.max_size:
+            raise UploadTooLarge(f"upload exceeds {self.max_size} bytes")
+        self.file.write(chunk)
+        self.hash.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> int:
+        self.file.close()
+        digest = self.hash.hexdigest()
+        if self.expected_hash and digest != self.expected_hash:
+            raise HashMismatch(f"body hashes to {digest}, not the declared {self.expected_hash}")
+        duplicate = self.store.add(self.filename, self.temp_path, digest, self.size)
+        print(f"[FILE] Saved file: {self.filename}, size: {self.size} bytes, sha256 {digest[:12]}"
+              f"{' (content already stored)' if duplicate else ''}")
+        return self.size
+
+    def abort(self):
+        try:
+            self.file.close()
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
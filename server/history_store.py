@@ -0,0 +1,193 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+HISTORY_DB = "chat_history.db"
+MAX_ACTIVE_SESSIONS = 256  # sessions kept in memory; the rest are reloaded from disk
+MAX_LOADED_TURNS = 64  # newest turns read back when a session is reloaded
+KEEP_TURNS = 500  # turns kept on disk per session
+FLUSH_INTERVAL = 0.2  # seconds the writer waits to batch more writes
+MAX_BATCH = 500
+MAX_SESSION_ID = 128
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_session ON turns (session, id);
+CREATE TABLE IF NOT EXISTS summaries (
+    session TEXT PRIMARY KEY,
+    summary TEXT NOT NULL
+);
+"""
+
+
+def valid_session_id(session_id) -> bool:
+    return isinstance(session_id, str) and 0 < len(session_id) <= MAX_SESSION_ID
+
+
+class HistoryStore:
+    """Chat sessions: an LRU of active ones in memory, all of them in SQLite.
+
+    Writes are queued and committed in batches by one writer thread, so the
+    event loop never waits on disk. Loads go through the same thread, after
+    any writes queued before them, so a reloaded session is always current.
+    new_session() builds the in-memory object (a ChatContext) for a session.
+    """
+
+    def __init__(self, path: str, new_session, max_active: int = MAX_ACTIVE_SESSIONS):
+        self.path = path
+        self.new_session = new_session
+        self.max_active = max_active
+        self.sessions = OrderedDict()
+        self.ops = queue.Queue()
+        self.loads = 0
+        self.evictions = 0
+        self.writes = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.writer = threading.Thread(target=self._writer, name="history-writer", daemon=True)
+        self.writer.start()
+
+    # ---- event-loop side ----
+    async def get(self, session_id: str):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+            return session
+
+        future = asyncio.get_running_loop().create_future()
+        self.ops.put(("load", session_id, future))
+        summary, turns = await future
+        # Another message for this session may have loaded it meanwhile
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.new_session()
+            session.restore(summary, turns)
+            self.loads += 1
+            self.sessions[session_id] = session
+            while len(self.sessions) > self.max_active:
+                self.sessions.popitem(last=False)
+                self.evictions += 1
+        return session
+
+    def append(self, session_id: str, role: str, content: str):
+        self.ops.put(("turn", session_id, role, content, time.time()))
+
+    def set_summary(self, session_id: str, summary: str):
+        self.ops.put(("summary", session_id, summary))
+
+    def close(self):
+        self.ops.put(None)
+        self.writer.join()
+
+    def stats(self) -> dict:
+        return {
+            "active_sessions": len(self.sessions),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "writes": self.writes,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "pending": self.ops.qsize(),
+        }
+
+    # ---- writer thread ----
+    def _open(self):
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        return db
+
+    def _writer(self):
+        db = None
+        running = True
+        while running:
+            batch = [self.ops.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            # Loads are answered right away; writes wait a moment for company
+            while batch[-1] is not None and batch[-1][0] != "load" and len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.ops.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            running = None not in batch
+            # A failed batch (locked or full disk, bad row) loses its writes,
+            # but the sessions waiting on its loads get the error and the
+            # thread carries on with the next batch
+            try:
+                if db is None:
+                    db = self._open()
+                self._apply(db, batch)
+            except Exception as e:
+                self.failed_batches += 1
+                print(f"[HISTORY] Failed to apply a batch of {len(batch)} operation(s): {e}")
+                for op in batch:
+                    if op is not None and op[0] == "load":
+                        future = op[2]
+                        future.get_loop().call_soon_threadsafe(self._resolve, future, None, e)
+        if db is not None:
+            db.close()
+
+    def _apply(self, db, batch):
+        touched = set()
+        with db:
+            for op in batch:
+                if op is None:
+                    continue
+                if op[0] == "turn":
+                    _, session_id, role, content, created = op
+                    db.execute(
+                        "INSERT INTO turns (session, role, content, created) VALUES (?, ?, ?, ?)",
+                        (session_id, role, content, created),
+                    )
+                    touched.add(session_id)
+                    self.writes += 1
+                elif op[0] == "summary":
+                    db.execute("INSERT OR REPLACE INTO summaries (session, summary) VALUES (?, ?)", (op[1], op[2]))
+                    self.writes += 1
+            for session_id in touched:
+                db.execute(
+                    "DELETE FROM turns WHERE session = ? AND id <= "
+                    "(SELECT id FROM turns WHERE session = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (session_id, session_id, KEEP_TURNS),
+                )
+        self.batches += 1
+
+        # Loads run after the writes queued ahead of them are committed
+        for op in batch:
+            if op is not None and op[0] == "load":
+                _, session_id, future = op
+                try:
+                    result, error = self._load(db, session_id), None
+                except Exception as e:
+                    result, error = None, e
+                future.get_loop().call_soon_threadsafe(self._resolve, future, result, error)
+
+    @staticmethod
+    def _resolve(future, result, error):
+        # The waiting client may have disconnected in the meantime
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    @staticmethod
+    def _load(db, session_id: str):
+        row = db.execute("SELECT summary FROM summaries WHERE session = ?", (session_id,)).fetchone()
+        turns = db.execute(
+            "SELECT role, content FROM turns WHERE session = ? ORDER BY id DESC LIMIT ?",
+            (session_id, MAX_LOADED_TURNS),
+        ).fetchall()
+        turns.reverse()
+        return (row[0] if row else ""), turns
@@ -1,28 +1,122 @@
 import os
+import json
+import mimetypes
 import socket
+import time
+from urllib.parse import parse_qs, urlsplit
+from email.utils import formatdate, parsedate_to_datetime
+import compression
 from cache import cache
+from file_index import FileIndex, DEFAULT_LIST_LIMIT
+from file_share import ContentStore, UploadTooLarge, is_sha256
+from proxy_parse import get_header, parse_response_head, response_body_decoder
+from upstream_pool import upstream_pool
+from metrics import registry, from_stats
 
-MAX_BYTES = 4096
-MAX_RESPONSE_SIZE = 50 * 1024 * 1024  # 50MB
 FILES_DIR = "./Files"
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB, larger uploads get 413 (main.py --max-upload)
+MAX_BODY_SIZE = 1024 * 1024  # bodies of other requests are held in memory; larger ones get 413
+HOT_FILE_MAX_SIZE = 256 * 1024  # files up to this size are served from memory once read
+KEEPALIVE_TIMEOUT = 5  # seconds an idle persistent connection is kept open
+MAX_KEEPALIVE_REQUESTS = 100  # requests served per connection before closing
 
 # Ensure the Files directory exists
 os.makedirs(FILES_DIR, exist_ok=True)
 
+# Uploads are stored once per distinct content (file_share.ContentStore);
+# downloads find a name's content through it
+file_store = ContentStore(FILES_DIR)
+
+# Shared listing index for FILES_DIR, kept current by the upload handlers
+file_index = FileIndex(FILES_DIR, file_store)
+
+# --- metrics, shared by the threaded and event-loop servers ---
+http_requests = registry.counter("ananta_http_requests_total", "Requests served", ("method", "route", "status"))
+http_latency = registry.histogram("ananta_http_request_seconds", "Time to handle a request", ("method", "route"))
+http_bytes_in = registry.counter("ananta_http_received_bytes_total", "Bytes read from clients")
+http_bytes_out = registry.counter("ananta_http_sent_bytes_total", "Bytes written to clients")
+active_connections = registry.gauge("ananta_http_active_connections", "Client connections being served")
+slot_wait = registry.histogram("ananta_http_slot_wait_seconds", "Time a connection waited for a free client slot")
+
+@registry.collector
+def collect_file_server():
+    yield from from_stats("ananta_cache", cache.cache_stats(),
+                          counters={"hits", "misses", "evictions", "expirations", "bytes_served", "bytes_evicted"},
+                          labels={"cache": "files"})
+    compression_stats = compression.compression_stats()
+    yield from from_stats("ananta_cache", compression_stats.pop("variant_cache"),
+                          counters={"hits", "misses", "evictions", "expirations", "bytes_served", "bytes_evicted"},
+                          labels={"cache": "compression"})
+    yield from from_stats("ananta_compression", compression_stats,
+                          counters={"responses", "bytes_original", "bytes_sent", "compressions", "compress_seconds"})
+    yield from from_stats("ananta_upstream", upstream_pool.stats(),
+                          counters={"connects", "reuses", "idle_evictions", "health_failures"})
+    yield from from_stats("ananta_store", file_store.store_stats(),
+                          counters={"stored", "deduplicated", "linked", "blobs_removed"})
+
+def route_name(request):
+    # A fixed set of names, so the metrics don't grow with every file name
+    if is_proxy_request(request):
+        return "proxy"
+    method = request.method.upper()
+    path, _ = split_path(request)
+    if path in ("/", "/list", "/metrics"):
+        return path
+    if path.startswith("/Files/"):
+        return "/Files/"
+    if path.startswith("/blobs/"):
+        return "/blobs/"
+    if path.startswith("/static/"):
+        # Frontend assets, served by unified_server.py
+        return "/static/"
+    if method in ("PUT", "POST"):
+        return "upload"
+    return "other"
+
+def response_status(data):
+    # "HTTP/1.1 200 OK..." -> "200"; None for interim responses (100 Continue),
+    # so the final status of the request is the one recorded
+    if data[:5] != b"HTTP/" or data[9:10] == b"1":
+        return None
+    return bytes(data[9:12]).decode("ascii", "replace")
+
+def record_request(request, status, seconds):
+    method = request.method.upper()
+    route = route_name(request)
+    http_requests.inc(method, route, status or "none")
+    http_latency.observe(seconds, method, route)
+
 # --- common reusable CORS header string ---
 CORS_HEADERS = (
     "Access-Control-Allow-Origin: *\r\n"
     "Access-Control-Allow-Methods: GET, POST, PUT, OPTIONS\r\n"
-    "Access-Control-Allow-Headers: Content-Type, Authorization\r\n"
+    "Access-Control-Allow-Headers: Content-Type, Authorization, Range, If-Range, If-None-Match, If-Modified-Since, X-Content-SHA256\r\n"
+    "Access-Control-Expose-Headers: Content-Range, Accept-Ranges, ETag, Last-Modified\r\n"
 )
 
-def send_error_response(client_socket, status_code, message):
+def wants_keep_alive(request):
+    connection = (get_header(request, "connection") or "").lower()
+    # HTTP/1.1 is persistent unless the client opts out; HTTP/1.0 must opt in
+    if (request.version or "").upper() == "HTTP/1.0":
+        return "keep-alive" in connection
+    return "close" not in connection
+
+def connection_header(request=None):
+    if request is not None and request.keep_alive:
+        return f"Connection: keep-alive\r\nKeep-Alive: timeout={KEEPALIVE_TIMEOUT}\r\n"
+    return "Connection: close\r\n"
+
+def send_error_response(client_socket, status_code, message, request=None):
     status_texts = {
         400: "Bad Request",
         404: "Not Found",
         405: "Method Not Allowed",
+        411: "Length Required",
+        403: "Forbidden",
+        413: "Payload Too Large",
+        416: "Range Not Satisfiable",
         500: "Internal Server Error",
+        501: "Not Implemented",
         502: "Bad Gateway",
         504: "Gateway Timeout",
     }
@@ -30,30 +124,244 @@ def send_error_response(client_socket, status_code, message):
     body = (
         f"<html><head><title>{status_code} {status_text}</title></head>"
         f"<body><h1>{status_code} {status_text}</h1><p>{message}</p></body></html>"
-    )
-    response = (
+    ).encode()
+    header = (
         f"HTTP/1.1 {status_code} {status_text}\r\n"
         f"Content-Type: text/html\r\n"
         f"{CORS_HEADERS}"
         f"Content-Length: {len(body)}\r\n"
-        "Connection: close\r\n\r\n"
-        f"{body}"
+        f"{connection_header(request)}\r\n"
     )
-    client_socket.sendall(response.encode())
+    client_socket.sendall(header.encode() + body)
+
+def send_json_response(client_socket, data, status=200, request=None, cache_key=None):
+    # bytes are taken as already-serialized JSON
+    body = data if isinstance(data, bytes) else json.dumps(data).encode()
+    original_size = len(body)
+    content_encoding = ""
+    encoding = None
+    if request is not None:
+        encoding = compression.choose_encoding(get_header(request, "accept-encoding"), "application/json", len(body))
+    if encoding:
+        # With a cache_key the body is compressed once and reused until the key changes
+        if cache_key:
+            encoded = compression.get_variant(f"{cache_key}:{encoding}", encoding, lambda: body)
+        else:
+            encoded = compression.compress(body, encoding)
+        if encoded is not None and len(encoded) < len(body):
+            body = encoded
+            content_encoding = f"Content-Encoding: {encoding}\r\n"
+            compression.record(original_size, len(body))
+    header = (
+        f"HTTP/1.1 {status} OK\r\n"
+        f"Content-Type: application/json\r\n"
+        f"{CORS_HEADERS}"
+        "Vary: Accept-Encoding\r\n"
+        f"{content_encoding}"
+        f"Content-Length: {len(body)}\r\n"
+        f"{connection_header(request)}\r\n"
+    )
+    client_socket.sendall(header.encode() + body)
+
+def split_path(request):
+    path, _, query = request.path.partition("?")
+    return path, parse_qs(query)
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_range(range_header, size):
+    """Resolve a single "bytes=" Range header against a file of the given size.
 
-def connect_remote_server(host, port):
+    Returns an inclusive (start, end) pair, or None when the header should be
+    ignored and the whole file served (malformed or multi-range requests).
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
     try:
-        s = socket.create_connection((host, int(port)), timeout=30)
-        return s
-    except Exception as e:
-        print(f"[HTTP] Failed to connect to {host}:{port} -> {e}")
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(range_header)
+            start = max(size - suffix, 0)
+            end = size - 1
+    except ValueError:
         return None
+    if start > end or start >= size:
+        raise RangeNotSatisfiable(range_header)
+    return start, min(end, size - 1)
+
+def file_validators(st, entry=None):
+    """ETag, Last-Modified and the mtime behind it for a file's current version."""
+    if entry is not None:
+        # A stored blob is shared by every name with that content, so its own
+        # mtime says nothing about this name; the manifest entry changes on
+        # every upload to it
+        mtime = entry["mtime"]
+        etag = f'"{entry["sha256"][:16]}-{int(mtime * 1e6):x}"'
+    else:
+        # mtime and size change whenever an upload replaces the file
+        mtime = st.st_mtime
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    return etag, formatdate(mtime, usegmt=True), mtime
+
+def is_not_modified(request, etag, mtime):
+    if_none_match = get_header(request, "if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        # Compressed variants carry the file's ETag with an "-<encoding>" suffix
+        variant_prefix = etag[:-1] + "-"
+        return any(t == "*" or t == etag or t.startswith(variant_prefix) for t in tags)
+    if_modified_since = get_header(request, "if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since
+    return False
+
+def send_not_modified(client_socket, request, etag, last_modified):
+    header = (
+        "HTTP/1.1 304 Not Modified\r\n"
+        f"{CORS_HEADERS}"
+        f"ETag: {etag}\r\n"
+        f"Last-Modified: {last_modified}\r\n"
+        "Cache-Control: no-cache\r\n"
+        f"{connection_header(request)}\r\n"
+    )
+    client_socket.sendall(header.encode())
+
+def send_file_response(client_socket, filepath, filename, request=None, entry=None):
+    """Send a file, answering conditional and single-range requests.
+
+    entry is the content store's manifest entry when filepath is a stored
+    blob; the validators then come from it rather than the blob's stat.
+
+    Files up to HOT_FILE_MAX_SIZE are kept in the cache keyed by path, mtime
+    and size, so a changed file is never served stale and repeat downloads
+    skip the disk. Larger files go out with sendfile() straight from the
+    file descriptor.
+    """
+    header_sent = False
+    f = None
+    try:
+        st = os.stat(filepath)
+        etag, last_modified, mtime = file_validators(st, entry)
+        if request is not None and is_not_modified(request, etag, mtime):
+            send_not_modified(client_socket, request, etag, last_modified)
+            print(f"[GET] Not modified: {filename}")
+            return
 
-def parse_host_port(host_header):
-    if ':' in host_header:
-        host, port = host_header.split(':', 1)
-        return host, int(port)
-    return host_header, 8080
+        element = None
+        if st.st_size <= HOT_FILE_MAX_SIZE:
+            element = cache.cache_find(f"{filepath}:{st.st_mtime_ns}:{st.st_size}")
+        if element is None:
+            f = open(filepath, "rb")
+            # The file may have been replaced since the stat; trust the open descriptor
+            st = os.fstat(f.fileno())
+            etag, last_modified, _ = file_validators(st, entry)
+
+        size = st.st_size
+        status = "200 OK"
+        offset, count = 0, size
+        content_range = ""
+
+        range_header = get_header(request, "range") if request is not None else None
+        if_range = get_header(request, "if-range") if request is not None else None
+        if range_header and (if_range is None or if_range.strip() in (etag, last_modified)):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                header = (
+                    "HTTP/1.1 416 Range Not Satisfiable\r\n"
+                    f"{CORS_HEADERS}"
+                    f"Content-Range: bytes */{size}\r\n"
+                    "Content-Length: 0\r\n"
+                    f"{connection_header(request)}\r\n"
+                )
+                client_socket.sendall(header.encode())
+                print(f"[GET] Unsatisfiable range {range_header!r} for {filename}")
+                return
+            if byte_range:
+                start, end = byte_range
+                status = "206 Partial Content"
+                offset, count = start, end - start + 1
+                content_range = f"Content-Range: bytes {start}-{end}/{size}\r\n"
+
+        content_type = mimetypes.guess_type(filename)[0]
+        encoding = None
+        if status == "200 OK" and request is not None:
+            encoding = compression.choose_encoding(get_header(request, "accept-encoding"), content_type, size)
+
+        def build_header(length, encoding=None):
+            vary = "Vary: Accept-Encoding\r\n" if compression.is_compressible(content_type) else ""
+            content_encoding = f"Content-Encoding: {encoding}\r\n" if encoding else ""
+            # Each encoded variant needs its own strong validator
+            tag = f'{etag[:-1]}-{encoding}"' if encoding else etag
+            return (
+                f"HTTP/1.1 {status}\r\n"
+                f"{CORS_HEADERS}"
+                "Content-Type: application/octet-stream\r\n"
+                f"Content-Disposition: attachment; filename=\"{filename}\"\r\n"
+                "Accept-Ranges: bytes\r\n"
+                f"ETag: {tag}\r\n"
+                f"Last-Modified: {last_modified}\r\n"
+                "Cache-Control: no-cache\r\n"
+                f"{vary}"
+                f"{content_encoding}"
+                f"{content_range}"
+                f"Content-Length: {length}\r\n"
+                f"{connection_header(request)}\r\n"
+            ).encode()
+
+        data = None
+        if element is not None:
+            data = element.data
+        elif size <= HOT_FILE_MAX_SIZE:
+            data = f.read()
+            if len(data) == size:
+                cache.cache_add(data, f"{filepath}:{st.st_mtime_ns}:{size}")
+
+        if encoding:
+            # Compressed once per file version, then served from the variant cache
+            variant_key = f"{filepath}:{st.st_mtime_ns}:{size}:{encoding}"
+            encoded = compression.get_variant(variant_key, encoding, lambda: data if data is not None else f.read())
+            if encoded is not None:
+                client_socket.sendall(build_header(len(encoded), encoding) + encoded)
+                compression.record(size, len(encoded))
+                print(f"[GET] Served file: {filename} ({status}, {len(encoded)}/{size} bytes {encoding})")
+                return
+
+        if data is None:
+            client_socket.sendall(build_header(count))
+            header_sent = True
+            if count:
+                client_socket.sendfile(f, offset, count)
+            print(f"[GET] Served file: {filename} ({status}, {count} bytes)")
+            return
+
+        client_socket.sendall(build_header(count) + data[offset:offset + count])
+        print(f"[GET] Served file: {filename} ({status}, {count} bytes{', cached' if element else ''})")
+    except Exception as e:
+        print(f"[GET] Failed to serve file {filename}: {e}")
+        if header_sent:
+            # Part of the body may be on the wire already; the connection can't be reused
+            if request is not None:
+                request.keep_alive = False
+            return
+        client_socket.sendall(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n")
+    finally:
+        if f is not None:
+            f.close()
 
 # -------------------- OPTIONS HANDLER (CORS preflight) --------------------
 def handle_options(client_socket, request, raw_request):
@@ -61,136 +369,462 @@ def handle_options(client_socket, request, raw_request):
         "HTTP/1.1 204 No Content\r\n"
         f"{CORS_HEADERS}"
         "Access-Control-Max-Age: 86400\r\n"
-        "Connection: keep-alive\r\n\r\n"
+        "Content-Length: 0\r\n"
+        f"{connection_header(request)}\r\n"
     )
     client_socket.sendall(response.encode())
     print(f"[OPTIONS] Handled preflight for {request.path}")
     return 0
 
-# -------------------- GET HANDLER --------------------
-def handle_get(client_socket, request, raw_request):
-    # Serve local file first
-    filename = os.path.basename(request.path)
-    filepath = os.path.join(FILES_DIR, filename)
-
-    if os.path.exists(filepath):
-        with open(filepath, "rb") as f:
-            file_data = f.read()
-        header = (
-            "HTTP/1.1 200 OK\r\n"
-            f"{CORS_HEADERS}"
-            "Content-Type: application/octet-stream\r\n"
-            f"Content-Disposition: attachment; filename=\"{filename}\"\r\n"
-            f"Content-Length: {len(file_data)}\r\n"
-            "Connection: close\r\n\r\n"
-        )
-        full_response = header.encode() + file_data
-        client_socket.sendall(full_response)
-        cache.cache_add(full_response, request.path)
-        print(f"[GET] Served local file {filename}")
-        return 0
+# -------------------- UPSTREAM PROXY --------------------
+# Absolute-form requests ("GET http://host/path") are forwarded over pooled
+# keep-alive connections and streamed back as they arrive. Complete, cacheable
+# GET responses are kept in the shared cache and replayed on later hits.
+PROXY_CHUNK = 64 * 1024
+PROXY_CACHE_TTL = 60  # seconds, for cacheable responses without max-age
+PROXY_TIMEOUT = 120  # seconds one upstream response may take to relay in full
+# Upstream hosts absolute-form (forward proxy) requests may reach. Empty turns
+# the proxy off, so the file server isn't an open relay to the LAN or to
+# local services; "*" allows any host (main.py --proxy-hosts)
+PROXY_HOSTS = {h.strip().lower() for h in os.environ.get("PROXY_HOSTS", "").split(",") if h.strip()}
+PROXY_METHODS = ("GET", "HEAD", "POST")
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-connection", "proxy-authenticate",
+    "proxy-authorization", "te", "trailer", "transfer-encoding", "upgrade",
+}
 
-    # If not local, try remote server (optional)
-    host, port = parse_host_port(request.host)
-    remote_sock = connect_remote_server(host, port)
-    if not remote_sock:
-        send_error_response(client_socket, 502, "Failed to connect remote server")
-        return -1
+class UpstreamError(Exception):
+    """The upstream failed before any of its response reached the client."""
 
-    http_req = (
-        f"GET {request.path} HTTP/1.1\r\n"
-        f"Host: {host}\r\n"
-        f"Connection: close\r\n"
-        f"User-Agent: ProxyServer/1.0\r\n\r\n"
-    )
-    remote_sock.sendall(http_req.encode())
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.status = status
+
+def is_proxy_request(request):
+    return (request.url or "").startswith("http://")
 
-    full_response = b""
+def proxy_target(request):
+    parts = urlsplit(request.url)
+    return parts.hostname, parts.port or 80
+
+def proxy_allowed(host):
+    return "*" in PROXY_HOSTS or (host or "").lower() in PROXY_HOSTS
+
+def proxy_cache_key(request, host, port):
+    return f"{host}:{port}{request.path}|{get_header(request, 'accept-encoding') or ''}"
+
+def build_upstream_request(request, host, port, body):
+    lines = [f"{request.method.upper()} {request.path} HTTP/1.1", f"Host: {host}" + (f":{port}" if port != 80 else "")]
+    for header in request.headers:
+        name = header.split(":", 1)[0].strip().lower()
+        if name not in HOP_BY_HOP and name not in ("host", "content-length"):
+            lines.append(header)
+    if body or request.method.upper() in ("POST", "PUT"):
+        lines.append(f"Content-Length: {len(body)}")
+    lines.append("Connection: keep-alive")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1") + body
+
+def response_ttl(request, resp):
+    """Seconds to cache an upstream response for, or None if it mustn't be cached."""
+    if request.method.upper() != "GET" or resp.status != 200:
+        return None
+    # Partial and conditional requests get answers that only fit that client
+    for name in ("range", "if-range", "if-none-match", "if-modified-since", "authorization"):
+        if get_header(request, name) is not None:
+            return None
+    if "vary" in resp.header_map and resp.header_map["vary"].strip().lower() not in ("accept-encoding", ""):
+        return None
+    directives = [d.strip().lower() for d in resp.header_map.get("cache-control", "").split(",")]
+    if any(d in ("no-store", "no-cache", "private") for d in directives):
+        return None
+    for d in directives:
+        if d.startswith(("s-maxage=", "max-age=")):
+            seconds = d.partition("=")[2]
+            return int(seconds) if seconds.isdigit() and int(seconds) > 0 else None
+    return PROXY_CACHE_TTL
+
+def response_head(resp):
+    # The upstream's connection management is hop-by-hop; ours is added per client
+    kept = [h for h in resp.headers if h.split(":", 1)[0].strip().lower() not in HOP_BY_HOP - {"transfer-encoding"}]
+    return "\r\n".join([f"HTTP/1.1 {resp.status} {resp.reason}"] + kept).encode("iso-8859-1") + b"\r\n"
+
+def upstream_recv(upstream, deadline):
+    # Each read waits at most until the deadline, so an upstream trickling
+    # bytes can't hold the relay past PROXY_TIMEOUT
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise socket.timeout("upstream response took too long")
+    upstream.settimeout(min(remaining, upstream.gettimeout() or remaining))
+    return upstream.recv(PROXY_CHUNK)
+
+def relay_response(client_socket, request, upstream, method, data):
+    """Read one response off upstream and stream it to the client.
+
+    Returns (upstream reusable, cached copy or None). Raises UpstreamError if
+    nothing was sent to the client yet.
+    """
+    deadline = time.monotonic() + PROXY_TIMEOUT
+    data = bytearray(data)
+    resp = None
+    while resp is None:
+        try:
+            resp = parse_response_head(data)
+        except ValueError as e:
+            raise UpstreamError(str(e))
+        if resp is None:
+            try:
+                chunk = upstream_recv(upstream, deadline)
+            except socket.timeout:
+                raise UpstreamError("upstream timed out", 504)
+            except OSError as e:
+                raise UpstreamError(str(e))
+            if not chunk:
+                raise UpstreamError("upstream closed before responding")
+            data.extend(chunk)
+        elif 100 <= resp.status < 200 and resp.status != 101:
+            # Interim responses (100 Continue) aren't relayed
+            del data[:resp.body_offset]
+            resp = None
+
+    decoder = response_body_decoder(method, resp)
+    if decoder is None:
+        # Close-delimited: the client sees the end of the body as the end of the connection
+        request.keep_alive = False
+    head = response_head(resp)
+    ttl = response_ttl(request, resp)
+    tee = bytearray(head + b"\r\n") if ttl else None
+
+    client_socket.sendall(head + connection_header(request).encode() + b"\r\n")
+    pending = bytes(data[resp.body_offset:])
     while True:
-        data = remote_sock.recv(MAX_BYTES)
-        if not data:
+        if pending:
+            if decoder is not None:
+                decoder.feed(pending)
+                if decoder.done and decoder.unused:
+                    pending = pending[:len(pending) - len(decoder.unused)]
+            client_socket.sendall(pending)
+            if tee is not None:
+                tee += pending
+                if len(tee) > cache.max_element_size:
+                    tee = None
+        if decoder is not None and decoder.done:
             break
-        client_socket.sendall(data)
-        full_response += data
-        if len(full_response) > MAX_RESPONSE_SIZE:
-            full_response = b""
+        try:
+            pending = upstream_recv(upstream, deadline)
+        except OSError:
+            pending = b""
+        if not pending:
+            if decoder is not None:
+                # Truncated upstream body: the client can't be told except by closing
+                request.keep_alive = False
+                return False, None
             break
 
-    remote_sock.close()
-    if full_response:
-        cache.cache_add(full_response, f"{host}:{port}{request.path}")
-    return 1
+    reusable = decoder is not None and not decoder.unused and \
+        "close" not in resp.header_map.get("connection", "").lower()
+    if tee is not None:
+        return reusable, (bytes(tee), ttl)
+    return reusable, None
 
-# -------------------- POST HANDLER --------------------
-def handle_post(client_socket, request, raw_request):
-    host, port = parse_host_port(request.host)
-    remote_sock = connect_remote_server(host, port)
-    if not remote_sock:
-        send_error_response(client_socket, 502, "Failed to connect remote server")
+def forward_request(client_socket, request, body=b""):
+    host, port = proxy_target(request)
+    if not host:
+        send_error_response(client_socket, 400, "Missing upstream host", request)
         return -1
+    method = request.method.upper()
+    cache_key = proxy_cache_key(request, host, port) if method == "GET" else None
 
-    remote_sock.sendall(raw_request.encode())
-    while True:
-        data = remote_sock.recv(MAX_BYTES)
-        if not data:
-            break
-        client_socket.sendall(data)
-    remote_sock.close()
-    return 1
+    if cache_key:
+        element = cache.cache_find(cache_key)
+        if element is not None:
+            # Stored as head + blank line + body; our Connection header goes before the blank line
+            head, _, rest = element.data.partition(b"\r\n\r\n")
+            client_socket.sendall(head + b"\r\n" + connection_header(request).encode() + b"\r\n" + rest)
+            print(f"[PROXY] Cache hit for {cache_key}")
+            return 1
 
-# -------------------- PUT HANDLER (UPLOAD) --------------------
-def handle_put(client_socket, request, raw_request):
-    filename = os.path.basename(request.path)
-    filepath = os.path.join(FILES_DIR, filename)
+    upstream_request = build_upstream_request(request, host, port, body)
+    # A pooled connection may have been closed by the upstream between our
+    # health check and this send; that earns one retry on a fresh connection
+    for attempt in range(2):
+        try:
+            upstream, reused = upstream_pool.acquire(host, port)
+        except OSError as e:
+            print(f"[PROXY] Failed to connect to {host}:{port} -> {e}")
+            send_error_response(client_socket, 502, "Failed to connect remote server", request)
+            return -1
 
-    split_data = raw_request.split(b"\r\n\r\n", 1)
-    body = split_data[1] if len(split_data) > 1 else b""
+        try:
+            try:
+                upstream.sendall(upstream_request)
+            except OSError as e:
+                raise UpstreamError(str(e))
+            reusable, cached = relay_response(client_socket, request, upstream, method, b"")
+        except UpstreamError as e:
+            upstream.close()
+            if reused and attempt == 0 and e.status == 502 and method in ("GET", "HEAD"):
+                continue
+            send_error_response(client_socket, e.status, f"Bad upstream response: {e}", request)
+            return -1
+        except Exception as e:
+            # Part of the response may already be on the wire
+            upstream.close()
+            request.keep_alive = False
+            print(f"[PROXY] Relay from {host}:{port} failed: {e}")
+            return -1
 
-    try:
-        with open(filepath, "wb") as f:
-            f.write(body[:MAX_FILE_SIZE])
+        upstream_pool.release(host, port, upstream, reusable)
+        if cached is not None:
+            cache.cache_add(cached[0], cache_key, ttl=cached[1])
+        return 1
+    return -1
 
-        response_body = (
-            f"<html><body><h1>✅ File '{filename}' uploaded successfully!</h1></body></html>"
-        )
-        response = (
-            "HTTP/1.1 201 Created\r\n"
-            f"{CORS_HEADERS}"
-            "Content-Type: text/html\r\n"
-            f"Content-Length: {len(response_body)}\r\n"
-            "Connection: close\r\n\r\n"
-            f"{response_body}"
-        )
-        client_socket.sendall(response.encode())
-        print(f"[PUT] File saved: {filepath}")
-        return 0
-    except Exception as e:
-        send_error_response(client_socket, 500, f"Failed to save file: {e}")
-        return -1
+# -------------------- GET HANDLER --------------------
+def handle_get(client_socket, request, raw_request):
+    # Proxied GET/HEAD only; local files are served by handle_download
+    return forward_request(client_socket, request)
 
-# -------------------- FILE UPLOAD HELPER --------------------
-def handle_file_upload(client_socket, request, body, body_len):
-    filename = os.path.basename(request.path)
-    if not filename:
-        send_error_response(client_socket, 400, "No filename specified")
-        return -1
+# -------------------- POST HANDLER --------------------
+def handle_post(client_socket, request, body_bytes):
+    # body_bytes is the whole decoded body, so a chunked request goes upstream
+    # with a Content-Length (build_upstream_request drops Transfer-Encoding)
+    return forward_request(client_socket, request, body_bytes)
 
-    filepath = os.path.join(FILES_DIR, filename)
-    with open(filepath, "wb") as f:
-        f.write(body[:MAX_FILE_SIZE])
+# -------------------- UPLOAD RESPONSES --------------------
+def send_put_response(client_socket, request, filename):
+    response_body = (
+        f"<html><body><h1>✅ File '{filename}' uploaded successfully!</h1></body></html>"
+    ).encode()
+    header = (
+        "HTTP/1.1 201 Created\r\n"
+        f"{CORS_HEADERS}"
+        "Content-Type: text/html\r\n"
+        f"Content-Length: {len(response_body)}\r\n"
+        f"{connection_header(request)}\r\n"
+    )
+    client_socket.sendall(header.encode() + response_body)
 
-    response_body = f"<html><body><h1>File uploaded successfully: {filename}</h1></body></html>"
-    response = (
+def send_upload_response(client_socket, request, filename):
+    response_body = f"<html><body><h1>File uploaded successfully: {filename}</h1></body></html>".encode()
+    header = (
         "HTTP/1.1 200 OK\r\n"
         f"{CORS_HEADERS}"
         "Content-Type: text/html\r\n"
         f"Content-Length: {len(response_body)}\r\n"
-        "Connection: close\r\n\r\n"
-        f"{response_body}"
+        f"{connection_header(request)}\r\n"
     )
-    client_socket.sendall(response.encode())
-    print(f"[UPLOAD] File saved as {filepath}")
+    client_socket.sendall(header.encode() + response_body)
+
+def send_too_large_response(client_socket, request):
+    send_error_response(client_socket, 413, f"File exceeds the {MAX_FILE_SIZE} byte upload limit", request)
+
+# -------------------- OTHER REQUEST BODIES --------------------
+# Bodies of requests that aren't uploads (proxied POSTs, stray bodies on GETs)
+# are buffered whole before routing, so they are capped at MAX_BODY_SIZE.
+# A chunked body declares no length up front and is checked as it arrives.
+class BodyTooLarge(Exception):
+    pass
+
+def check_body_size(size):
+    if size > MAX_BODY_SIZE:
+        raise BodyTooLarge(f"request body exceeds {MAX_BODY_SIZE} bytes")
+
+def send_body_too_large_response(client_socket, request):
+    # The rest of the body is never read, so nothing after it can be framed
+    request.keep_alive = False
+    send_error_response(client_socket, 413, f"Request body exceeds the {MAX_BODY_SIZE} byte limit", request)
+
+# -------------------- STREAMING UPLOADS --------------------
+# The servers read PUT/POST bodies off the socket themselves and feed them to
+# a StreamingUpload chunk by chunk, so an upload never sits in memory whole.
+# This is the only upload path; route_request never sees a local PUT/POST.
+def is_upload(request):
+    return request.method.upper() in ("PUT", "POST") and not is_proxy_request(request)
+
+def send_stored_response(client_socket, request, filename):
+    if request.method.upper() == "PUT":
+        send_put_response(client_socket, request, filename)
+    else:
+        send_upload_response(client_socket, request, filename)
+
+def begin_upload(client_socket, request):
+    """Vet an upload before its body is read and open its temp file.
+
+    Returns None once the client has been answered, with an error or, when
+    its X-Content-SHA256 names content that is already stored and it is
+    waiting on 100-continue, with success and no transfer; the connection
+    is then closed, in case the client sends the body anyway.
+    """
+    filename = os.path.basename(split_path(request)[0])
+    if not filename:
+        request.keep_alive = False
+        send_error_response(client_socket, 400, "No filename specified", request)
+        return None
+
+    declared = get_header(request, "content-length")
+    if declared is not None and int(declared) > MAX_FILE_SIZE:
+        request.keep_alive = False
+        send_too_large_response(client_socket, request)
+        return None
+
+    expecting = (get_header(request, "expect") or "").lower() == "100-continue"
+    expected_hash = get_header(request, "x-content-sha256")
+    if expected_hash is not None:
+        expected_hash = expected_hash.strip().lower()
+        if not is_sha256(expected_hash):
+            request.keep_alive = False
+            send_error_response(client_socket, 400, "X-Content-SHA256 must be 64 hex digits", request)
+            return None
+        # Answered before the body is read, so a client waiting on 100-continue
+        # never sends it. One that sends the body straight away has to be read
+        # to the end, or closing on the unread data could reset the connection
+        # before the response arrives; its upload is deduplicated on commit.
+        if expecting and file_store.link(filename, expected_hash):
+            file_index.update(filename)
+            request.keep_alive = False
+            send_stored_response(client_socket, request, filename)
+            return None
+
+    upload = file_store.upload(filename, MAX_FILE_SIZE, expected_hash)
+    if expecting:
+        client_socket.sendall(b"HTTP/1.1 100 Continue\r\n\r\n")
+    return upload
+
+def finish_upload(client_socket, request, upload):
+    try:
+        upload.commit()
+    except Exception as e:
+        # A bad hash gets 400; disk or manifest failures 500, and the temp file goes
+        print(f"[UPLOAD] Failed to store {upload.filename}: {e}")
+        return fail_upload(client_socket, request, upload, e)
+    filename = upload.filename
+    file_index.update(filename)
+    send_stored_response(client_socket, request, filename)
+    if request.method.upper() == "PUT":
+        print(f"[PUT] File saved: {filename}")
+        return 0
+    print(f"[UPLOAD] File saved as {filename}")
     return 1
 
+def fail_upload(client_socket, request, upload, error):
+    upload.abort()
+    request.keep_alive = False
+    if isinstance(error, UploadTooLarge):
+        send_too_large_response(client_socket, request)
+    elif isinstance(error, ValueError):
+        send_error_response(client_socket, 400, f"Malformed request body: {error}", request)
+    else:
+        send_error_response(client_socket, 500, f"Failed to save file: {error}", request)
+    return -1
+
+
+# -------------------- LIST HANDLER --------------------
+def handle_list(client_socket, request, raw_request):
+    # Query: offset, limit, prefix, sort (name|size|mtime, "-" prefix for descending)
+    _, query = split_path(request)
+    try:
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", [str(DEFAULT_LIST_LIMIT)])[0])
+        prefix = query.get("prefix", [""])[0]
+        sort = query.get("sort", ["name"])[0]
+        version = file_index.version
+        body = file_index.listing(offset=offset, limit=limit, prefix=prefix, sort=sort)
+    except ValueError as e:
+        send_error_response(client_socket, 400, f"Bad list query: {e}", request)
+        return -1
+    except Exception as e:
+        client_socket.sendall(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n")
+        print(f"[GET] Failed to list files: {e}")
+        return -1
+
+    # Compressed listings are reused until the index changes
+    cache_key = f"list:{version}:{offset}:{limit}:{sort}:{prefix}"
+    send_json_response(client_socket, body, request=request, cache_key=cache_key)
+    return 0
+
+# -------------------- DOWNLOAD HANDLER --------------------
+def handle_download(client_socket, request, raw_request):
+    filename = os.path.basename(split_path(request)[0])
+    # Stored files share one blob per content, so caches are keyed by it too
+    filepath, entry = file_store.resolve(filename) if filename else (None, None)
+    if filepath is not None:
+        send_file_response(client_socket, filepath, filename, request, entry)
+        return 0
+    client_socket.sendall(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+    return -1
+
+# -------------------- BLOB QUERY --------------------
+def handle_blob_query(client_socket, request, raw_request):
+    # GET /blobs/<sha256>: whether that content is stored, so a client can
+    # upload with X-Content-SHA256 and skip sending it
+    digest = os.path.basename(split_path(request)[0]).lower()
+    size = file_store.blob_size(digest)
+    if size < 0:
+        client_socket.sendall(
+            f"HTTP/1.1 404 Not Found\r\n{CORS_HEADERS}Content-Length: 0\r\n{connection_header(request)}\r\n".encode()
+        )
+        return -1
+    send_json_response(client_socket, {"sha256": digest, "size": size}, request=request)
+    return 0
+
+# -------------------- METRICS HANDLER --------------------
+def handle_metrics(client_socket, request, raw_request):
+    body = registry.render().encode()
+    original_size = len(body)
+    content_encoding = ""
+    encoding = compression.choose_encoding(get_header(request, "accept-encoding"), "text/plain", len(body))
+    if encoding:
+        encoded = compression.compress(body, encoding)
+        if encoded is not None and len(encoded) < len(body):
+            body = encoded
+            content_encoding = f"Content-Encoding: {encoding}\r\n"
+            compression.record(original_size, len(body))
+    header = (
+        "HTTP/1.1 200 OK\r\n"
+        "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+        "Cache-Control: no-store\r\n"
+        f"{content_encoding}"
+        f"Content-Length: {len(body)}\r\n"
+        f"{connection_header(request)}\r\n"
+    )
+    client_socket.sendall(header.encode() + body)
+    return 0
+
+# -------------------- REQUEST ROUTER --------------------
+def route_request(client_socket, request, raw_request, body_bytes):
+    """Dispatch one parsed request to its handler.
+
+    Shared by the threaded server in main.py and the event-loop server in
+    event_server.py, so both expose exactly the same routes.
+    """
+    method = request.method.upper()
+    path, _ = split_path(request)
+
+    if is_proxy_request(request):
+        if method not in PROXY_METHODS:
+            send_error_response(client_socket, 501, f"{method} is not forwarded", request)
+            return -1
+        if not proxy_allowed(proxy_target(request)[0]):
+            send_error_response(client_socket, 403, "Proxying to that host is not allowed", request)
+            return -1
+        if method in ("GET", "HEAD"):
+            return handle_get(client_socket, request, raw_request)
+        return handle_post(client_socket, request, body_bytes)
+
+    if method == "GET":
+        if path == "/list":
+            return handle_list(client_socket, request, raw_request)
+        if path == "/metrics":
+            return handle_metrics(client_socket, request, raw_request)
+        if path.startswith("/Files/"):
+            return handle_download(client_socket, request, raw_request)
+        if path.startswith("/blobs/"):
+            return handle_blob_query(client_socket, request, raw_request)
+        client_socket.sendall(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+        return -1
 
+    if method == "OPTIONS":
+        return handle_options(client_socket, request, raw_request)
 
+    client_socket.sendall(b"HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\n\r\n")
+    return -1
@@ -0,0 +1,75 @@
+import json
+import hashlib
+import threading
+from cache import Cache
+
+LLM_CACHE_SIZE = 64 * (1 << 20)  # 64 MB of replies
+LLM_CACHE_TTL = 3600  # seconds a reply may be served again
+
+
+def normalize_prompt(prompt: str) -> str:
+    # Differences in spacing alone shouldn't cost a generation
+    return " ".join(prompt.split())
+
+
+def cache_key(model: str, prompt: str, options: dict, context: list = None) -> str:
+    """Hash of everything that determines a reply."""
+    material = json.dumps(
+        {
+            "model": model,
+            "prompt": normalize_prompt(prompt),
+            "options": options,
+            "context": context or [],
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return "llm:" + hashlib.sha256(material.encode()).hexdigest()
+
+
+class LLMCache:
+    """Exact-match cache of finished generations, on top of cache.Cache.
+
+    Entries hold the reply text and the fields of Ollama's final chunk that
+    later turns depend on (context, token counts), so a hit can stand in
+    for the generation completely. Also tracks the GPU time hits saved,
+    from Ollama's total_duration of the original generation.
+    """
+
+    def __init__(self, max_size: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL):
+        self.cache = Cache(max_size=max_size)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.gpu_seconds_saved = 0.0
+        self.stores = 0
+
+    def get(self, key: str):
+        """Return (text, final) for key, or None."""
+        element = self.cache.cache_find(key)
+        if element is None:
+            return None
+        entry = json.loads(element.data)
+        with self.lock:
+            self.gpu_seconds_saved += entry["final"].get("total_duration", 0) / 1e9
+        return entry["text"], entry["final"]
+
+    def put(self, key: str, text: str, final: dict):
+        if not final.get("done"):
+            return
+        kept = {k: final[k] for k in ("context", "prompt_eval_count", "eval_count", "eval_duration", "total_duration") if k in final}
+        kept["done"] = True
+        data = json.dumps({"text": text, "final": kept}).encode()
+        if self.cache.cache_add(data, key, ttl=self.ttl):
+            with self.lock:
+                self.stores += 1
+
+    def stats(self) -> dict:
+        stats = self.cache.cache_stats()
+        with self.lock:
+            stats["stores"] = self.stores
+            stats["gpu_seconds_saved"] = round(self.gpu_seconds_saved, 3)
+        return stats
+
+
+#  Singleton instance
+llm_cache = LLMCache()
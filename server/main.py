@@ -1,152 +1,178 @@
-import os
 import socket
 import threading
-import sys
-import json
-from http_handler import handle_put, handle_file_upload, handle_options
-from proxy_parse import parse_http_request
+import argparse
+import time
+import http_handler
+from http_handler import (
+    route_request, wants_keep_alive, is_upload, begin_upload, finish_upload, fail_upload,
+    BodyTooLarge, check_body_size, send_body_too_large_response,
+    KEEPALIVE_TIMEOUT, MAX_KEEPALIVE_REQUESTS,
+    record_request, response_status, http_bytes_in, http_bytes_out, active_connections, slot_wait,
+)
+from proxy_parse import HttpRequestParser, body_decoder_for
 
 DEFAULT_PORT = 8000
 MAX_CLIENTS = 1000
 RECV_BUFFER = 4096
 SOCKET_TIMEOUT = 30  # seconds
-
-FILES_DIR = "./Files"
-os.makedirs(FILES_DIR, exist_ok=True)
+UPLOAD_CHUNK = 64 * 1024  # upload bodies are streamed to disk in pieces this size
 
 semaphore = threading.Semaphore(MAX_CLIENTS)
 thread_count_lock = threading.Lock()
 thread_counter = 0
 
-CORS_HEADERS = (
-    "Access-Control-Allow-Origin: *\r\n"
-    "Access-Control-Allow-Methods: GET, POST, PUT, OPTIONS\r\n"
-    "Access-Control-Allow-Headers: Content-Type, Authorization\r\n"
-)
+class MeteredSocket:
+    """Counts the bytes a connection moves and notes each response's status."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.status = None
+
+    def recv(self, size):
+        data = self.sock.recv(size)
+        http_bytes_in.inc(value=len(data))
+        return data
+
+    def sendall(self, data):
+        if self.status is None:
+            self.status = response_status(data)
+        self.sock.sendall(data)
+        http_bytes_out.inc(value=len(data))
+
+    def sendfile(self, file, offset=0, count=None):
+        sent = self.sock.sendfile(file, offset, count)
+        http_bytes_out.inc(value=sent)
+        return sent
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+def read_body(client_socket: socket.socket, data: bytearray, request) -> bytes:
+    """Read request's body, framed by Content-Length or chunked, and return it.
+
+    data is left holding whatever followed the body, i.e. the start of the
+    next pipelined request. Raises BodyTooLarge past MAX_BODY_SIZE.
+    """
+    check_body_size(request.content_length)
+    decoder = body_decoder_for(request)
+    body = bytearray(decoder.feed(bytes(data[request.body_offset:])))
+    while not decoder.done:
+        check_body_size(len(body))
+        chunk = client_socket.recv(RECV_BUFFER)
+        if not chunk:
+            # Closed mid-body: nothing after it can be framed
+            request.keep_alive = False
+            break
+        body += decoder.feed(chunk)
+    check_body_size(len(body))
+    data[:] = decoder.unused
+    return bytes(body)
+
+def receive_upload(client_socket: socket.socket, request, prefix: bytes) -> bytes:
+    """Stream a PUT/POST body from the socket to disk.
+
+    prefix holds body bytes that arrived with the headers. Returns whatever
+    followed the body, i.e. the start of the next pipelined request.
+    """
+    decoder = body_decoder_for(request)
+    upload = begin_upload(client_socket, request)
+    if upload is None:
+        return b""
 
-def send_json_response(client_socket, data, status=200):
-    body = json.dumps(data)
-    response = (
-        f"HTTP/1.1 {status} OK\r\n"
-        f"Content-Type: application/json\r\n"
-        f"{CORS_HEADERS}"
-        f"Content-Length: {len(body)}\r\n"
-        "Connection: close\r\n\r\n"
-        f"{body}"
-    )
-    client_socket.sendall(response.encode())
-
-def send_file_response(client_socket, filepath, filename):
     try:
-        with open(filepath, "rb") as f:
-            file_data = f.read()
-        header = (
-            "HTTP/1.1 200 OK\r\n"
-            f"{CORS_HEADERS}"
-            "Content-Type: application/octet-stream\r\n"
-            f"Content-Disposition: attachment; filename=\"{filename}\"\r\n"
-            f"Content-Length: {len(file_data)}\r\n"
-            "Connection: close\r\n\r\n"
-        )
-        client_socket.sendall(header.encode() + file_data)
-        print(f"[GET] Served file: {filename}")
+        upload.write(decoder.feed(prefix))
+        while not decoder.done:
+            chunk = client_socket.recv(UPLOAD_CHUNK)
+            if not chunk:
+                raise ConnectionError("client closed connection mid-upload")
+            upload.write(decoder.feed(chunk))
     except Exception as e:
-        client_socket.sendall(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n")
-        print(f"[GET] Failed to serve file {filename}: {e}")
+        print(f"[UPLOAD] Failed to receive {upload.filename}: {e}")
+        fail_upload(client_socket, request, upload, e)
+        return b""
+
+    finish_upload(client_socket, request, upload)
+    return decoder.unused
 
 def threaded_client_fn(client_socket: socket.socket, client_addr):
     global thread_counter
     acquired = False
+    client_socket = MeteredSocket(client_socket)
     try:
+        waited = time.perf_counter()
         semaphore.acquire()
         acquired = True
-        client_socket.settimeout(SOCKET_TIMEOUT)
+        slot_wait.observe(time.perf_counter() - waited)
+        active_connections.inc()
 
-        # Read HTTP request
+        # Bytes received but not yet consumed; pipelined requests wait here
         data = bytearray()
-        try:
-            while True:
-                chunk = client_socket.recv(RECV_BUFFER)
-                if not chunk:
-                    break
-                data.extend(chunk)
-                if b"\r\n\r\n" in data:
-                    break
-                if len(data) > 2_000_000:
-                    break
-        except Exception as e:
-            print(f"[THREAD {client_addr}] recv error: {e}")
-            client_socket.close()
-            return
-
-        if not data:
-            client_socket.close()
-            return
-
-        parsed, headers_bytes, body_bytes = parse_http_request(bytes(data))
-        if parsed is None:
-            client_socket.sendall(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
-            client_socket.close()
-            return
-
-        # Extract Content-Length from headers list
-        content_length = 0
-        for header in parsed.headers:
-            if header.lower().startswith("content-length:"):
-                content_length = int(header.split(":", 1)[1].strip())
+        parser = HttpRequestParser()
+        served = 0
+        while True:
+            # Read HTTP request headers, unless a pipelined one is already buffered
+            client_socket.settimeout(KEEPALIVE_TIMEOUT if served else SOCKET_TIMEOUT)
+            parsed = None
+            try:
+                parsed = parser.parse(data)
+                while parsed is None:
+                    chunk = client_socket.recv(RECV_BUFFER)
+                    if not chunk:
+                        break
+                    data.extend(chunk)
+                    client_socket.settimeout(SOCKET_TIMEOUT)
+                    parsed = parser.parse(data)
+            except socket.timeout:
+                if data:
+                    print(f"[THREAD {client_addr}] recv timed out mid-request")
+                # otherwise an idle keep-alive connection timed out between requests
                 break
-
-        already = len(body_bytes)
-        to_read = content_length - already
-        while to_read > 0:
-            chunk = client_socket.recv(min(RECV_BUFFER, to_read))
-            if not chunk:
+            except ValueError as e:
+                print(f"[THREAD {client_addr}] Bad request: {e}")
+                client_socket.sendall(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+                break
+            except Exception as e:
+                print(f"[THREAD {client_addr}] recv error: {e}")
                 break
-            body_bytes += chunk
-            to_read -= len(chunk)
 
-        raw_request = headers_bytes + b"\r\n\r\n" + body_bytes if headers_bytes else bytes(data)
-        method = parsed.method.upper()
-        print(f"[THREAD {client_addr}] Handling {method} for {parsed.path}")
+            if parsed is None:
+                # Closed before a complete request head arrived
+                break
 
-        # -------------------- GET --------------------
-        if method == "GET":
-            if parsed.path == "/list":
-                # Return JSON array of files
+            served += 1
+            parsed.keep_alive = served < MAX_KEEPALIVE_REQUESTS and wants_keep_alive(parsed)
+            method = parsed.method.upper()
+            print(f"[THREAD {client_addr}] Handling {method} for {parsed.path}")
+            started = time.perf_counter()
+            client_socket.status = None
+
+            if is_upload(parsed):
+                # Upload bodies go straight from the socket to disk
+                prefix = bytes(data[parsed.body_offset:])
+                data = bytearray(receive_upload(client_socket, parsed, prefix))
+            else:
+                # Anything past this request's body belongs to the next pipelined request
+                head = bytes(data[:parsed.body_offset])
                 try:
-                    files = [f for f in os.listdir(FILES_DIR) if os.path.isfile(os.path.join(FILES_DIR, f))]
-                    send_json_response(client_socket, files)
-                except Exception as e:
-                    client_socket.sendall(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n")
-                    print(f"[GET] Failed to list files: {e}")
-            elif parsed.path.startswith("/Files/"):
-                filename = os.path.basename(parsed.path)
-                filepath = os.path.join(FILES_DIR, filename)
-                if os.path.exists(filepath):
-                    send_file_response(client_socket, filepath, filename)
+                    body_bytes = read_body(client_socket, data, parsed)
+                except BodyTooLarge as e:
+                    print(f"[THREAD {client_addr}] {e}")
+                    send_body_too_large_response(client_socket, parsed)
                 else:
-                    client_socket.sendall(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
-            else:
-                client_socket.sendall(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
-
-        # -------------------- PUT --------------------
-        elif method == "PUT":
-            handle_put(client_socket, parsed, raw_request)
-
-        # -------------------- POST --------------------
-        elif method == "POST":
-            handle_file_upload(client_socket, parsed, body_bytes, len(body_bytes))
-
-        # -------------------- OPTIONS --------------------
-        elif method == "OPTIONS":
-            handle_options(client_socket, parsed, raw_request)
+                    raw_request = head + body_bytes
+                    route_request(client_socket, parsed, raw_request, body_bytes)
+            record_request(parsed, client_socket.status, time.perf_counter() - started)
 
-        else:
-            client_socket.sendall(b"HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\n\r\n")
+            # Handlers clear keep_alive when the response cannot be delimited
+            if not parsed.keep_alive:
+                break
 
     except Exception as e:
         print(f"[THREAD {client_addr}] Exception in handler: {e}")
-        client_socket.sendall(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n")
+        try:
+            client_socket.sendall(b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n")
+        except Exception:
+            pass
     finally:
         try:
             client_socket.close()
@@ -154,6 +180,7 @@ def threaded_client_fn(client_socket: socket.socket, client_addr):
             pass
         if acquired:
             semaphore.release()
+            active_connections.dec()
         with thread_count_lock:
             thread_counter += 1
         print(f"[THREAD {client_addr}] Connection closed")
@@ -203,15 +230,26 @@ def start_server(listen_host: str = "0.0.0.0", listen_port: int = DEFAULT_PORT):
 
 
 if __name__ == "__main__":
-    port = DEFAULT_PORT
-    if len(sys.argv) >= 2:
-        try:
-            port_arg = int(sys.argv[1])
-            if 1 <= port_arg <= 65535:
-                port = port_arg
-            else:
-                print("[MAIN] Invalid port number, using default 8080")
-        except ValueError:
-            print("[MAIN] Invalid port arg, using default 8080")
-
-    start_server(listen_port=port)
+    parser = argparse.ArgumentParser(description="Ananta file server")
+    parser.add_argument("port", nargs="?", type=int, default=DEFAULT_PORT)
+    # --threaded keeps the original thread-per-connection server for comparisons
+    parser.add_argument("--threaded", action="store_true", help="use one thread per connection")
+    parser.add_argument("--max-upload", type=int, default=http_handler.MAX_FILE_SIZE,
+                        help="largest accepted upload in bytes; bigger ones get 413")
+    parser.add_argument("--proxy-hosts", default=",".join(sorted(http_handler.PROXY_HOSTS)),
+                        help="comma-separated upstream hosts the forward proxy may reach, or * for any; "
+                             "empty (the default, or PROXY_HOSTS) disables it")
+    args = parser.parse_args()
+
+    port = args.port
+    if not 1 <= port <= 65535:
+        print(f"[MAIN] Invalid port number, using default {DEFAULT_PORT}")
+        port = DEFAULT_PORT
+    http_handler.MAX_FILE_SIZE = args.max_upload
+    http_handler.PROXY_HOSTS = {h.strip().lower() for h in args.proxy_hosts.split(",") if h.strip()}
+
+    if args.threaded:
+        start_server(listen_port=port)
+    else:
+        from event_server import start_event_server
+        start_event_server(listen_port=port)
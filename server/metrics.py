@@ -0,0 +1,189 @@
+import threading
+from bisect import bisect_left
+
+# Seconds; covers a cached 304 up to a long generation
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+MAX_LABEL_SETS = 500  # per metric; label values come from clients (methods, model names)
+OVERFLOW_LABEL = "other"
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, values: tuple) -> tuple:
+        # Called with the lock held. Past MAX_LABEL_SETS new label sets are
+        # folded together, so a client can't grow the scrape without bound
+        if values in self.values or len(self.values) < MAX_LABEL_SETS:
+            return values
+        return (OVERFLOW_LABEL,) * len(self.labels)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, value: float = 1):
+        with self.lock:
+            key = self._key(labels)
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> list:
+        with self.lock:
+            items = list(self.values.items())
+        lines = self.header()
+        for labels, value in items:
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, value: float = 1):
+        self.inc(*labels, value=-value)
+
+    def set(self, value: float, *labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Fixed buckets; observe() is a bisect and a few additions under a lock."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            key = self._key(labels)
+            entry = self.values.get(key)
+            if entry is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> list:
+        with self.lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        lines = self.header()
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = format_labels(self.labels, labels, f'le="{format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            plain = format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{plain} {format_value(total)}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+def from_stats(prefix: str, stats: dict, counters=(), labels: dict = None):
+    """Turn a component's stats() dict into collector samples.
+
+    Keys listed in counters are exported as prefix_key_total counters, other
+    numeric keys as prefix_key gauges; anything else is skipped.
+    """
+    labels = labels or {}
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if key in counters:
+            yield f"{prefix}_{key}_total", "counter", labels, value
+        else:
+            yield f"{prefix}_{key}", "gauge", labels, value
+
+
+class Registry:
+    """Metrics of one process, rendered in the Prometheus text format.
+
+    Counters, gauges and histograms are updated as things happen. Collectors
+    are called at scrape time instead, to export numbers components already
+    keep (cache and pool stats), so those cost nothing between scrapes. A
+    collector returns (name, kind, labels, value) samples; see from_stats().
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def _add(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels=()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels=()) -> Gauge:
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def collector(self, collect):
+        with self.lock:
+            self.collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics)
+            collectors = list(self.collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        # Samples of one name may come from several collectors (e.g. one per cache)
+        families = {}
+        for collect in collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                print(f"[METRICS] Collector {getattr(collect, '__name__', collect)} failed: {e}")
+                continue
+            for name, kind, labels, value in samples:
+                families.setdefault(name, (kind, []))[1].append((labels, value))
+        for name, (kind, samples) in families.items():
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(labels.keys(), labels.values())} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+#  Singleton instance
+registry = Registry()
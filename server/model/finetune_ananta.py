@@ -1,15 +1,21 @@
 import os
-import json
+import time
+import sys
+import argparse
 import torch
-from torch.utils.data import Dataset
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
     DataCollatorForLanguageModeling,
+    default_data_collator,
     Trainer,
+    TrainerCallback,
     TrainingArguments,
     set_seed,
-s)
+)
+from token_shards import prepare_shards, TokenShardDataset
+from packing import PackedDataset, BatchStats, LengthGroupedTrainer
+from lora import apply_lora, count_parameters, save_adapter, LORA_RANK, LORA_ALPHA, LORA_TARGETS
 
 BASE_MODEL = "HuggingFaceTB/llama3:8b--Instruct"
 DATASET_PATH = "dataset.jsonl"
@@ -21,79 +27,146 @@ BATCH_SIZE = 2
 GRAD_ACC_STEPS = 8
 WARMUP_STEPS = 50
 SEED = 42
+# Tokenized datasets, reused while the dataset, tokenizer and MAX_SEQ_LEN stay the same
+TOKEN_CACHE_DIR = "outputs/token_cache"
+# pad: batches padded to their longest example; bucket: batches of similar
+# lengths; pack: examples concatenated into full MAX_SEQ_LEN blocks
+BATCHING = "pad"
 
 
-def load_texts(p):
-    texts = []
-    f = open(p, "r", encoding="utf-8")
-    [
-        texts.append(json.loads(l)["text"].strip())
-        if p.endswith(".jsonl")
-        else texts.append(l.strip())
-        for l in f
-        if l.strip()
-    ]
-    f.close()
-    return texts
-
-
-def encode_texts(texts, tokenizer, max_len):
-    return [
-        {
-            "input_ids": e["input_ids"].squeeze(0),
-            "attention_mask": e["attention_mask"].squeeze(0),
-        }
-        for e in [
-            tokenizer(
-                t,
-                truncation=True,
-                max_length=max_len,
-                padding=False,
-                return_tensors="pt",
-            )
-            for t in texts
-        ]
-    ]
+def peak_rss():
+    """Peak resident memory of this process, e.g. "1234 MB", or "n/a"."""
+    try:
+        import resource  # Unix only
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is bytes on macOS, KiB elsewhere
+        return f"{peak / (1024 * 1024 if sys.platform == 'darwin' else 1024):.0f} MB"
+    try:
+        import psutil
+    except ImportError:
+        return "n/a"
+    memory = psutil.Process().memory_info()
+    # Windows reports the peak working set; elsewhere only the current RSS is known
+    return f"{getattr(memory, 'peak_wset', memory.rss) / (1024 * 1024):.0f} MB"
+
+
+class ResourceLogger(TrainerCallback):
+    """Prints the average optimizer step time and peak RSS at every logging step."""
+
+    def __init__(self):
+        self.started = None
+        self.seconds = 0.0
+        self.steps = 0
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self.started = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.seconds += time.perf_counter() - self.started
+        self.steps += 1
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if self.steps:
+            print(f"[TRAIN] step {state.global_step}: {self.seconds / self.steps:.3f} s/step, peak RSS {peak_rss()}")
+            self.seconds = 0.0
+            self.steps = 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fine-tune the Ananta model")
+    parser.add_argument("--base-model", default=BASE_MODEL)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--batching", choices=("pad", "bucket", "pack"), default=BATCHING)
+    parser.add_argument("--max-steps", type=int, default=-1, help="stop after this many optimizer steps, for quick comparisons")
+    parser.add_argument("--lora", action="store_true",
+                        help="train a low-rank adapter on a frozen model, with gradient checkpointing; saves only the adapter")
+    parser.add_argument("--lora-rank", type=int, default=LORA_RANK)
+    parser.add_argument("--bf16", action="store_true", help="compute in bf16, also on CPU; with --lora the frozen weights are loaded in bf16 too")
+    return parser.parse_args()
 
 
 def main():
+    opts = parse_args()
     set_seed(SEED)
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(opts.output_dir, exist_ok=True)
 
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
-    model = AutoModelForCausalLM.from_pretrained(BASE_MODEL)
+    tokenizer = AutoTokenizer.from_pretrained(opts.base_model)
+    # Frozen weights get no gradients or optimizer state, so bf16 copies are enough
+    dtype = torch.bfloat16 if opts.lora and opts.bf16 else torch.float32
+    model = AutoModelForCausalLM.from_pretrained(opts.base_model, dtype=dtype)
+    if opts.lora:
+        wrapped = apply_lora(model, rank=opts.lora_rank)
+        trainable, total = count_parameters(model)
+        print(f"[LORA] Adapting {len(wrapped)} layers: {trainable:,} of {total:,} parameters trainable")
 
-    texts = load_texts(DATASET_PATH)
-    data = [
-        {"input_ids": x["input_ids"], "attention_mask": x["attention_mask"]}
-        for x in encode_texts(texts, tokenizer, MAX_SEQ_LEN)
-    ]
+    shards = TokenShardDataset(prepare_shards(opts.dataset, tokenizer, MAX_SEQ_LEN, TOKEN_CACHE_DIR))
 
-    collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+    if opts.batching == "pack":
+        data = PackedDataset(shards, MAX_SEQ_LEN, tokenizer.pad_token_id or 0)
+        collator = BatchStats(default_data_collator)
+        # Example boundaries come from position_ids, which transformers only
+        # turns into a mask when there's no KV cache
+        model.config.use_cache = False
+    else:
+        data = shards
+        collator = BatchStats(DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False))
 
     args = TrainingArguments(
-        output_dir=OUTPUT_DIR,
+        output_dir=opts.output_dir,
         num_train_epochs=EPOCHS,
+        max_steps=opts.max_steps,
         per_device_train_batch_size=BATCH_SIZE,
         gradient_accumulation_steps=GRAD_ACC_STEPS,
         learning_rate=LR,
         warmup_steps=WARMUP_STEPS,
         logging_steps=10,
-        fp16=torch.cuda.is_available(),
+        fp16=torch.cuda.is_available() and not opts.bf16,
+        bf16=opts.bf16,
+        # transformers only accepts bf16 without a GPU when told it's running on CPU
+        use_cpu=opts.bf16 and not torch.cuda.is_available(),
+        gradient_checkpointing=opts.lora,
+        # Non-reentrant checkpointing works with the frozen embeddings' outputs
+        gradient_checkpointing_kwargs={"use_reentrant": False} if opts.lora else None,
+        # The adapter is saved at the end; checkpoints would hold the whole model
+        save_strategy="no" if opts.lora else "steps",
         report_to=[],
+        # BatchStats takes the extra num_tokens field off packed blocks itself
+        remove_unused_columns=False,
     )
 
-    trainer = Trainer(
+    trainer_class = Trainer
+    extra = {}
+    if opts.batching == "bucket":
+        trainer_class = LengthGroupedTrainer
+        extra["lengths"] = shards.lengths().tolist()
+
+    trainer = trainer_class(
         model=model,
         args=args,
         train_dataset=data,
         tokenizer=tokenizer,
         data_collator=collator,
+        callbacks=[ResourceLogger()],
+        **extra,
     )
 
-    trainer.train()
-    model.save_pretrained(OUTPUT_DIR)
-    tokenizer.save_pretrained(OUTPUT_DIR)
+    result = trainer.train()
+    stats = collator.report(result.metrics["train_runtime"])
+    print(
+        f"[TRAIN] batching={opts.batching} tokens/s={stats['tokens_per_s']} "
+        f"padding={stats['padding_ratio']:.1%} ({stats['real_tokens']} real of {stats['total_tokens']} tokens) "
+        f"peak RSS={peak_rss()}"
+    )
+    if opts.lora:
+        # Only the adapter; merge_adapter.py turns it into a standalone model
+        save_adapter(model, opts.output_dir, opts.base_model, rank=opts.lora_rank, alpha=LORA_ALPHA, targets=LORA_TARGETS)
+    else:
+        model.save_pretrained(opts.output_dir)
+    tokenizer.save_pretrained(opts.output_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+import os
+import json
+import math
+import torch
+from torch import nn
+from safetensors.torch import save_file, load_file
+from transformers.pytorch_utils import Conv1D
+
+LORA_RANK = 8
+LORA_ALPHA = 16
+LORA_DROPOUT = 0.05
+# Attention projections of Llama-style models (q/k/v/o_proj) and GPT-2 (c_attn)
+LORA_TARGETS = ("q_proj", "k_proj", "v_proj", "o_proj", "c_attn")
+ADAPTER_WEIGHTS = "adapter_model.safetensors"
+ADAPTER_CONFIG = "adapter_config.json"
+
+
+class LoRALayer(nn.Module):
+    """A frozen Linear (or GPT-2 Conv1D) plus a trainable low-rank update.
+
+    output = base(x) + dropout(x) @ A^T @ B^T * alpha / rank. B starts at
+    zero, so training begins from exactly the base model.
+    """
+
+    def __init__(self, base, rank=LORA_RANK, alpha=LORA_ALPHA, dropout=LORA_DROPOUT):
+        super().__init__()
+        if isinstance(base, Conv1D):
+            in_features, out_features = base.weight.shape
+        else:
+            in_features, out_features = base.in_features, base.out_features
+        self.base = base
+        self.scale = alpha / rank
+        self.dropout = nn.Dropout(dropout) if dropout else nn.Identity()
+        # Adapter weights stay fp32 even when the frozen base is loaded in bf16
+        self.lora_A = nn.Parameter(torch.empty(rank, in_features, device=base.weight.device))
+        self.lora_B = nn.Parameter(torch.zeros(out_features, rank, device=base.weight.device))
+        nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))
+
+    def forward(self, x):
+        out = self.base(x)
+        update = self.dropout(x).to(self.lora_A.dtype) @ self.lora_A.T @ self.lora_B.T
+        return out + (update * self.scale).to(out.dtype)
+
+    def merged(self):
+        """The base layer with the update folded into its weight."""
+        delta = (self.lora_B @ self.lora_A) * self.scale
+        if isinstance(self.base, Conv1D):
+            delta = delta.T  # Conv1D stores its weight as (in, out)
+        with torch.no_grad():
+            self.base.weight += delta.to(self.base.weight.dtype)
+        return self.base
+
+
+def apply_lora(model, rank=LORA_RANK, alpha=LORA_ALPHA, dropout=LORA_DROPOUT, targets=LORA_TARGETS):
+    """Freeze model and wrap every target layer in a LoRALayer; returns their names."""
+    for param in model.parameters():
+        param.requires_grad = False
+    wrapped = []
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if child_name in targets and isinstance(child, (nn.Linear, Conv1D)):
+                setattr(module, child_name, LoRALayer(child, rank, alpha, dropout))
+                wrapped.append(f"{name}.{child_name}" if name else child_name)
+    if not wrapped:
+        raise ValueError(f"no layers named {', '.join(targets)} to adapt")
+    return wrapped
+
+
+def count_parameters(model):
+    trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    return trainable, sum(p.numel() for p in model.parameters())
+
+
+def save_adapter(model, directory, base_model, rank=LORA_RANK, alpha=LORA_ALPHA, targets=LORA_TARGETS):
+    """Write only the adapter weights (and what's needed to rebuild them)."""
+    os.makedirs(directory, exist_ok=True)
+    weights = {name: param.detach().contiguous().cpu() for name, param in model.named_parameters() if "lora_" in name}
+    save_file(weights, os.path.join(directory, ADAPTER_WEIGHTS))
+    # A local base model is recorded by absolute path, so merging works from
+    # any directory; hub ids are kept as they are
+    if os.path.exists(base_model):
+        base_model = os.path.abspath(base_model)
+    with open(os.path.join(directory, ADAPTER_CONFIG), "w") as f:
+        json.dump({"base_model": base_model, "rank": rank, "alpha": alpha, "targets": list(targets)}, f, indent=2)
+
+
+def load_adapter_config(directory):
+    with open(os.path.join(directory, ADAPTER_CONFIG)) as f:
+        return json.load(f)
+
+
+def load_adapter(model, directory):
+    config = load_adapter_config(directory)
+    apply_lora(model, config["rank"], config["alpha"], 0.0, tuple(config["targets"]))
+    state = load_file(os.path.join(directory, ADAPTER_WEIGHTS))
+    result = model.load_state_dict(state, strict=False)
+    missing = [name for name in result.missing_keys if "lora_" in name]
+    if missing or result.unexpected_keys:
+        raise ValueError(f"adapter doesn't fit the model: missing {missing[:3]}, unexpected {result.unexpected_keys[:3]}")
+    return config
+
+
+def merge_lora(model):
+    """Replace every LoRALayer with its merged base layer, in place."""
+    for module in list(model.modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, LoRALayer):
+                setattr(module, child_name, child.merged())
+    return model
@@ -0,0 +1,36 @@
+"""Fold a LoRA adapter saved by finetune_ananta.py --lora into its base model.
+
+    python merge_adapter.py outputs/fine_tuned_model outputs/merged_model
+
+The result is a standalone model (and tokenizer) that loads with
+AutoModelForCausalLM.from_pretrained like any other, without lora.py.
+"""
+import argparse
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+from lora import load_adapter, load_adapter_config, merge_lora
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("adapter_dir", help="directory written by finetune_ananta.py --lora")
+    parser.add_argument("output_dir")
+    parser.add_argument("--base-model", help="base model to merge into (default: the one the adapter was trained on)")
+    parser.add_argument("--bf16", action="store_true", help="save the merged weights in bf16")
+    args = parser.parse_args()
+
+    base_model = args.base_model or load_adapter_config(args.adapter_dir)["base_model"]
+    # Merged in fp32 so the small updates aren't rounded away
+    model = AutoModelForCausalLM.from_pretrained(base_model, dtype=torch.float32)
+    load_adapter(model, args.adapter_dir)
+    merge_lora(model)
+    if args.bf16:
+        model = model.to(torch.bfloat16)
+
+    model.save_pretrained(args.output_dir)
+    AutoTokenizer.from_pretrained(args.adapter_dir).save_pretrained(args.output_dir)
+    print(f"[MERGE] {base_model} + {args.adapter_dir} -> {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import math
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from transformers import Trainer
+from transformers.trainer_pt_utils import LengthGroupedSampler
+
+
+class PackedDataset(Dataset):
+    """Fixed-size blocks cut from the concatenated examples of a TokenShardDataset.
+
+    Every block is block_size tokens long, so nothing is padded except the
+    tail of the last one. Each block carries position_ids that restart at
+    every example; with no attention_mask, transformers turns those into a
+    block-diagonal causal mask, so tokens never attend across examples.
+    The first token of each example gets no label, so the model isn't
+    trained to predict it from the previous example. An example cut at a
+    block edge continues in the next block with its positions carried on.
+    """
+
+    def __init__(self, shards, block_size, pad_token_id=0):
+        self.shards = shards
+        self.block_size = block_size
+        self.pad_token_id = pad_token_id
+        # Where each example starts in the concatenated token stream
+        self.starts = np.concatenate(([0], np.cumsum(shards.lengths())))
+        self.total_tokens = int(self.starts[-1])
+
+    def __len__(self):
+        return math.ceil(self.total_tokens / self.block_size)
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        begin = i * self.block_size
+        end = min(begin + self.block_size, self.total_tokens)
+        first = int(np.searchsorted(self.starts, begin, side="right")) - 1
+        last = int(np.searchsorted(self.starts, end, side="left"))
+        pieces = [self.shards.token_ids(j) for j in range(first, last)]
+        tokens = np.concatenate(pieces)[begin - self.starts[first]:end - self.starts[first]]
+
+        positions = np.empty(len(tokens), dtype=np.int64)
+        labels = tokens.copy()
+        for j in range(first, last):
+            lo = max(self.starts[j], begin) - begin
+            hi = min(self.starts[j + 1], end) - begin
+            positions[lo:hi] = np.arange(lo + begin - self.starts[j], hi + begin - self.starts[j])
+            if self.starts[j] >= begin:
+                labels[lo] = -100
+
+        real = len(tokens)
+        pad = self.block_size - real
+        if pad:
+            # The padding forms a sequence of its own (positions restart) with no labels
+            tokens = np.concatenate((tokens, np.full(pad, self.pad_token_id, dtype=np.int64)))
+            labels = np.concatenate((labels, np.full(pad, -100, dtype=np.int64)))
+            positions = np.concatenate((positions, np.arange(pad, dtype=np.int64)))
+        return {
+            "input_ids": torch.from_numpy(tokens),
+            "labels": torch.from_numpy(labels),
+            "position_ids": torch.from_numpy(positions),
+            "num_tokens": real,
+        }
+
+
+class BatchStats:
+    """Wraps a collator to count real and padding tokens in the batches it builds."""
+
+    def __init__(self, collator):
+        self.collator = collator
+        self.real_tokens = 0
+        self.total_tokens = 0
+
+    def __call__(self, features):
+        # Packed blocks say how many of their tokens are real; the model mustn't see that
+        counts = [f.pop("num_tokens") for f in features if "num_tokens" in f]
+        batch = self.collator(features)
+        real = sum(counts) if counts else int(batch["attention_mask"].sum())
+        self.real_tokens += real
+        self.total_tokens += batch["input_ids"].numel()
+        return batch
+
+    def report(self, seconds):
+        padding = 1 - self.real_tokens / self.total_tokens if self.total_tokens else 0.0
+        return {
+            "real_tokens": self.real_tokens,
+            "total_tokens": self.total_tokens,
+            "padding_ratio": round(padding, 4),
+            "tokens_per_s": round(self.real_tokens / seconds, 1) if seconds else None,
+        }
+
+
+class LengthGroupedTrainer(Trainer):
+    """Trainer whose batches hold examples of similar length.
+
+    Uses transformers' LengthGroupedSampler with lengths read from the shard
+    offsets, instead of letting it tokenize-and-measure every example.
+    """
+
+    def __init__(self, *args, lengths=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lengths = lengths
+
+    def _get_train_sampler(self, *args, **kwargs):
+        generator = torch.Generator()
+        generator.manual_seed(self.args.seed)
+        return LengthGroupedSampler(
+            self.args.train_batch_size * self.args.gradient_accumulation_steps,
+            lengths=self.lengths,
+            generator=generator,
+        )
@@ -0,0 +1,248 @@
+import os
+import json
+import shutil
+import hashlib
+from bisect import bisect_right
+from collections import deque
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+SHARD_FORMAT = 1  # bump when the on-disk layout changes
+SHARD_TOKENS = 64 * (1 << 20)  # tokens per shard file before starting the next one
+TOKENIZE_BATCH = 1000  # texts per tokenizer call / pool task
+TOKENIZE_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+
+
+def iter_texts(path):
+    """Yield training texts one at a time: the "text" field of each JSONL
+    line, or each non-empty line of a plain text file."""
+    is_jsonl = path.endswith(".jsonl")
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            yield json.loads(line)["text"].strip() if is_jsonl else line.strip()
+
+
+def iter_batches(texts, size):
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def tokenizer_fingerprint(tokenizer):
+    # The serialized fast tokenizer covers vocab, merges, normalizer and
+    # special tokens; slow ones fall back to their vocab
+    h = hashlib.sha256(type(tokenizer).__name__.encode())
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        h.update(backend.to_str().encode())
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode())
+    h.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def cache_dir_for(dataset_path, tokenizer, max_len, cache_root):
+    st = os.stat(dataset_path)
+    key = json.dumps({
+        "format": SHARD_FORMAT,
+        "dataset": os.path.abspath(dataset_path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "max_len": max_len,
+    }, sort_keys=True)
+    return os.path.join(cache_root, hashlib.sha256(key.encode()).hexdigest()[:16])
+
+
+# ---- pool workers ----
+_worker_tokenizer = None
+_worker_max_len = None
+
+
+def _init_worker(tokenizer, max_len):
+    global _worker_tokenizer, _worker_max_len
+    # The pool already uses every core; don't let each worker start its own threads
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    torch.set_num_threads(1)
+    _worker_tokenizer = tokenizer
+    _worker_max_len = max_len
+
+
+def _tokenize(texts):
+    ids = _worker_tokenizer(texts, truncation=True, max_length=_worker_max_len, padding=False)["input_ids"]
+    # Flat array plus lengths pickles far smaller than a list of lists
+    lengths = np.fromiter((len(x) for x in ids), dtype=np.int64, count=len(ids))
+    flat = np.fromiter(chain.from_iterable(ids), dtype=np.int64, count=int(lengths.sum()))
+    return flat, lengths
+
+
+class ShardWriter:
+    """Appends token ids to shard-NNNNN.bin files and their offsets to
+    shard-NNNNN.idx (example i is tokens[idx[i]:idx[i+1]])."""
+
+    def __init__(self, directory, dtype, shard_tokens=SHARD_TOKENS):
+        self.directory = directory
+        self.dtype = dtype
+        self.shard_tokens = shard_tokens
+        self.shards = []
+        self.file = None
+        self.offsets = None
+        self.examples = 0
+        self.tokens = 0
+
+    def _open(self):
+        name = f"shard-{len(self.shards):05d}"
+        self.file = open(os.path.join(self.directory, name + ".bin"), "wb")
+        self.offsets = [0]
+        self.shards.append({"name": name})
+
+    def _close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        name = self.shards[-1]["name"]
+        with open(os.path.join(self.directory, name + ".idx"), "wb") as f:
+            np.save(f, np.asarray(self.offsets, dtype=np.int64))
+        self.shards[-1].update(examples=len(self.offsets) - 1, tokens=self.offsets[-1])
+        self.file = None
+
+    def write(self, flat, lengths):
+        ends = np.cumsum(lengths)
+        done = 0
+        while done < len(lengths):
+            if self.file is None or self.offsets[-1] >= self.shard_tokens:
+                self._close()
+                self._open()
+            base = int(ends[done - 1]) if done else 0
+            # As many whole examples as fit in this shard, at least one
+            room = self.shard_tokens - self.offsets[-1]
+            stop = done + max(1, int(np.searchsorted(ends[done:] - base, room, side="right")))
+            flat[base:int(ends[stop - 1])].astype(self.dtype).tofile(self.file)
+            self.offsets.extend((self.offsets[-1] + ends[done:stop] - base).tolist())
+            done = stop
+        self.examples += len(lengths)
+        self.tokens += int(ends[-1]) if len(ends) else 0
+
+    def finish(self):
+        self._close()
+
+
+def prepare_shards(dataset_path, tokenizer, max_len, cache_root, workers=TOKENIZE_WORKERS, batch_size=TOKENIZE_BATCH,
+                   shard_tokens=SHARD_TOKENS):
+    """Tokenize dataset_path into memory-mapped shards and return their directory.
+
+    The JSONL is streamed and tokenized in batches across a process pool,
+    with only a few batches in flight, so memory stays flat whatever the
+    dataset size. The directory is keyed by the dataset file, the tokenizer
+    and max_len; when it is already complete nothing is tokenized.
+    """
+    directory = cache_dir_for(dataset_path, tokenizer, max_len, cache_root)
+    if os.path.exists(os.path.join(directory, "meta.json")):
+        print(f"[DATA] Reusing tokenized shards in {directory}")
+        return directory
+
+    # Built beside the final directory and renamed into place, so an
+    # interrupted run never leaves a half-written cache behind
+    building = directory + ".tmp"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    writer = ShardWriter(building, dtype, shard_tokens)
+
+    print(f"[DATA] Tokenizing {dataset_path} with {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tokenizer, max_len)) as pool:
+        pending = deque()
+        for batch in iter_batches(iter_texts(dataset_path), batch_size):
+            pending.append(pool.submit(_tokenize, batch))
+            # Results are written in submission order; bound what is queued
+            if len(pending) >= workers * 2:
+                writer.write(*pending.popleft().result())
+        while pending:
+            writer.write(*pending.popleft().result())
+    writer.finish()
+
+    meta = {
+        "format": SHARD_FORMAT,
+        "dtype": np.dtype(dtype).name,
+        "max_len": max_len,
+        "examples": writer.examples,
+        "tokens": writer.tokens,
+        "shards": writer.shards,
+    }
+    with open(os.path.join(building, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(building, directory)
+    print(f"[DATA] {writer.examples} examples, {writer.tokens} tokens in {len(writer.shards)} shard(s)")
+    return directory
+
+
+class TokenShardDataset(Dataset):
+    """Examples read lazily from the shards written by prepare_shards().
+
+    Token files and offsets are memory-mapped, so only the examples being
+    batched are paged in; the OS can drop the rest at any time.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.directory = directory
+        self.dtype = np.dtype(self.meta["dtype"])
+        self.shard_names = [s["name"] for s in self.meta["shards"]]
+        # Index of the first example of each shard
+        self.starts = np.cumsum([0] + [s["examples"] for s in self.meta["shards"]]).tolist()
+        self._tokens = {}
+        self._offsets = {}
+
+    def _shard(self, shard):
+        # Opened on first use, so each DataLoader worker maps its own view
+        if shard not in self._tokens:
+            name = os.path.join(self.directory, self.shard_names[shard])
+            offsets = np.load(name + ".idx", mmap_mode="r")
+            tokens = np.memmap(name + ".bin", dtype=self.dtype, mode="r") if offsets[-1] else np.zeros(0, self.dtype)
+            self._offsets[shard] = offsets
+            self._tokens[shard] = tokens
+        return self._tokens[shard], self._offsets[shard]
+
+    def _locate(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        shard = bisect_right(self.starts, i) - 1
+        return shard, i - self.starts[shard]
+
+    def lengths(self):
+        """Token count of every example, in order, straight from the offsets."""
+        if not self.shard_names:
+            return np.zeros(0, dtype=np.int32)
+        return np.concatenate([np.diff(self._shard(i)[1]).astype(np.int32) for i in range(len(self.shard_names))])
+
+    def length(self, i):
+        shard, j = self._locate(i)
+        _, offsets = self._shard(shard)
+        return int(offsets[j + 1] - offsets[j])
+
+    def token_ids(self, i):
+        shard, j = self._locate(i)
+        tokens, offsets = self._shard(shard)
+        return np.asarray(tokens[offsets[j]:offsets[j + 1]], dtype=np.int64)
+
+    def __len__(self):
+        return self.meta["examples"]
+
+    def __getitem__(self, i):
+        ids = torch.from_numpy(self.token_ids(i))
+        return {"input_ids": ids, "attention_mask": torch.ones_like(ids)}
@@ -0,0 +1,214 @@
+import asyncio
+import contextlib
+import json
+import time
+from urllib.parse import urlsplit
+from proxy_parse import parse_response_head, response_body_decoder
+
+CONNECT_TIMEOUT = 10  # seconds
+READ_TIMEOUT = 120  # seconds without a byte from Ollama before giving up
+IDLE_TIMEOUT = 30  # seconds an unused connection is kept
+MAX_IDLE = 16
+READ_CHUNK = 64 * 1024
+
+
+class OllamaError(Exception):
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        # HTTP status when Ollama answered with an error, None otherwise
+        self.status = status
+
+
+class Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+
+    def usable(self, idle_timeout: float) -> bool:
+        # EOF on an idle connection means Ollama closed it
+        return (
+            not self.reader.at_eof()
+            and not self.writer.is_closing()
+            and time.monotonic() - self.last_used < idle_timeout
+        )
+
+    def close(self):
+        self.writer.close()
+
+
+class OllamaClient:
+    """Non-blocking HTTP/1.1 client for one Ollama server, run on the event loop.
+
+    Connections are kept alive and reused across requests. stream() yields
+    the NDJSON objects of a streamed reply as each line arrives; closing it
+    early (or cancelling the task driving it) drops the connection, which
+    also makes Ollama stop generating.
+    """
+
+    def __init__(self, base_url: str, max_idle: int = MAX_IDLE, idle_timeout: float = IDLE_TIMEOUT):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle = []
+        self.in_flight = 0
+        self.connects = 0
+        self.reuses = 0
+
+    async def _acquire(self, timeout: float):
+        while self.idle:
+            conn = self.idle.pop()
+            if conn.usable(self.idle_timeout):
+                self.reuses += 1
+                return conn, True
+            conn.close()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, limit=READ_CHUNK), min(timeout, CONNECT_TIMEOUT)
+        )
+        self.connects += 1
+        return Connection(reader, writer), False
+
+    def _release(self, conn: Connection, reusable: bool):
+        if reusable and len(self.idle) < self.max_idle:
+            conn.last_used = time.monotonic()
+            self.idle.append(conn)
+        else:
+            conn.close()
+
+    def _request(self, method: str, path: str, body: bytes) -> bytes:
+        return (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            "Content-Type: application/json\r\n"
+            "Accept: application/x-ndjson\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: keep-alive\r\n\r\n"
+        ).encode() + body
+
+    async def stream(self, path: str, payload: dict = None, timeout: float = None, read_timeout: float = READ_TIMEOUT,
+                     method: str = "POST"):
+        """Send payload to path (POST by default) and yield each JSON line of the reply.
+
+        timeout bounds the whole request, read_timeout the wait for any
+        single read. Both raise asyncio.TimeoutError.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+
+        def remaining():
+            left = read_timeout if deadline is None else min(read_timeout, deadline - time.monotonic())
+            if left <= 0:
+                raise asyncio.TimeoutError()
+            return left
+
+        request = self._request(method, path, json.dumps(payload).encode() if payload is not None else b"")
+        self.in_flight += 1
+        conn = None
+        reusable = False
+        try:
+            # A kept-alive connection may have been closed by Ollama while idle;
+            # if it is reset or hits EOF before any response byte arrives,
+            # retry once on a new one. A timeout means Ollama is slow, not
+            # that the connection was stale: retrying would resubmit the
+            # generation. (asyncio.TimeoutError is an OSError on 3.11+.)
+            for attempt in range(2):
+                conn, reused = await self._acquire(remaining())
+                buffer = bytearray()
+                try:
+                    conn.writer.write(request)
+                    await conn.writer.drain()
+                    resp = None
+                    while resp is None:
+                        data = await asyncio.wait_for(conn.reader.read(READ_CHUNK), remaining())
+                        if not data:
+                            raise ConnectionResetError("connection closed before a response")
+                        buffer.extend(data)
+                        resp = parse_response_head(buffer)
+                    break
+                except asyncio.TimeoutError:
+                    conn.close()
+                    conn = None
+                    raise
+                except (ConnectionResetError, BrokenPipeError):
+                    conn.close()
+                    conn = None
+                    if not reused or attempt or buffer:
+                        raise
+
+            decoder = response_body_decoder(method, resp)
+            if resp.status != 200:
+                body = bytes(buffer[resp.body_offset:])
+                raise OllamaError(f"Ollama returned {resp.status} {resp.reason}: {body[:200].decode(errors='replace')}", resp.status)
+
+            pending = bytes(buffer[resp.body_offset:])
+            lines = bytearray()
+            while True:
+                lines += decoder.feed(pending) if decoder is not None else pending
+                # Yield each complete line as soon as it is in
+                while True:
+                    end = lines.find(b"\n")
+                    if end < 0:
+                        break
+                    line = bytes(lines[:end]).strip()
+                    del lines[:end + 1]
+                    if line:
+                        try:
+                            chunk = json.loads(line)
+                        except ValueError:
+                            continue
+                        yield chunk
+                if decoder is not None and decoder.done:
+                    break
+                pending = await asyncio.wait_for(conn.reader.read(READ_CHUNK), remaining())
+                if not pending:
+                    if decoder is not None:
+                        raise OllamaError("Ollama closed the connection mid-reply")
+                    break
+            tail = bytes(lines).strip()
+            if tail:
+                try:
+                    chunk = json.loads(tail)
+                except ValueError:
+                    chunk = None
+                if chunk is not None:
+                    yield chunk
+            reusable = decoder is not None and not decoder.unused and \
+                "close" not in resp.header_map.get("connection", "").lower()
+        finally:
+            # Reached early on cancellation, timeout or an abandoned generator:
+            # the reply wasn't read to the end, so the connection is dropped
+            self.in_flight -= 1
+            if conn is not None:
+                self._release(conn, reusable)
+
+    async def generate(self, payload: dict, timeout: float = None):
+        """Yield the chunks of a streamed /api/generate reply."""
+        async with contextlib.aclosing(self.stream("/api/generate", payload, timeout=timeout)) as chunks:
+            async for chunk in chunks:
+                if "error" in chunk:
+                    raise OllamaError(chunk["error"])
+                yield chunk
+
+    async def get_json(self, path: str, timeout: float = None):
+        """GET path and return its JSON body."""
+        result = None
+        # Read to the end so the connection can be reused
+        async with contextlib.aclosing(self.stream(path, timeout=timeout, method="GET")) as lines:
+            async for line in lines:
+                if result is None:
+                    result = line
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "connects": self.connects,
+            "reuses": self.reuses,
+            "idle": len(self.idle),
+            "in_flight": self.in_flight,
+        }
+
+    async def close(self):
+        idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
@@ -1,6 +1,7 @@
 import re
 
 MAX_HEADERS = 50
+FRAMING_HEADERS = ("content-length", "transfer-encoding")
 
 class ParsedRequest:
     def __init__(self):
@@ -13,33 +14,25 @@ class ParsedRequest:
         self.headers = []
         self.body = b""
         self.body_length = 0
+        self.keep_alive = False
+        # Request target as sent; absolute-form ("http://...") means a proxy request
+        self.url = None
+        # Filled in by HttpRequestParser
+        self.header_map = None
+        self.body_offset = 0
+        self.content_length = 0
 
-def parse_http_request(raw_data: bytes):
-    try:
-        decoded = raw_data.decode('iso-8859-1', errors='replace')
-    except:
-        return None, None, None
-
-    
-    parts = re.split(r'\r\n\r\n|\n\n', decoded, maxsplit=1)
-    header_part = parts[0]
-    body_part = parts[1] if len(parts) > 1 else b""
-    header_bytes = header_part.encode('iso-8859-1')
-    body_bytes = body_part.encode('iso-8859-1')
-
-    pr = ParsedRequest()
-
-    
-    lines = header_part.splitlines()
+def _fill_request(pr: ParsedRequest, lines) -> bool:
     if not lines:
-        return None, None, None
+        return False
 
     first_line = lines[0].strip()
     parts = first_line.split()
     if len(parts) < 3:
-        return None, None, None
+        return False
 
     pr.method, url, pr.version = parts[0], parts[1], parts[2]
+    pr.url = url
 
     
     if url.startswith("http://"):
@@ -76,17 +69,15 @@ def parse_http_request(raw_data: bytes):
 
  
     if not pr.host:
-        for h in pr.headers:
-            if h.lower().startswith("host:"):
-                val = h.split(":", 1)[1].strip()
-                if ":" in val:
-                    host_val, port_val = val.split(":", 1)
-                    pr.host = host_val.strip()
-                    pr.port = port_val.strip()
-                else:
-                    pr.host = val
-                    pr.port = pr.port or "8080"
-                break
+        val = get_header(pr, "host")
+        if val is not None:
+            if ":" in val:
+                host_val, port_val = val.split(":", 1)
+                pr.host = host_val.strip()
+                pr.port = port_val.strip()
+            else:
+                pr.host = val
+                pr.port = pr.port or "8080"
 
  
     if not pr.host:
@@ -95,6 +86,26 @@ def parse_http_request(raw_data: bytes):
         pr.port = "8080"
     if not pr.path:
         pr.path = "/"
+    return True
+
+def parse_http_request(raw_data: bytes):
+    try:
+        decoded = raw_data.decode('iso-8859-1', errors='replace')
+    except:
+        return None, None, None
+
+    
+    parts = re.split(r'\r\n\r\n|\n\n', decoded, maxsplit=1)
+    header_part = parts[0]
+    body_part = parts[1] if len(parts) > 1 else b""
+    header_bytes = header_part.encode('iso-8859-1')
+    body_bytes = body_part.encode('iso-8859-1')
+
+    pr = ParsedRequest()
+
+    
+    if not _fill_request(pr, header_part.splitlines()):
+        return None, None, None
 
     
     pr.body = body_bytes
@@ -103,6 +114,80 @@ def parse_http_request(raw_data: bytes):
     return pr, header_bytes, body_bytes
 
 
+class HttpRequestParser:
+    """Incremental parser for request heads arriving in a bytearray.
+
+    Call parse() after each recv with the connection's buffer. It returns
+    None until the blank line ending the headers has arrived, then a
+    ParsedRequest whose body_offset points at the first body byte in the
+    buffer. Only the header block is decoded; the body is never scanned,
+    copied or decoded. Already-scanned bytes are not searched again on the next call.
+    """
+
+    def __init__(self, max_header_bytes: int = 64 * 1024):
+        self.max_header_bytes = max_header_bytes
+        self._scanned = 0
+
+    def reset(self):
+        self._scanned = 0
+
+    def parse(self, buffer, start: int = 0):
+        # Back up 3 bytes so a terminator split across two recv()s is found,
+        # and never look further than a header block can reach (not into the body)
+        search_from = max(start, self._scanned - 3)
+        search_end = min(len(buffer), start + self.max_header_bytes + 4)
+        crlf = buffer.find(b"\r\n\r\n", search_from, search_end)
+        lf = buffer.find(b"\n\n", search_from, crlf + 2 if crlf >= 0 else search_end)
+        if crlf < 0 and lf < 0:
+            self._scanned = search_end
+            if len(buffer) - start > self.max_header_bytes:
+                raise ValueError("request headers too large")
+            return None
+
+        if lf < 0 or (0 <= crlf < lf):
+            head_end, body_offset = crlf, crlf + 4
+        else:
+            head_end, body_offset = lf, lf + 2
+        self._scanned = 0
+
+        lines = buffer[start:head_end].decode("iso-8859-1").splitlines()
+        # _fill_request keeps only the first MAX_HEADERS; a framing header
+        # past them would go unseen and its body be read as the next request
+        if len(lines) - 1 > MAX_HEADERS:
+            raise ValueError(f"more than {MAX_HEADERS} headers")
+
+        pr = ParsedRequest()
+        if not _fill_request(pr, lines):
+            raise ValueError("malformed request line")
+
+        header_map = {}
+        for h in pr.headers:
+            name, sep, value = h.partition(":")
+            if sep:
+                name, value = name.strip().lower(), value.strip()
+                # First occurrence wins, as with get_header(); conflicting
+                # framing headers would let a proxy in front see a different
+                # request boundary than we do
+                if name in FRAMING_HEADERS and header_map.get(name, value) != value:
+                    raise ValueError(f"conflicting {name} headers")
+                header_map.setdefault(name, value)
+        pr.header_map = header_map
+        pr.body_offset = body_offset
+
+        length = header_map.get("content-length")
+        transfer_encoding = header_map.get("transfer-encoding")
+        if transfer_encoding is not None:
+            if length is not None:
+                raise ValueError("both Transfer-Encoding and Content-Length")
+            if transfer_encoding.lower() != "chunked":
+                raise ValueError(f"unsupported Transfer-Encoding: {transfer_encoding!r}")
+        if length is not None:
+            if not length.isdigit():
+                raise ValueError(f"invalid Content-Length: {length!r}")
+            pr.content_length = int(length)
+        return pr
+
+
 def unparse_http_request(pr: ParsedRequest):
     if not pr.method or not pr.path or not pr.version:
         return b""
@@ -120,3 +205,148 @@ def unparse_http_request(pr: ParsedRequest):
         full = full.encode('iso-8859-1')
 
     return full
+
+
+def get_header(pr: ParsedRequest, name: str, default=None):
+    if pr.header_map is not None:
+        return pr.header_map.get(name.lower(), default)
+    prefix = name.lower() + ":"
+    for h in pr.headers:
+        if h.lower().startswith(prefix):
+            return h.split(":", 1)[1].strip()
+    return default
+
+
+class BodyDecoder:
+    """Incremental request-body framer for Content-Length and chunked bodies.
+
+    Raw socket bytes go in through feed(), which returns the body payload they
+    contained. Once done is set, unused holds any bytes past the end of the
+    body (the start of a pipelined request).
+    """
+
+    def __init__(self, content_length: int = 0, chunked: bool = False):
+        self.chunked = chunked
+        self.remaining = 0 if chunked else content_length
+        self.done = not chunked and content_length <= 0
+        self.unused = b""
+        self._buffer = bytearray()
+        self._state = "size"
+
+    def feed(self, data: bytes) -> bytes:
+        if self.done:
+            self.unused += data
+            return b""
+
+        if not self.chunked:
+            piece = data[:self.remaining]
+            self.remaining -= len(piece)
+            if self.remaining == 0:
+                self.done = True
+                self.unused = data[len(piece):]
+            return piece
+
+        self._buffer.extend(data)
+        out = bytearray()
+        while not self.done:
+            if self._state == "data":
+                if not self._buffer:
+                    break
+                take = min(self.remaining, len(self._buffer))
+                out += self._buffer[:take]
+                del self._buffer[:take]
+                self.remaining -= take
+                if self.remaining == 0:
+                    self._state = "data_end"
+                continue
+
+            end = self._buffer.find(b"\r\n")
+            if end < 0:
+                if len(self._buffer) > 8192:
+                    raise ValueError("chunk header too long")
+                break
+            line = bytes(self._buffer[:end])
+            del self._buffer[:end + 2]
+
+            if self._state == "size":
+                size_text = line.split(b";", 1)[0].strip()
+                try:
+                    size = int(size_text, 16)
+                except ValueError:
+                    raise ValueError(f"invalid chunk size: {size_text!r}")
+                if size < 0:
+                    raise ValueError("negative chunk size")
+                if size == 0:
+                    self._state = "trailer"
+                else:
+                    self.remaining = size
+                    self._state = "data"
+            elif self._state == "data_end":
+                if line:
+                    raise ValueError("missing CRLF after chunk data")
+                self._state = "size"
+            elif self._state == "trailer":
+                # Trailer headers are ignored; an empty line ends the body
+                if not line:
+                    self.done = True
+                    self.unused = bytes(self._buffer)
+                    self._buffer.clear()
+        return bytes(out)
+
+
+def body_decoder_for(pr: ParsedRequest) -> BodyDecoder:
+    transfer_encoding = (get_header(pr, "transfer-encoding") or "").lower()
+    if "chunked" in transfer_encoding:
+        return BodyDecoder(chunked=True)
+    return BodyDecoder(content_length=int(get_header(pr, "content-length", "0") or 0))
+
+
+class ParsedResponse:
+    def __init__(self):
+        self.version = None
+        self.status = 0
+        self.reason = ""
+        self.headers = []
+        self.header_map = {}
+        self.body_offset = 0
+
+
+def parse_response_head(buffer, max_header_bytes: int = 64 * 1024):
+    """Parse an upstream response head from the start of buffer.
+
+    Returns None until the blank line after the headers has arrived.
+    """
+    end = buffer.find(b"\r\n\r\n", 0, max_header_bytes + 4)
+    if end < 0:
+        if len(buffer) > max_header_bytes:
+            raise ValueError("response headers too large")
+        return None
+
+    lines = buffer[:end].decode("iso-8859-1").split("\r\n")
+    parts = lines[0].split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+        raise ValueError(f"malformed status line: {lines[0]!r}")
+
+    resp = ParsedResponse()
+    resp.version = parts[0]
+    resp.status = int(parts[1])
+    resp.reason = parts[2] if len(parts) > 2 else ""
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            resp.headers.append(line)
+            resp.header_map.setdefault(name.strip().lower(), value.strip())
+    resp.body_offset = end + 4
+    return resp
+
+
+def response_body_decoder(method: str, resp: ParsedResponse):
+    """Framing for an upstream response body, or None if it runs until close."""
+    if method.upper() == "HEAD" or resp.status in (204, 304) or 100 <= resp.status < 200:
+        return BodyDecoder(0)
+    if "chunked" in resp.header_map.get("transfer-encoding", "").lower():
+        return BodyDecoder(chunked=True)
+    length = resp.header_map.get("content-length")
+    if length is not None and length.isdigit():
+        return BodyDecoder(int(length))
+    return None
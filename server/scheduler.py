@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import deque
+
+DEFAULT_JOB_SECONDS = 10.0  # ETA guess until real jobs have been timed
+JOB_TIME_SMOOTHING = 0.2  # weight of the newest job in the running average
+
+
+class Job:
+    def __init__(self, key: str, run, notify=None):
+        self.key = key
+        self.run = run
+        self.notify = notify
+        self.future = asyncio.get_running_loop().create_future()
+        self.task = None
+        self.position = None
+
+
+class FairScheduler:
+    """Runs at most max_concurrent jobs, taking turns between clients.
+
+    Every client (key) has its own FIFO queue; free slots go to the queues
+    round-robin, so a client with many jobs waiting gets one slot per turn
+    like everyone else. Waiting jobs are told their position and an ETA
+    whenever it changes. A job whose caller is cancelled (e.g. the client
+    disconnected) is dropped from its queue or, if running, cancelled.
+    """
+
+    def __init__(self, max_concurrent: int = 2):
+        self.max_concurrent = max_concurrent
+        self.queues = {}
+        self.rotation = deque()  # keys with waiting jobs, in the order they will be served
+        self.running = set()
+        self.avg_seconds = None
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    async def run(self, key: str, run, notify=None):
+        """Queue run (an async callable) for key and return its result.
+
+        notify(position, eta_seconds) is called while the job waits.
+        """
+        job = Job(key, run, notify)
+        self.queues.setdefault(key, deque()).append(job)
+        if key not in self.rotation:
+            self.rotation.append(key)
+        self._dispatch()
+        self._notify_positions()
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            self._cancel(job)
+            raise
+
+    def _cancel(self, job: Job):
+        if job.task is not None:
+            job.task.cancel()
+            return
+        queue = self.queues.get(job.key)
+        if queue is not None and job in queue:
+            queue.remove(job)
+            if not queue:
+                del self.queues[job.key]
+                self.rotation.remove(job.key)
+            self.cancelled += 1
+            self._notify_positions()
+
+    def _dispatch(self):
+        while len(self.running) < self.max_concurrent and self.rotation:
+            key = self.rotation.popleft()
+            queue = self.queues[key]
+            job = queue.popleft()
+            if queue:
+                # Back of the line until every other client has had a turn
+                self.rotation.append(key)
+            else:
+                del self.queues[key]
+            job.task = asyncio.ensure_future(self._execute(job))
+            self.running.add(job.task)
+
+    async def _execute(self, job: Job):
+        started = time.monotonic()
+        try:
+            result = await job.run()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            if not job.future.done():
+                job.future.cancel()
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.completed += 1
+            elapsed = time.monotonic() - started
+            if self.avg_seconds is None:
+                self.avg_seconds = elapsed
+            else:
+                self.avg_seconds += JOB_TIME_SMOOTHING * (elapsed - self.avg_seconds)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.running.discard(job.task)
+            self._dispatch()
+            self._notify_positions()
+
+    def waiting_order(self):
+        """Waiting jobs in the order they will start."""
+        queues = [list(self.queues[key]) for key in self.rotation]
+        order = []
+        depth = 0
+        while True:
+            turn = [q[depth] for q in queues if depth < len(q)]
+            if not turn:
+                return order
+            order.extend(turn)
+            depth += 1
+
+    def _notify_positions(self):
+        for ahead, job in enumerate(self.waiting_order()):
+            position = ahead + 1
+            if job.notify is None or job.position == position:
+                continue
+            job.position = position
+            # Each running job frees a slot after about avg_seconds on average
+            eta = (ahead // self.max_concurrent + 1) * (self.avg_seconds or DEFAULT_JOB_SECONDS)
+            job.notify(position, round(eta, 1))
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self.running),
+            "queued": sum(len(q) for q in self.queues.values()),
+            "queued_clients": len(self.queues),
+            "max_concurrent": self.max_concurrent,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "avg_job_seconds": round(self.avg_seconds or 0.0, 2),
+        }
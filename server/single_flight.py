@@ -0,0 +1,108 @@
+import asyncio
+
+
+class Flight:
+    """One in-flight generation shared by every client that asked for it.
+
+    The producer task publish()es Ollama's chunks; each subscriber iterates
+    events() and gets every chunk from the start, however late it joined.
+    When the last subscriber leaves before the end, the producer task is
+    cancelled, which stops the generation upstream.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.notifiers = []
+        self.position = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: dict):
+        self.chunks.append(chunk)
+        self._wake()
+
+    def _wake(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def _finished(self, task: asyncio.Task):
+        self.done = True
+        if task.cancelled():
+            # Seen only by subscribers that outlived a cancelled job (e.g. shutdown)
+            self.error = RuntimeError("generation was cancelled")
+        elif task.exception() is not None:
+            self.error = task.exception()
+        self._wake()
+
+    def notify(self, position: int, eta: float):
+        # Queue updates for the shared job go to everyone waiting on it
+        self.position = (position, eta)
+        for notifier in list(self.notifiers):
+            notifier(position, eta)
+
+    async def events(self, notify=None):
+        self.subscribers += 1
+        if notify is not None:
+            self.notifiers.append(notify)
+            if self.position is not None and not self.chunks:
+                notify(*self.position)
+        try:
+            sent = 0
+            while True:
+                while sent < len(self.chunks):
+                    yield self.chunks[sent]
+                    sent += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if notify is not None:
+                self.notifiers.remove(notify)
+            if self.subscribers == 0 and not self.done:
+                self.task.cancel()
+
+
+class SingleFlight:
+    """Coalesces identical concurrent generations into one Flight per key."""
+
+    def __init__(self):
+        self.flights = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def join(self, key: str, produce):
+        """Return (flight, leader): the running flight for key, or a new one
+        driven by produce(flight), a coroutine function.
+
+        A key of None never coalesces.
+        """
+        flight = self.flights.get(key) if key else None
+        if flight is not None and not flight.done:
+            self.coalesced += 1
+            return flight, False
+
+        flight = Flight()
+        flight.task = asyncio.ensure_future(produce(flight))
+        flight.task.add_done_callback(flight._finished)
+        self.started += 1
+        if key:
+            self.flights[key] = flight
+
+            def forget(_):
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.task.add_done_callback(forget)
+        return flight, True
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.flights),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,116 @@
+import os
+import re
+import hashlib
+import mimetypes
+import compression
+from proxy_parse import get_header
+
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend")
+INDEX_FILE = "index.html"
+ASSET_PREFIX = "/static/"
+HASH_LENGTH = 12  # hex digits of sha256 in hashed asset names
+# Hashed names change whenever the content does, so they can be cached for good
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# Pages and unhashed names are revalidated (cheaply, with their ETag) every time
+REVALIDATE_CACHE = "no-cache"
+
+# src="..." / href="..." attributes in the page, for rewriting to hashed names
+ASSET_REFERENCE = re.compile(r'\b(src|href)="([^"]+)"')
+
+
+class Asset:
+    """One file held in memory with its validators."""
+
+    def __init__(self, body, content_type, cache_control):
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.etag = f'"{self.digest[:HASH_LENGTH]}"'
+
+
+class StaticAssets:
+    """The frontend, read once at startup and served from memory.
+
+    Every file under directory is served at /static/<name> and, for long
+    caching, at /static/<stem>.<hash><ext>. The page (/ or /index.html) is
+    rewritten to refer to the hashed names, so a browser fetches an asset
+    once per version and only revalidates the page itself.
+    """
+
+    def __init__(self, directory=FRONTEND_DIR):
+        self.directory = os.path.normpath(directory)
+        self.routes = {}
+        hashed_names = {}
+        for root, _, files in os.walk(self.directory):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                if relative == INDEX_FILE:
+                    continue
+                with open(path, "rb") as f:
+                    body = f.read()
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                self.routes[ASSET_PREFIX + relative] = Asset(body, content_type, REVALIDATE_CACHE)
+                stem, ext = os.path.splitext(relative)
+                hashed = Asset(body, content_type, IMMUTABLE_CACHE)
+                hashed_names[relative] = f"{ASSET_PREFIX}{stem}.{hashed.digest[:HASH_LENGTH]}{ext}"
+                self.routes[hashed_names[relative]] = hashed
+
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                page = f.read()
+
+            def rewrite(match):
+                target = hashed_names.get(match.group(2))
+                return f'{match.group(1)}="{target}"' if target else match.group(0)
+
+            index = Asset(ASSET_REFERENCE.sub(rewrite, page).encode(), "text/html; charset=utf-8", REVALIDATE_CACHE)
+            self.routes["/"] = index
+            self.routes["/" + INDEX_FILE] = index
+        print(f"[STATIC] Serving {len(hashed_names)} asset(s) from {self.directory}")
+
+    def match(self, request):
+        """The asset a GET/HEAD request asks for, or None for other routes."""
+        if request.method.upper() not in ("GET", "HEAD"):
+            return None
+        return self.routes.get(request.path.partition("?")[0])
+
+    def response(self, request, asset, connection_header):
+        """Complete response bytes for asset, honouring If-None-Match and Accept-Encoding."""
+        if_none_match = get_header(request, "if-none-match")
+        # Compressed variants carry the asset's ETag with an "-<encoding>" suffix
+        variant_prefix = asset.etag[:-1] + "-"
+        tags = [t.strip() for t in if_none_match.split(",")] if if_none_match else []
+        if any(t == asset.etag or t.startswith(variant_prefix) for t in tags):
+            return (
+                "HTTP/1.1 304 Not Modified\r\n"
+                f"ETag: {asset.etag}\r\n"
+                f"Cache-Control: {asset.cache_control}\r\n"
+                f"{connection_header}\r\n"
+            ).encode()
+
+        body = asset.body
+        etag = asset.etag
+        content_encoding = ""
+        encoding = compression.choose_encoding(get_header(request, "accept-encoding"), asset.content_type, len(body))
+        if encoding:
+            # Shares the compressed-variant cache with the file API
+            encoded = compression.get_variant(f"static:{asset.digest}:{encoding}", encoding, lambda: body)
+            if encoded is not None:
+                compression.record(len(body), len(encoded))
+                body = encoded
+                etag = f'{asset.etag[:-1]}-{encoding}"'
+                content_encoding = f"Content-Encoding: {encoding}\r\n"
+        header = (
+            "HTTP/1.1 200 OK\r\n"
+            f"Content-Type: {asset.content_type}\r\n"
+            f"Cache-Control: {asset.cache_control}\r\n"
+            f"ETag: {etag}\r\n"
+            "Vary: Accept-Encoding\r\n"
+            f"{content_encoding}"
+            f"Content-Length: {len(body)}\r\n"
+            f"{connection_header}\r\n"
+        ).encode()
+        return header if request.method.upper() == "HEAD" else header + body
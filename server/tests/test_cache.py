@@ -0,0 +1,20 @@
+from cache import Cache, MAX_ELEMENT_SIZE
+
+
+def test_element_larger_than_its_shard_is_rejected():
+    cache = Cache(max_size=64 * (1 << 20), shards=8)
+    assert cache.max_element_size == 8 * (1 << 20) < MAX_ELEMENT_SIZE
+    cache.cache_add(b"x" * 1024, "small")
+
+    assert not cache.cache_add(b"y" * (9 * (1 << 20)), "big")
+    assert cache.cache_find("big") is None
+    # Nothing was evicted to make room for it
+    assert cache.cache_find("small") is not None
+
+
+def test_shards_stay_within_budget():
+    cache = Cache(max_size=1 << 20, shards=4)
+    for i in range(200):
+        cache.cache_add(b"z" * 10_000, f"url-{i}")
+    assert all(shard.size <= shard.max_size for shard in cache.shards)
+    assert cache.cache_stats()["evictions"] > 0
@@ -0,0 +1,119 @@
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+import pytest
+
+from bench import stub_ollama
+from ollama_client import OllamaClient
+
+MODEL = "llama3:8b"
+
+
+def run_with_stub(scenario, **settings):
+    """Run scenario(client, stub) against an in-process stub Ollama."""
+    args = SimpleNamespace(tokens=5, ttft=0.0, token_delay=0.0, models=[MODEL], max_loaded=1, swap_delay=0.0)
+    vars(args).update(settings)
+    stub_ollama.stats.update(connections=0, requests=0, active=0, swaps=0)
+    stub_ollama.loaded[:] = [MODEL]
+
+    async def main():
+        stub = SimpleNamespace(writers=[], stats=stub_ollama.stats)
+
+        async def handle(reader, writer):
+            stub.writers.append(writer)
+            await stub_ollama.handle(reader, writer, args)
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = OllamaClient(f"http://127.0.0.1:{port}")
+        try:
+            await scenario(client, stub)
+        finally:
+            await client.close()
+            server.close()
+            for writer in stub.writers:
+                writer.transport.abort()
+
+    asyncio.run(main())
+
+
+async def collect(chunks):
+    async with contextlib.aclosing(chunks) as lines:
+        return [line async for line in lines]
+
+
+def test_reuses_connections():
+    async def scenario(client, stub):
+        for _ in range(3):
+            tags = await client.get_json("/api/tags")
+            assert tags["models"] == [{"name": MODEL}]
+        reply = await collect(client.generate({"model": MODEL, "prompt": "hi there"}))
+        assert "".join(c["response"] for c in reply) == "hi there hi there hi "
+        assert reply[-1]["done"]
+        assert (client.connects, client.reuses) == (1, 3)
+        assert stub.stats["connections"] == 1
+
+    run_with_stub(scenario)
+
+
+def test_retries_once_when_an_idle_connection_was_closed():
+    async def scenario(client, stub):
+        await client.get_json("/api/tags")
+        # Closed by the server while idle; the client can't tell until it sends
+        stub.writers[0].transport.abort()
+        tags = await client.get_json("/api/tags")
+        assert tags["models"] == [{"name": MODEL}]
+        assert (client.connects, client.reuses) == (2, 1)
+        assert stub.stats["requests"] == 2
+
+    run_with_stub(scenario)
+
+
+def test_does_not_resend_when_the_response_head_times_out():
+    async def scenario(client, stub):
+        await client.get_json("/api/tags")
+        # A model that isn't loaded holds the response head back for swap_delay
+        with pytest.raises(asyncio.TimeoutError):
+            await collect(client.stream("/api/generate", {"model": "other", "prompt": "hi"}, read_timeout=0.2))
+        assert stub.stats["requests"] == 2
+        assert client.connects == 1
+        assert client.idle == [] and client.in_flight == 0
+
+    run_with_stub(scenario, swap_delay=1.0)
+
+
+def test_closing_mid_stream_drops_the_connection():
+    async def scenario(client, stub):
+        async with contextlib.aclosing(client.generate({"model": MODEL, "prompt": "hi"})) as chunks:
+            async for chunk in chunks:
+                break
+        assert client.idle == [] and client.in_flight == 0
+
+        await asyncio.sleep(0.1)
+        assert stub.stats["active"] == 0
+        await client.get_json("/api/tags")
+        assert client.connects == 2
+
+    run_with_stub(scenario, tokens=100, token_delay=0.01)
+
+
+def test_cancelling_mid_stream_drops_the_connection():
+    async def scenario(client, stub):
+        first = asyncio.Event()
+
+        async def consume():
+            async for _ in client.generate({"model": MODEL, "prompt": "hi"}):
+                first.set()
+
+        task = asyncio.create_task(consume())
+        await first.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert client.idle == [] and client.in_flight == 0
+
+        await asyncio.sleep(0.1)
+        assert stub.stats["active"] == 0
+
+    run_with_stub(scenario, tokens=100, token_delay=0.01)
@@ -0,0 +1,165 @@
+import random
+
+import pytest
+
+from proxy_parse import HttpRequestParser, MAX_HEADERS, body_decoder_for, parse_http_request
+
+FIELDS = ("method", "protocol", "host", "port", "path", "version", "headers")
+METHODS = ("GET", "PUT", "POST", "OPTIONS", "DELETE", "get", "X-CUSTOM")
+HEADER_NAMES = ("Host", "host", "HOST", "Content-Type", "Accept", "User-Agent", "X-Long", "Connection", "Range")
+
+
+def random_token(rng, alphabet="abcdefghijklmnopqrstuvwxyz0123456789-._~%", lo=1, hi=12):
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(lo, hi)))
+
+
+def random_request(rng):
+    method = rng.choice(METHODS)
+    path = "/" + "/".join(random_token(rng) for _ in range(rng.randint(0, 4)))
+    if rng.random() < 0.3:
+        host = random_token(rng) + (f":{rng.randint(1, 65535)}" if rng.random() < 0.5 else "")
+        path = f"http://{host}{path if rng.random() < 0.8 else ''}"
+    if rng.random() < 0.2:
+        path += "?" + random_token(rng)
+    version = rng.choice(("HTTP/1.1", "HTTP/1.0"))
+    eol = "\r\n" if rng.random() < 0.9 else "\n"
+
+    lines = [f"{method}{' ' * rng.randint(1, 2)}{path} {version}"]
+    if rng.random() < 0.05:
+        lines[0] = f"{method} {path}"  # malformed request line
+    for _ in range(rng.randint(0, 12)):
+        name = rng.choice(HEADER_NAMES)
+        value = random_token(rng, hi=40) if name != "Host" else random_token(rng) + ":" + str(rng.randint(1, 9999))
+        lines.append(f"{name}:{' ' * rng.randint(0, 2)}{value}")
+
+    body = rng.randbytes(rng.choice((0, 0, 1, 17, 300, 5000)))
+    head = eol.join(lines) + eol + eol
+    return head.encode("iso-8859-1") + body
+
+
+def compare(raw, rng):
+    """Return None if both parsers agree on raw, else a description of the mismatch."""
+    legacy, _, legacy_body = parse_http_request(raw)
+
+    # Feed the request in random-sized pieces, as recv() would deliver it
+    parser = HttpRequestParser()
+    buf = bytearray()
+    parsed = None
+    pos = 0
+    try:
+        while pos < len(raw) and parsed is None:
+            step = rng.randint(1, 64)
+            buf.extend(raw[pos:pos + step])
+            pos += step
+            parsed = parser.parse(buf)
+    except ValueError:
+        return None if legacy is None else f"new parser rejected a request the old one accepted: {raw[:80]!r}"
+
+    if legacy is None:
+        return f"new parser accepted a request the old one rejected: {raw[:80]!r}"
+    if parsed is None:
+        return f"new parser never completed: {raw[:80]!r}"
+
+    buf.extend(raw[pos:])
+    for field in FIELDS:
+        if getattr(legacy, field) != getattr(parsed, field):
+            return f"{field}: {getattr(legacy, field)!r} != {getattr(parsed, field)!r}"
+    if bytes(buf[parsed.body_offset:]) != legacy_body:
+        return "body bytes differ"
+    return None
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_agrees_with_legacy_parser(seed):
+    # Differential fuzz: the incremental parser must read every generated
+    # request exactly as parse_http_request does, however it is split
+    rng = random.Random(seed)
+    for i in range(2000):
+        problem = compare(random_request(rng), rng)
+        assert problem is None, f"case {i}: {problem}"
+
+
+def parse(raw):
+    return HttpRequestParser().parse(bytearray(raw))
+
+
+def test_waits_for_the_end_of_the_head():
+    parser = HttpRequestParser()
+    buf = bytearray(b"GET /list HTTP/1.1\r\nHost: x\r\n")
+    assert parser.parse(buf) is None
+    buf.extend(b"\r\n")
+    assert parser.parse(buf).path == "/list"
+
+
+@pytest.mark.parametrize("headers", [
+    b"Transfer-Encoding: chunked\r\nContent-Length: 5\r\n",
+    b"Content-Length: 5\r\nTransfer-Encoding: chunked\r\n",
+    b"Content-Length: 0\r\nContent-Length: 5\r\n",
+    b"Transfer-Encoding: chunked\r\nTransfer-Encoding: identity\r\n",
+    b"Transfer-Encoding: gzip, chunked\r\n",
+    b"Transfer-Encoding: identity\r\n",
+    b"Content-Length: -1\r\n",
+    b"Content-Length: 5x\r\n",
+])
+def test_rejects_ambiguous_framing(headers):
+    with pytest.raises(ValueError):
+        parse(b"POST /p HTTP/1.1\r\nHost: x\r\n" + headers + b"\r\n")
+
+
+def test_accepts_repeated_identical_content_length():
+    assert parse(b"POST /p HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\ncontent-length: 3\r\n\r\nabc").content_length == 3
+
+
+def test_rejects_too_many_headers():
+    # Headers past the cap would be dropped, framing ones included
+    extra = b"".join(b"X-%d: y\r\n" % i for i in range(MAX_HEADERS))
+    with pytest.raises(ValueError):
+        parse(b"GET /list HTTP/1.1\r\nHost: x\r\n" + extra + b"Content-Length: 4\r\n\r\nGET ")
+
+    allowed = b"".join(b"X-%d: y\r\n" % i for i in range(MAX_HEADERS - 1))
+    assert len(parse(b"GET /list HTTP/1.1\r\nHost: x\r\n" + allowed + b"\r\n").headers) == MAX_HEADERS
+
+
+def read_pipeline(raw, step):
+    """Parse and decode every request in raw, fed step bytes at a time."""
+    parser = HttpRequestParser()
+    buf = bytearray()
+    requests = []
+    pos = 0
+    while pos < len(raw) or buf:
+        parsed = parser.parse(buf)
+        while parsed is None and pos < len(raw):
+            buf.extend(raw[pos:pos + step])
+            pos += step
+            parsed = parser.parse(buf)
+        if parsed is None:
+            break
+        decoder = body_decoder_for(parsed)
+        body = decoder.feed(bytes(buf[parsed.body_offset:]))
+        while not decoder.done:
+            body += decoder.feed(raw[pos:pos + step])
+            pos += step
+        buf = bytearray(decoder.unused)
+        requests.append((parsed.method, parsed.path, body))
+    return requests
+
+
+@pytest.mark.parametrize("step", [1, 7, 4096])
+def test_pipelined_requests_after_a_chunked_body(step):
+    raw = (
+        b"GET /list HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+        b"4\r\nGET \r\n6;ext=1\r\n/nope \r\n0\r\nTrailer: t\r\n\r\n"
+        b"POST /p HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\n\r\nabc"
+        b"GET /last HTTP/1.1\r\nHost: x\r\n\r\n"
+    )
+    assert read_pipeline(raw, step) == [
+        ("GET", "/list", b"GET /nope "),
+        ("POST", "/p", b"abc"),
+        ("GET", "/last", b""),
+    ]
+
+
+def test_rejects_bad_chunk_size():
+    decoder = body_decoder_for(parse(b"POST /p HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"))
+    with pytest.raises(ValueError):
+        decoder.feed(b"zz\r\n")
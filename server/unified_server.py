@@ -0,0 +1,112 @@
+"""The file API, WebSocket chat and the frontend from one process on one port.
+
+    python unified_server.py [port]
+
+Runs the event-loop file server (event_server.py) with two additions:
+requests asking for a WebSocket upgrade are handed to the chat server's
+handler, and the frontend is served from memory at / and /static/. Both
+servers' metrics, caches and client-slot limit are shared, and /metrics
+reports all of them.
+"""
+import asyncio
+import argparse
+from websockets.asyncio.server import Server, ServerConnection
+from websockets.extensions.permessage_deflate import enable_server_permessage_deflate
+from websockets.server import ServerProtocol
+import http_handler
+import event_server
+from proxy_parse import get_header
+from static_assets import StaticAssets, FRONTEND_DIR
+from websocket_server import ws_handler, ollama, OLLAMA_BACKENDS
+
+DEFAULT_PORT = 8000
+
+
+class WebSocketGateway:
+    """Turns upgrade requests on the HTTP port into chat connections.
+
+    The connection's transport is switched over to a websockets
+    ServerConnection and the request head, already read by the HTTP
+    server, is replayed into it; websockets then answers the handshake and
+    runs ws_handler exactly as websocket_server.py's own server would.
+    """
+
+    def __init__(self, handler):
+        # Tracks the connections and runs handler on each, without listening itself
+        self.server = Server(handler)
+
+    def attach(self, server: asyncio.Server):
+        # websockets checks the listening server during handshakes
+        self.server.wrap(server)
+
+    def accepts(self, request):
+        upgrade = (get_header(request, "upgrade") or "").lower()
+        return request.method.upper() == "GET" and upgrade == "websocket"
+
+    async def take_over(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, head: bytes):
+        """Run the WebSocket connection to completion on writer's transport.
+
+        head is what the HTTP server has read so far; frames the client sent
+        with or right after the handshake may still sit in reader's buffer,
+        and go to the WebSocket connection after it.
+        """
+        transport = writer.transport
+        # StreamReader has no call that returns its buffer without waiting
+        head += bytes(reader._buffer)
+        reader._buffer.clear()
+        # Same defaults as websockets.serve(), permessage-deflate included
+        protocol = ServerProtocol(extensions=enable_server_permessage_deflate(None))
+        connection = ServerConnection(protocol, self.server)
+        transport.set_protocol(connection)
+        try:
+            connection.connection_made(transport)
+            connection.data_received(head)
+            # The reader may have paused the transport with a full buffer
+            transport.resume_reading()
+        except Exception:
+            transport.abort()
+            raise
+        await connection.wait_closed()
+
+
+async def serve(listen_host: str = "0.0.0.0", listen_port: int = DEFAULT_PORT, frontend: str = FRONTEND_DIR):
+    assets = StaticAssets(frontend)
+    gateway = WebSocketGateway(ws_handler)
+    ollama.start()
+    print(f"[MAIN] Frontend at http://{listen_host}:{listen_port}/, chat at ws://{listen_host}:{listen_port}/ws")
+    print(f"[WS] Ollama backends: {', '.join(OLLAMA_BACKENDS)}")
+    await event_server.serve(listen_host, listen_port, websocket=gateway, assets=assets)
+
+
+def start_unified_server(listen_host: str = "0.0.0.0", listen_port: int = DEFAULT_PORT, frontend: str = FRONTEND_DIR):
+    try:
+        asyncio.run(serve(listen_host, listen_port, frontend))
+    except KeyboardInterrupt:
+        print("\n[MAIN] Shutting down due to KeyboardInterrupt")
+    except OSError as e:
+        print(f"[MAIN] Failed to bind/listen on {listen_host}:{listen_port} -> {e}")
+    finally:
+        event_server.disk_pool.shutdown(wait=False)
+        event_server.proxy_pool.shutdown(wait=False)
+        print("[MAIN] Server closed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ananta file, chat and frontend server")
+    parser.add_argument("port", nargs="?", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-upload", type=int, default=http_handler.MAX_FILE_SIZE,
+                        help="largest accepted upload in bytes; bigger ones get 413")
+    parser.add_argument("--proxy-hosts", default=",".join(sorted(http_handler.PROXY_HOSTS)),
+                        help="comma-separated upstream hosts the forward proxy may reach, or * for any; "
+                             "empty (the default, or PROXY_HOSTS) disables it")
+    parser.add_argument("--frontend", default=FRONTEND_DIR, help="directory of the frontend to serve")
+    args = parser.parse_args()
+
+    port = args.port
+    if not 1 <= port <= 65535:
+        print(f"[MAIN] Invalid port number, using default {DEFAULT_PORT}")
+        port = DEFAULT_PORT
+    http_handler.MAX_FILE_SIZE = args.max_upload
+    http_handler.PROXY_HOSTS = {h.strip().lower() for h in args.proxy_hosts.split(",") if h.strip()}
+
+    start_unified_server(listen_port=port, frontend=args.frontend)
@@ -0,0 +1,103 @@
+import time
+import select
+import socket
+import threading
+from collections import deque
+
+CONNECT_TIMEOUT = 10  # seconds
+IO_TIMEOUT = 30  # seconds
+IDLE_TIMEOUT = 30  # seconds an unused upstream connection is kept
+MAX_IDLE_PER_HOST = 8
+
+
+class UpstreamPool:
+    """Keep-alive connections to upstream servers, keyed by (host, port).
+
+    acquire() hands out an idle connection when one passes a health check
+    (not readable: an idle socket with pending data or EOF has been closed
+    or poisoned by the server), otherwise it opens a new one. release()
+    parks a connection for reuse when its last response was fully read.
+    Connections idle for longer than IDLE_TIMEOUT are closed.
+    """
+
+    def __init__(self, max_idle_per_host: int = MAX_IDLE_PER_HOST, idle_timeout: float = IDLE_TIMEOUT):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.reuses = 0
+        self.idle_evictions = 0
+        self.health_failures = 0
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = []
+        with self.lock:
+            for key in list(self.idle):
+                conns = self.idle[key]
+                while conns and conns[0][1] < cutoff:
+                    expired.append(conns.popleft()[0])
+                if not conns:
+                    del self.idle[key]
+            self.idle_evictions += len(expired)
+        for sock in expired:
+            sock.close()
+
+    @staticmethod
+    def healthy(sock: socket.socket) -> bool:
+        try:
+            readable, _, errored = select.select([sock], [], [sock], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable and not errored
+
+    def acquire(self, host: str, port: int):
+        """Return (socket, reused) for host:port."""
+        self.evict_idle()
+        key = (host, port)
+        while True:
+            with self.lock:
+                conns = self.idle.get(key)
+                # Most recently used first: the likeliest to still be open
+                sock = conns.pop()[0] if conns else None
+            if sock is None:
+                break
+            if self.healthy(sock):
+                # The last relay may have shortened it towards its deadline
+                sock.settimeout(IO_TIMEOUT)
+                with self.lock:
+                    self.reuses += 1
+                return sock, True
+            with self.lock:
+                self.health_failures += 1
+            sock.close()
+
+        sock = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
+        sock.settimeout(IO_TIMEOUT)
+        with self.lock:
+            self.connects += 1
+        return sock, False
+
+    def release(self, host: str, port: int, sock: socket.socket, reusable: bool):
+        if reusable:
+            with self.lock:
+                conns = self.idle.setdefault((host, port), deque())
+                if len(conns) < self.max_idle_per_host:
+                    conns.append((sock, time.monotonic()))
+                    return
+        sock.close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "connects": self.connects,
+                "reuses": self.reuses,
+                "idle_evictions": self.idle_evictions,
+                "health_failures": self.health_failures,
+                "idle": sum(len(c) for c in self.idle.values()),
+            }
+
+
+#  Singleton instance
+upstream_pool = UpstreamPool()
@@ -1,85 +1,379 @@
 import asyncio
+import contextlib
 import json
+import os
+import time
 import traceback
-from typing import Dict
-import requests
 import websockets
+from http import HTTPStatus
+from backend_router import BackendRouter
+from scheduler import FairScheduler
+from chat_context import ChatContext
+from llm_cache import llm_cache, cache_key
+from single_flight import SingleFlight
+from history_store import HistoryStore, HISTORY_DB, valid_session_id
+from metrics import registry, from_stats
 
-OLLAMA_API_URL = "http://192.168.250.200:11434/api/generate" 
+OLLAMA_API_URL = os.environ.get("OLLAMA_API_URL", "http://192.168.250.200:11434/api/generate")
+# Comma-separated Ollama servers to spread generations over
+OLLAMA_BACKENDS = [url.strip() for url in os.environ.get("OLLAMA_BACKENDS", OLLAMA_API_URL).split(",") if url.strip()]
 
 WS_HOST = "0.0.0.0"   
 WS_PORT = 8765
 
 OLLAMA_TIMEOUT = 300
 
-# Store history per client
-client_histories: Dict[str, list] = {}
+# Generations allowed to run against each Ollama server at once; the rest wait their turn
+OLLAMA_CONCURRENCY = int(os.environ.get("OLLAMA_CONCURRENCY", "2"))
+MAX_CONCURRENT_GENERATIONS = OLLAMA_CONCURRENCY * len(OLLAMA_BACKENDS)
 
-async def call_ollama(prompt: str, model: str = "llama3:8b") -> str:
+# Model context window, and the part of it kept for the reply. History is
+# trimmed to fit the rest (chat_context.ChatContext)
+NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "1024"))
+NUM_PREDICT = int(os.environ.get("OLLAMA_NUM_PREDICT", "100"))
+# Fold turns that slide out of the window into a rolling summary (costs an extra generation)
+CONTEXT_SUMMARIES = os.environ.get("CONTEXT_SUMMARIES", "0") == "1"
+
+# Shared by all chat connections; picks a backend per generation and keeps
+# its connections to each one alive. A backend with the model loaded is
+# preferred until it has a full share of the generations
+ollama = BackendRouter(OLLAMA_BACKENDS, warm_limit=OLLAMA_CONCURRENCY)
+
+# Round-robin between client IPs, so several tabs or scripts from one
+# user still get a single turn each round
+scheduler = FairScheduler(MAX_CONCURRENT_GENERATIONS)
+
+# Identical prompts that arrive while one is generating share its output
+flights = SingleFlight()
+
+def new_history() -> ChatContext:
+    return ChatContext(NUM_CTX - NUM_PREDICT, summaries=CONTEXT_SUMMARIES)
+
+# Chat history per client session id, the recently active ones in memory and all on disk
+history_store = HistoryStore(os.environ.get("CHAT_HISTORY_DB", HISTORY_DB), new_history)
+
+# Streamed replies are sent in pieces of at least this many characters, or
+# whatever has arrived once this long has passed since the last frame
+STREAM_COALESCE_CHARS = 64
+STREAM_COALESCE_SECONDS = 0.05
+
+# Ollama only reads model parameters from "options"
+GENERATION_OPTIONS = {
+    "num_predict": NUM_PREDICT,
+    "num_ctx": NUM_CTX,
+    "temperature": 0.5,
+}
+
+# Recorded once per upstream generation, however many clients share it
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500)
+ws_connections = registry.gauge("ananta_ws_active_connections", "Open chat connections")
+replies = registry.counter("ananta_llm_replies_total", "Replies sent, by where they came from", ("source",))
+generations = registry.counter("ananta_llm_generations_total", "Generations run against Ollama", ("model", "outcome"))
+queue_wait = registry.histogram("ananta_llm_queue_wait_seconds", "Time a generation waited for a scheduler slot", ("model",))
+first_token = registry.histogram("ananta_llm_time_to_first_token_seconds", "Time from a generation's start to its first token", ("model",))
+generation_time = registry.histogram("ananta_llm_generation_seconds", "Time a generation took, from its start to the last token", ("model",))
+token_rate = registry.histogram("ananta_llm_tokens_per_second", "Decode speed reported by Ollama", ("model",), buckets=TOKEN_RATE_BUCKETS)
+
+@registry.collector
+def collect_chat_server():
+    yield from from_stats("ananta_cache", llm_cache.stats(),
+                          counters={"hits", "misses", "evictions", "expirations", "bytes_served", "bytes_evicted", "stores", "gpu_seconds_saved"},
+                          labels={"cache": "llm"})
+    yield from from_stats("ananta_scheduler", scheduler.stats(), counters={"completed", "cancelled", "failed"})
+    yield from from_stats("ananta_coalescing", flights.stats(), counters={"started", "coalesced"})
+    yield from from_stats("ananta_history", history_store.stats(), counters={"loads", "evictions", "writes", "batches", "failed_batches"})
+    for backend in ollama.backends:
+        labels = {"backend": backend.url}
+        yield "ananta_backend_healthy", "gauge", labels, int(backend.healthy)
+        yield "ananta_backend_loaded_models", "gauge", labels, len(backend.models)
+        yield from from_stats("ananta_backend", backend.stats(), counters={"requests", "failures"}, labels=labels)
+        yield from from_stats("ananta_backend_connection", backend.client.stats(), counters={"connects", "reuses"}, labels=labels)
+
+def metrics_endpoint(connection, request):
+    # Plain HTTP GET /metrics on the WebSocket port; everything else upgrades as usual
+    if request.path.split("?")[0] == "/metrics":
+        return connection.respond(HTTPStatus.OK, registry.render())
+    return None
+
+def ollama_payload(prompt: str, model: str, context: list = None) -> dict:
     payload = {
         "model": model,
         "prompt": prompt,
-        "stream": True,       
-        "max_tokens": 100,    
-        "num_ctx": 1024,      
-        "temperature": 0.5   
+        "stream": True,
+        "options": dict(GENERATION_OPTIONS),
     }
+    if context:
+        # Token ids of the conversation so far, as returned with the last reply
+        payload["context"] = context
+    return payload
 
-    def sync_request():
-        with requests.post(OLLAMA_API_URL, json=payload, stream=True, timeout=OLLAMA_TIMEOUT) as r:
-            r.raise_for_status()
+def stream_ollama(prompt: str, model: str = "llama3:8b", context: list = None):
+    """Async iterator over Ollama's NDJSON chunks (dicts) as they arrive.
 
-            full_output = ""
-            for line in r.iter_lines(decode_unicode=True):
-                if not line:
-                    continue
-                try:
-                    chunk = json.loads(line)
-                    text_piece = chunk.get("response") or chunk.get("text") or ""
-                    full_output += text_piece
-                except Exception:
-                    pass
-            return full_output.strip()
+    Close it (contextlib.aclosing) when stopping early so the connection
+    to Ollama is dropped and generation stops.
+    """
+    return ollama.generate(ollama_payload(prompt, model, context), timeout=OLLAMA_TIMEOUT)
+
+async def collect_reply(chunks):
+    """Return the whole reply and Ollama's final chunk (token counts, context)."""
+    full_output = ""
+    final = {}
+    async with contextlib.aclosing(chunks):
+        async for chunk in chunks:
+            full_output += chunk.get("response") or chunk.get("text") or ""
+            if chunk.get("done"):
+                final = chunk
+    return full_output.strip(), final
+
+async def generate_text(prompt: str, model: str = "llama3:8b", context: list = None):
+    return await collect_reply(stream_ollama(prompt, model, context))
+
+async def call_ollama(prompt: str, model: str = "llama3:8b") -> str:
+    return (await generate_text(prompt, model))[0]
+
+def stream_stats(started: float, first_at: float, frames: int, final: dict) -> dict:
+    now = time.perf_counter()
+    stats = {
+        "ttft_ms": round((first_at - started) * 1000, 1) if first_at else None,
+        "total_ms": round((now - started) * 1000, 1),
+        "frames": frames,
+    }
+    # Ollama reports token counts and durations (ns) on its final chunk
+    if final.get("eval_count"):
+        stats["tokens"] = final["eval_count"]
+        if final.get("eval_duration"):
+            stats["tokens_per_s"] = round(final["eval_count"] / (final["eval_duration"] / 1e9), 1)
+    if final.get("prompt_eval_count"):
+        stats["prompt_tokens"] = final["prompt_eval_count"]
+    return stats
+
+async def stream_reply(ws, chunks, extra_stats: dict = None):
+    """Forward Ollama chunks as {"type": "chunk"} frames, then a {"type": "done"} frame.
+
+    Tokens are coalesced so a fast model doesn't cost one WebSocket frame per
+    token; the first piece always goes out immediately. Returns the reply
+    and Ollama's final chunk.
+    """
+    started = time.perf_counter()
+    first_at = None
+    last_sent = 0.0
+    frames = 0
+    pending = ""
+    full_output = ""
+    final = {}
 
-    return await asyncio.to_thread(sync_request)
+    # aclosing: a client that disconnects mid-reply lets go of the generation too
+    async with contextlib.aclosing(chunks):
+        async for chunk in chunks:
+            piece = chunk.get("response") or chunk.get("text") or ""
+            if chunk.get("done"):
+                final = chunk
+            if not piece:
+                continue
+            if first_at is None:
+                first_at = time.perf_counter()
+            pending += piece
+            full_output += piece
+            now = time.perf_counter()
+            if len(pending) >= STREAM_COALESCE_CHARS or now - last_sent >= STREAM_COALESCE_SECONDS:
+                await ws.send(json.dumps({"type": "chunk", "text": pending}))
+                frames += 1
+                pending = ""
+                last_sent = now
+
+    if pending:
+        await ws.send(json.dumps({"type": "chunk", "text": pending}))
+        frames += 1
+    stats = stream_stats(started, first_at, frames, final)
+    stats.update(extra_stats or {})
+    await ws.send(json.dumps({"type": "done", "done": True, "stats": stats}))
+    return full_output.strip(), final
+
+async def replay_reply(ws, text: str, final: dict, extra_stats: dict = None):
+    """Send a cached reply with the same chunk/done frames as a live one."""
+    started = time.perf_counter()
+    frames = 0
+    for i in range(0, len(text), STREAM_COALESCE_CHARS):
+        await ws.send(json.dumps({"type": "chunk", "text": text[i:i + STREAM_COALESCE_CHARS]}))
+        frames += 1
+    stats = stream_stats(started, started if text else None, frames, final)
+    stats.update(extra_stats or {})
+    await ws.send(json.dumps({"type": "done", "done": True, "stats": stats}))
+
+class ClientGone(Exception):
+    pass
+
+async def unless_closed(ws, coro):
+    """Await coro, cancelling it if the client disconnects first."""
+    job = asyncio.ensure_future(coro)
+    closed = asyncio.ensure_future(ws.wait_closed())
+    try:
+        await asyncio.wait({job, closed}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        job.cancel()
+        raise
+    finally:
+        closed.cancel()
+    if not job.done():
+        # Queued jobs leave the queue, running ones stop generating
+        job.cancel()
+        raise ClientGone()
+    return job.result()
+
+def queue_notifier(ws):
+    def notify(position: int, eta: float):
+        async def send():
+            try:
+                await ws.send(json.dumps({"type": "queued", "position": position, "eta_s": eta}))
+            except Exception:
+                pass
+        asyncio.ensure_future(send())
+    return notify
 
 async def ws_handler(ws):
     client_id = f"{ws.remote_address}"
+    client_ip = ws.remote_address[0] if ws.remote_address else client_id
     print(f"[WS] Connection from {client_id}")
+    ws_connections.inc()
 
-    # Initialize history for this client
-    if client_id not in client_histories:
-        client_histories[client_id] = []
+    # Clients without a session id get history for this connection only
+    connection_history = new_history()
 
     try:
         async for message in ws:
             try:
                 data = json.loads(message)
+                if isinstance(data, dict) and data.get("type") == "stats":
+                    await ws.send(json.dumps({
+                        "type": "stats",
+                        "llm_cache": llm_cache.stats(),
+                        "scheduler": scheduler.stats(),
+                        "coalescing": flights.stats(),
+                        "history": history_store.stats(),
+                        "backends": ollama.stats(),
+                    }))
+                    continue
                 if isinstance(data, dict) and "message" in data:
                     prompt = data["message"]
                     model = data.get("model", "llama3:8b")
+                    # Opt-in: older clients keep getting a single {"response": ...}
+                    stream = bool(data.get("stream"))
+                    # "cache": false forces a fresh generation
+                    use_cache = data.get("cache", True) is not False
+                    # Stable id chosen by the client, so history survives reconnects
+                    session_id = data.get("session") if valid_session_id(data.get("session")) else None
                 else:
                     prompt = str(data)
                     model = "llama3:8b"
+                    stream = False
+                    use_cache = True
+                    session_id = None
             except json.JSONDecodeError:
                 prompt = message
                 model = "llama3:8b"
+                stream = False
+                use_cache = True
+                session_id = None
 
-            # Add user prompt to history
-            client_histories[client_id].append({"role": "user", "content": prompt})
             print(f"[WS] Prompt from {client_id}: {prompt[:100]}")
 
             try:
-                # Combine history into a single prompt for Ollama
-                full_prompt = "\n".join([f"{entry['role']}: {entry['content']}" for entry in client_histories[client_id]])
-                ai_text = await call_ollama(full_prompt, model=model)
-                if not isinstance(ai_text, str):
-                    ai_text = str(ai_text)
- 
-                client_histories[client_id].append({"role": "ai", "content": ai_text})
+                history = await history_store.get(session_id) if session_id else connection_history
+
+                def remember(role, content):
+                    if session_id:
+                        history_store.append(session_id, role, content)
+
+                # Add user prompt to history; history sends only what the
+                # token budget allows, reusing Ollama's context when it can
+                turn = history.prepare(prompt, model)
+                remember("user", prompt)
+                info = {
+                    "context_reused": turn["context_reused"],
+                    "prompt_tokens_est": turn["prompt_tokens_est"],
+                }
+
+                # Identical prompt, history and parameters: replay the earlier reply
+                # without queueing for the GPU, unless the client asked for a fresh one
+                key = cache_key(model, turn["prompt"], GENERATION_OPTIONS, turn["context"]) if use_cache else None
+                cached = llm_cache.get(key) if key else None
+                if cached is not None:
+                    replies.inc("cached")
+                    ai_text, final = cached
+                    history.record_reply(ai_text, final)
+                    remember("ai", ai_text)
+                    print(f"[LLM-CACHE] Hit for {client_id}, saved {final.get('total_duration', 0) / 1e9:.2f} GPU-s")
+                    if stream:
+                        await replay_reply(ws, ai_text, final, dict(info, cached=True))
+                        continue
+                    await ws.send(json.dumps({"response": ai_text}))
+                    continue
+
+                async def produce(flight):
+                    # One generation per key however many clients subscribe; it
+                    # takes a scheduler slot under the client that started it
+                    queued_at = time.perf_counter()
+
+                    async def run():
+                        started = time.perf_counter()
+                        queue_wait.observe(started - queued_at, model)
+                        outcome = "error"
+                        try:
+                            async with contextlib.aclosing(stream_ollama(turn["prompt"], model, turn["context"])) as chunks:
+                                async for chunk in chunks:
+                                    if not flight.chunks:
+                                        first_token.observe(time.perf_counter() - started, model)
+                                    flight.publish(chunk)
+                            outcome = "ok"
+                        except asyncio.CancelledError:
+                            outcome = "cancelled"
+                            raise
+                        finally:
+                            generations.inc(model, outcome)
+                        generation_time.observe(time.perf_counter() - started, model)
+                        final = flight.chunks[-1] if flight.chunks else {}
+                        if final.get("eval_count") and final.get("eval_duration"):
+                            token_rate.observe(final["eval_count"] / (final["eval_duration"] / 1e9), model)
+
+                    await scheduler.run(client_ip, run, flight.notify)
+                    if key and flight.chunks:
+                        text = "".join(c.get("response") or c.get("text") or "" for c in flight.chunks)
+                        llm_cache.put(key, text.strip(), flight.chunks[-1])
+
+                # The same prompt already generating for someone else: share it
+                flight, leader = flights.join(key, produce)
+                replies.inc("generated" if leader else "coalesced")
+                if not leader:
+                    print(f"[COALESCE] {client_id} joined an in-flight generation")
+
+                # Queue updates are part of the streaming protocol; old clients only get the reply
+                chunks = flight.events(queue_notifier(ws) if stream else None)
+                if stream:
+                    reply = stream_reply(ws, chunks, info if leader else dict(info, coalesced=True))
+                else:
+                    reply = collect_reply(chunks)
+                ai_text, final = await unless_closed(ws, reply)
+                history.record_reply(ai_text, final)
+                remember("ai", ai_text)
+                print(
+                    f"[CTX] {client_id}: prompt_tokens={final.get('prompt_eval_count')} "
+                    f"est={info['prompt_tokens_est']} context_reused={info['context_reused']}"
+                )
+                if history.unsummarized:
+                    summary, _ = await unless_closed(
+                        ws, scheduler.run(client_ip, lambda: generate_text(history.summary_prompt(), model))
+                    )
+                    history.set_summary(summary)
+                    if session_id:
+                        history_store.set_summary(session_id, history.summary)
+                if stream:
+                    continue
 
                 resp = {"response": ai_text}
 
+            except (websockets.ConnectionClosed, ClientGone):
+                raise
             except Exception as e:
                 traceback.print_exc()
                 resp = {"error": "Failed to call Ollama", "detail": str(e)}
@@ -92,15 +386,20 @@ async def ws_handler(ws):
 
     except websockets.ConnectionClosed:
         pass
+    except ClientGone:
+        print(f"[WS] {client_id} left mid-generation, cancelled")
     except Exception:
         traceback.print_exc()
     finally:
+        ws_connections.dec()
         print(f"[WS] Connection closed: {client_id}")
 
 def start_ws_server_forever(host: str = WS_HOST, port: int = WS_PORT):
     async def runner():
-        server = await websockets.serve(ws_handler, host, port)
-        print(f"[WS] WebSocket server listening on ws://{host}:{port}")
+        server = await websockets.serve(ws_handler, host, port, process_request=metrics_endpoint)
+        ollama.start()
+        print(f"[WS] WebSocket server listening on ws://{host}:{port} (metrics at http://{host}:{port}/metrics)")
+        print(f"[WS] Ollama backends: {', '.join(OLLAMA_BACKENDS)}")
         await server.wait_closed()
 
     loop = asyncio.new_event_loop()